@@ -0,0 +1,199 @@
+"""HTTP API for programmatic keyword extraction.
+
+Run with:  uvicorn api:app --host 0.0.0.0 --port 8000
+"""
+import os
+import json
+import uuid
+import asyncio
+import tempfile
+import shutil
+from typing import List, Optional
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from web_scrape import extract_article_links, fetch_page
+from pipeline import fetch_site, analyze_site, triage_job, FETCH_TIME_SHARE
+from cancellation import CancelToken, Cancelled, cancellation_scope
+from ngram_index import get_ngram_index
+from telemetry import get_telemetry
+from profiling import run_profiled
+
+# Requests beyond this many in flight wait up to API_QUEUE_TIMEOUT seconds
+# for a slot and are then rejected with 429
+API_MAX_CONCURRENCY = int(os.environ.get("API_MAX_CONCURRENCY", 8))
+API_QUEUE_TIMEOUT = float(os.environ.get("API_QUEUE_TIMEOUT", 10))
+
+DEFAULT_PROMPT = """Puedes responder en español o en inglés, dependiendo del idioma principal del contenido de los documentos PDF proporcionados.
+
+Analiza los documentos PDF como si fueran páginas web optimizadas para SEO. Identifica los temas centrales y extrae entre 5 y 10 palabras clave de cola larga o frases de búsqueda relevantes, naturales y específicas del nicho.
+
+Adicionalmente, extrae una lista de palabras clave orientadas a campañas de Paid Media (Google Ads, Meta, etc.), con intención de compra, comparativa o solución.
+
+La respuesta debe considerar el análisis global de todos los documentos proporcionados."""
+
+app = FastAPI(title="Keyword Extractor API")
+_slots = None
+
+def get_slots():
+    # Created lazily so the semaphore binds to the server's event loop
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(API_MAX_CONCURRENCY)
+    return _slots
+
+async def acquire_slot():
+    try:
+        await asyncio.wait_for(get_slots().acquire(), timeout=API_QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=429, detail="Too many concurrent requests, retry later")
+
+class UrlRequest(BaseModel):
+    url: str
+
+class KeywordRequest(BaseModel):
+    url: str
+    prompt: Optional[str] = None
+    max_articles: int = 10
+    article_indexes: Optional[List[int]] = None
+    incremental: bool = False
+    adaptive: bool = False
+    digest: bool = False
+    # Seconds the whole request may take; the result is partial if it runs out
+    deadline: Optional[float] = None
+    # Profile the fetch and the analysis together; the result lists the saved artifacts
+    profile: bool = False
+
+class TriageRequest(BaseModel):
+    urls: List[str]
+    max_articles: int = 20
+    gemini: bool = False
+    prompt: Optional[str] = None
+
+@app.get("/health")
+async def health():
+    return {"status": "ok", "max_concurrency": API_MAX_CONCURRENCY}
+
+@app.post("/links")
+async def links(request: UrlRequest):
+    await acquire_slot()
+    try:
+        return {"url": request.url, "links": await asyncio.to_thread(extract_article_links, request.url)}
+    finally:
+        get_slots().release()
+
+@app.post("/content")
+async def content(request: UrlRequest):
+    await acquire_slot()
+    try:
+        return await asyncio.to_thread(fetch_page, request.url)
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=f"Error fetching {request.url}: {e}")
+    finally:
+        get_slots().release()
+
+@app.post("/triage")
+async def triage(request: TriageRequest):
+    """Keyword candidates for many sites from their declared metadata only.
+
+    Only each main page and the <head> of its top articles are read; with
+    gemini, the metadata is also sent to Gemini with the prompt.
+    """
+    await acquire_slot()
+    try:
+        return await asyncio.to_thread(triage_job, lambda *args, **kwargs: None, request.prompt or DEFAULT_PROMPT,
+                                       list(dict.fromkeys(request.urls)), request.max_articles, request.gemini)
+    finally:
+        get_slots().release()
+
+@app.get("/index/phrases")
+async def index_phrases(min_sites: int = 2, min_words: int = 2, limit: int = 50):
+    """Phrases found on at least min_sites of the sites fetched so far"""
+    index = get_ngram_index()
+    phrases = await asyncio.to_thread(index.common_phrases, min_sites, min_words, limit)
+    return {"stats": await asyncio.to_thread(index.stats), "phrases": phrases}
+
+@app.get("/index/terms/{term}")
+async def index_term(term: str):
+    index = get_ngram_index()
+    return dict(await asyncio.to_thread(index.frequency, term),
+                documents=await asyncio.to_thread(index.documents_for, term))
+
+@app.get("/usage")
+async def usage(days: int = 30):
+    """Gemini token usage, latency and retries per day/model, per site and per routing decision"""
+    telemetry = get_telemetry()
+    return {"by_day": await asyncio.to_thread(telemetry.by_day, days),
+            "by_site": await asyncio.to_thread(telemetry.by_site, days),
+            "by_route": await asyncio.to_thread(telemetry.routes, days)}
+
+def fetch_and_analyze(request, progress, output_dir):
+    manifest, article_links = fetch_site(request.url, output_dir, progress, request.max_articles,
+                                         adaptive=request.adaptive, time_share=FETCH_TIME_SHARE)
+    run_id = uuid.uuid4().hex
+    keywords = analyze_site(request.prompt or DEFAULT_PROMPT, manifest, request.article_indexes, progress,
+                            incremental=request.incremental, run_id=run_id, use_digest=request.digest)
+    return {"url": request.url, "articles": article_links, "keywords": keywords,
+            "usage": get_telemetry().run_usage(run_id)}
+
+def run_keywords(request, progress, token):
+    output_dir = tempfile.mkdtemp(prefix="keyword_api_")
+    try:
+        with cancellation_scope(token):
+            if not request.profile:
+                return fetch_and_analyze(request, progress, output_dir)
+            result, profile = run_profiled("keywords", fetch_and_analyze, request, progress, output_dir)
+            return dict(result, profile=profile)
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+@app.post("/keywords")
+async def keywords(request: KeywordRequest):
+    """Scrape a site and run the Gemini keyword analysis.
+
+    The response is NDJSON: progress events while the work runs (with the
+    keyword text generated so far in "partial" once Gemini starts streaming),
+    then a single result or error event. With a deadline the fetch and the
+    analysis are cut to fit it, and a client disconnecting cancels the work.
+    """
+    await acquire_slot()
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+    token = CancelToken(request.deadline)
+
+    def progress(label, fraction=None, partial=None):
+        event = {"event": "progress", "label": label, "fraction": fraction}
+        if partial is not None:
+            event["partial"] = partial
+        loop.call_soon_threadsafe(events.put_nowait, event)
+
+    async def worker():
+        try:
+            result = await asyncio.to_thread(run_keywords, request, progress, token)
+            await events.put(dict(result, event="result"))
+        except Cancelled:
+            await events.put({"event": "error", "detail": "cancelled"})
+        except Exception as e:
+            await events.put({"event": "error", "detail": str(e)})
+        finally:
+            get_slots().release()
+
+    task = asyncio.create_task(worker())
+
+    async def stream():
+        try:
+            while True:
+                event = await events.get()
+                yield json.dumps(event, ensure_ascii=False) + "\n"
+                if event["event"] in ("result", "error"):
+                    break
+        finally:
+            # Also reached when the client disconnects mid-stream
+            token.cancel()
+        await task
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=int(os.environ.get("API_PORT", 8000)))
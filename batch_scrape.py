@@ -0,0 +1,93 @@
+import argparse
+import json
+import os
+import sys
+from web_scrape import scrape_website_and_articles
+from manifest import RunManifest
+from writers import JsonlWriter, get_writer, site_slug, WRITERS
+import warc_fetch
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Scrape one or more sites without the Streamlit UI.")
+    parser.add_argument("urls", nargs="+", help="Website URLs to scrape")
+    parser.add_argument("--format", choices=sorted(WRITERS), default="jsonl",
+                        help="Output format (default: jsonl, which skips PDF generation)")
+    parser.add_argument("--output-dir", default="scraped",
+                        help="Directory for the output files, or '-' to stream JSONL to stdout")
+    parser.add_argument("--manifest", help="Append a JSONL run manifest (url, content hash, artifact, status) to this file")
+    parser.add_argument("--metadata-only", action="store_true",
+                        help="Only read each site's declared metadata (meta keywords, Open Graph, JSON-LD) "
+                             "from the main page and the <head> of its articles, and write keyword candidates "
+                             "as JSONL")
+    parser.add_argument("--profile", metavar="DIR", nargs="?", const="",
+                        help="Profile the run (cProfile + tracemalloc) and save the artifacts to DIR "
+                             "(default: profiles/ in the data directory)")
+    warc = parser.add_mutually_exclusive_group()
+    warc.add_argument("--record", metavar="WARC", help="Record every HTTP response to this WARC file")
+    warc.add_argument("--replay", metavar="WARC", help="Serve every request from this WARC file instead of the network")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.record:
+        warc_fetch.set_mode("record", args.record)
+    elif args.replay:
+        warc_fetch.set_mode("replay", args.replay)
+    if args.profile is not None:
+        from profiling import run_profiled
+        total, profile = run_profiled("batch_scrape", run, args, output_dir=args.profile or None)
+        print(f"Profile saved to {profile['report']} ({profile['elapsed']:.1f}s)", file=sys.stderr)
+    else:
+        total = run(args)
+    print(f"Saved {total} articles from {len(args.urls)} site(s).", file=sys.stderr)
+    return 0
+
+def run(args):
+    if args.metadata_only:
+        return run_metadata(args)
+    total = 0
+    manifest = RunManifest(spill_path=args.manifest) if args.manifest else None
+
+    if args.format == "jsonl":
+        # Every site is appended to the same stream
+        if args.output_dir == "-":
+            writer = JsonlWriter(sys.stdout)
+        else:
+            writer = get_writer("jsonl", args.output_dir)
+        with writer:
+            for url in args.urls:
+                total += scrape_website_and_articles(url, args.output_dir, writer=writer, manifest=manifest)
+    else:
+        for url in args.urls:
+            site_dir = args.output_dir
+            if args.format != "archive":
+                site_dir = os.path.join(args.output_dir, site_slug(url))
+            with get_writer(args.format, site_dir, url) as writer:
+                total += scrape_website_and_articles(url, site_dir, writer=writer, manifest=manifest)
+    return total
+
+def run_metadata(args):
+    from page_metadata import site_metadata, metadata_candidates
+    if args.output_dir == "-":
+        out = sys.stdout
+    else:
+        os.makedirs(args.output_dir, exist_ok=True)
+        out = open(os.path.join(args.output_dir, "metadata.jsonl"), "a", encoding="utf-8")
+    total = 0
+    try:
+        for url in args.urls:
+            try:
+                pages, links = site_metadata(url)
+            except Exception as e:
+                print(f"Error reading {url}: {e}", file=sys.stderr)
+                continue
+            total += len(pages) - 1
+            record = {'url': url, 'links': links, 'pages': pages, 'candidates': metadata_candidates(pages)}
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return total
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,190 @@
+"""Compare the legacy save_as_pdf rendering with pdf_export, end to end.
+
+Synthetic blog articles are rendered to HTML and converted with
+web_scrape.clean_html_content, so both paths see the markdown a real fetch
+produces. Full PDF builds are timed alternately over several rounds,
+since single runs are dominated by noise.
+
+Both paths spend nearly all their time in reportlab's line breaking and
+font metrics, so they measure within noise of each other: pdf_export is
+not faster end to end. What it changes is correctness (every article
+renders, links with parentheses keep their text) and one cached set of
+styles instead of new ones per paragraph.
+
+Run from the repository root:  python benchmarks/bench_pdf_export.py
+"""
+import os
+import random
+import re
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import streamlit as st
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.styles import ParagraphStyle
+from reportlab.lib.units import inch
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
+
+import pdf_export
+from web_scrape import clean_html_content
+
+WORDS = ("marketing digital campaña keywords búsqueda intención conversión "
+         "audiencia anuncios presupuesto estrategia contenido blog SEO").split()
+
+
+def make_article(paragraphs=120, seed=0):
+    """HTML of a long blog article: headings, links, emphasis, lists and entities"""
+    rng = random.Random(seed)
+
+    def sentence():
+        words = [rng.choice(WORDS) for _ in range(rng.randint(30, 80))]
+        words[3] = f"<strong>{words[3]}</strong>"
+        words[7] = f'<a href="https://example.com/guia?id={rng.randint(1, 999)}&amp;ref=blog">{words[7]}</a>'
+        words[11] = "I+D&amp;R"
+        return " ".join(words)
+
+    body = [f"<h1>Artículo {seed}: estrategia de contenidos</h1>"]
+    for i in range(paragraphs):
+        if i % 25 == 0:
+            body.append(f"<h2>Sección {i} &amp; más</h2>")
+        elif i % 10 == 0:
+            body.append("<ul>" + "".join(f"<li>{sentence()[:80]}</li>" for _ in range(4)) + "</ul>")
+        else:
+            body.append(f"<p>{sentence()}</p>")
+    return (f"<html><head><title>Artículo {seed}</title></head><body><article>"
+            + "".join(body) + "</article></body></html>")
+
+
+def legacy_build_pdf(output_path, title, url, content):
+    """The rendering part of the old web_scrape.save_as_pdf, copied unchanged"""
+    doc = SimpleDocTemplate(
+        output_path,
+        pagesize=letter,
+        rightMargin=72,
+        leftMargin=72,
+        topMargin=72,
+        bottomMargin=72
+    )
+
+    title_style = ParagraphStyle(
+        'TitleStyle',
+        fontSize=16,
+        leading=20,
+        textColor=colors.darkblue,
+        spaceAfter=12
+    )
+
+    normal_style = ParagraphStyle(
+        'NormalStyle',
+        fontSize=11,
+        leading=14,
+        spaceAfter=6
+    )
+
+    url_style = ParagraphStyle(
+        'URLStyle',
+        fontSize=9,
+        leading=12,
+        textColor=colors.darkblue,
+        spaceAfter=12
+    )
+
+    story = []
+
+    story.append(Paragraph(title, title_style))
+    story.append(Spacer(1, 0.25*inch))
+
+    story.append(Paragraph(f"Source: {url}", url_style))
+    story.append(Spacer(1, 0.25*inch))
+
+    paragraphs = content.split('\n\n')
+    for para in paragraphs:
+        if para.strip():
+            # Skip image placeholders with no useful text
+            if '![' in para and len(para.replace('![', '').strip()) < 5:
+                continue
+
+            # Fix encoding issues that might occur
+            para = para.encode('utf-8', 'ignore').decode('utf-8')
+
+            if para.startswith('# '):
+                header_style = ParagraphStyle(
+                    'Header1Style',
+                    fontSize=14,
+                    leading=18,
+                    textColor=colors.darkblue,
+                    spaceAfter=10
+                )
+                story.append(Paragraph(para.replace('# ', ''), header_style))
+            elif para.startswith('## '):
+                header_style = ParagraphStyle(
+                    'Header2Style',
+                    fontSize=12,
+                    leading=16,
+                    textColor=colors.darkblue,
+                    spaceAfter=8
+                )
+                story.append(Paragraph(para.replace('## ', ''), header_style))
+            else:
+                # Clean up markdown formatting for better PDF display
+                para = re.sub(r'\[(.*?)\]\(.*?\)', r'\1', para)  # Remove hyperlinks but keep text
+                para = para.replace('**', '').replace('*', '').replace('__', '').replace('_', '')
+
+                # Wrap paragraphs in try/except to handle any PDF generation errors
+                try:
+                    story.append(Paragraph(para, normal_style))
+                except Exception as e:
+                    st.warning(f"Error adding paragraph to PDF: {e}")
+                    # Try a simplified version without special characters
+                    simplified = re.sub(r'[^\x00-\x7F]+', ' ', para)
+                    story.append(Paragraph(simplified, normal_style))
+
+    doc.build(story)
+
+
+def main(articles=5, paragraphs=120, rounds=7):
+    url = "https://example.com/blog/benchmark?a=1&b=2"
+    pages = [clean_html_content(make_article(paragraphs, seed)) for seed in range(articles)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.pdf")
+        builders = {
+            'legacy': lambda page: legacy_build_pdf(path, page['title'], url, page['content']),
+            'pdf_export': lambda page: pdf_export.build_pdf(path, page['title'], url, page['content']),
+        }
+        failed = {name: set() for name in builders}
+        for name, build in builders.items():
+            # Warm-up, and find the articles each path fails to render at all
+            for i, page in enumerate(pages):
+                try:
+                    build(page)
+                except Exception:
+                    failed[name].add(i)
+        # Only articles both paths render are timed, so neither does less work
+        timed_pages = [page for i, page in enumerate(pages) if not any(i in f for f in failed.values())]
+        times = {name: [] for name in builders}
+        for round_ in range(rounds):
+            # Alternate the order so drift (thermal, caches) affects both equally
+            for name in (builders if round_ % 2 == 0 else reversed(list(builders))):
+                start = time.perf_counter()
+                for page in timed_pages:
+                    builders[name](page)
+                times[name].append(time.perf_counter() - start)
+
+    print(f"full PDF build, {len(timed_pages)} of {articles} articles x {paragraphs} paragraphs, "
+          f"{rounds} alternating rounds")
+    for name, samples in times.items():
+        print(f"  {name:10s} median {statistics.median(samples)*1000:8.1f} ms  "
+              f"min {min(samples)*1000:8.1f} ms  max {max(samples)*1000:8.1f} ms  "
+              f"failed to render {len(failed[name])}/{articles} articles")
+    ratio = statistics.median(times['legacy']) / statistics.median(times['pdf_export'])
+    print(f"  legacy / pdf_export median ratio: {ratio:.2f}")
+
+
+if __name__ == "__main__":
+    main()
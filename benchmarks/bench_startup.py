@@ -0,0 +1,60 @@
+"""Measure cold-start time to first render of the Streamlit apps.
+
+Each run starts a fresh interpreter, imports Streamlit's test harness and
+renders the app once, the way a new container serves its first session.
+Run from the repository root:  python benchmarks/bench_startup.py
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APPS = ["streamlit_app.py", "server.py"]
+# Modules that should only load once work is submitted
+HEAVY_MODULES = ["google.generativeai", "google.api_core.exceptions", "reportlab.platypus", "html2text", "numpy"]
+
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+harness = time.perf_counter()
+app = AppTest.from_file(sys.argv[1], default_timeout=120)
+app.run()
+done = time.perf_counter()
+print(json.dumps({
+    "first_render": done - start,
+    "script": done - harness,
+    "exceptions": [str(e.value) for e in app.exception],
+    "heavy": [m for m in sys.argv[2:] if m in sys.modules],
+}))
+"""
+
+
+def cold_start(app, data_dir):
+    env = dict(os.environ, KEYWORD_DATA_DIR=data_dir, JOBS_DB=os.path.join(data_dir, "jobs.sqlite3"))
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD, os.path.join(ROOT, app), *HEAVY_MODULES],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(runs=5):
+    with tempfile.TemporaryDirectory() as data_dir:
+        for app in APPS:
+            results = [cold_start(app, data_dir) for _ in range(runs)]
+            first_render = statistics.median(r["first_render"] for r in results)
+            script = statistics.median(r["script"] for r in results)
+            print(f"{app} (median of {runs} cold starts)")
+            print(f"  time to first render: {first_render*1000:8.1f} ms")
+            print(f"  app script run:       {script*1000:8.1f} ms")
+            print(f"  heavy modules loaded: {', '.join(results[-1]['heavy']) or 'none'}")
+            if results[-1]["exceptions"]:
+                print(f"  exceptions: {results[-1]['exceptions']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+import os
+import json
+import sqlite3
+import hashlib
+import threading
+from collections import Counter
+from contextlib import contextmanager
+import streamlit as st
+from paths import data_path
+
+BOILERPLATE_DB = os.environ.get("BOILERPLATE_DB") or data_path("boilerplate.sqlite3")
+# A block is template once it shows up on at least this many pages of a site
+# and on at least BOILERPLATE_RATIO of the pages seen so far
+BOILERPLATE_MIN_PAGES = int(os.environ.get("BOILERPLATE_MIN_PAGES", 3))
+BOILERPLATE_RATIO = float(os.environ.get("BOILERPLATE_RATIO", 0.6))
+# Only the site's most recent pages count, so templates follow site redesigns
+BOILERPLATE_WINDOW = int(os.environ.get("BOILERPLATE_WINDOW", 40))
+
+BLOCK_TAGS = ['div', 'section', 'aside', 'header', 'footer', 'form', 'ul', 'ol', 'li', 'p',
+              'blockquote', 'figure', 'table', 'h2', 'h3', 'h4', 'h5', 'h6']
+MIN_BLOCK_CHARS = 12
+
+def block_hash(text):
+    normalized = ' '.join(text.split()).lower()
+    if len(normalized) < MIN_BLOCK_CHARS:
+        return None
+    return hashlib.blake2b(normalized.encode('utf-8'), digest_size=8).hexdigest()
+
+def iter_blocks(soup):
+    for element in soup.find_all(BLOCK_TAGS):
+        digest = block_hash(element.get_text(' ', strip=True))
+        if digest is not None:
+            yield element, digest
+
+class BoilerplateLearner:
+    """Learns each site's template blocks from the pages fetched on it.
+
+    Every page contributes the set of hashes of its text blocks; blocks that
+    repeat on most of a site's pages (footers, CTAs, newsletter boxes,
+    related-post widgets) are removed before conversion. Counts cover the
+    last BOILERPLATE_WINDOW pages of each site: each page's hashes are kept
+    so the oldest page's counts leave with it. Per-site state is kept in
+    memory and persisted to SQLite, so later runs start with the template
+    already learned.
+    """
+
+    def __init__(self, db_path=BOILERPLATE_DB):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._sites = {}
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS template_pages (
+                    id INTEGER PRIMARY KEY,
+                    site TEXT NOT NULL,
+                    url TEXT NOT NULL,
+                    hashes TEXT NOT NULL,
+                    UNIQUE (site, url)
+                )
+            """)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _site(self, site):
+        state = self._sites.get(site)
+        if state is None:
+            with self._connect() as conn:
+                rows = conn.execute(
+                    "SELECT id, url, hashes FROM template_pages WHERE site = ? ORDER BY id DESC LIMIT ?",
+                    (site, BOILERPLATE_WINDOW)).fetchall()
+                # Pages outside the window (e.g. after it was made smaller) no longer count
+                if len(rows) == BOILERPLATE_WINDOW:
+                    conn.execute("DELETE FROM template_pages WHERE site = ? AND id < ?", (site, rows[-1][0]))
+            # Oldest first, so eviction order survives a restart
+            urls = {url: json.loads(hashes) for _, url, hashes in reversed(rows)}
+            blocks = Counter(h for hashes in urls.values() for h in hashes)
+            state = {'pages': len(urls), 'blocks': blocks, 'urls': urls}
+            self._sites[site] = state
+        return state
+
+    def _template(self, state):
+        threshold = max(BOILERPLATE_MIN_PAGES, BOILERPLATE_RATIO * state['pages'])
+        return frozenset(h for h, count in state['blocks'].items() if count >= threshold)
+
+    def learn(self, site, url, soup):
+        """Count the page's distinct blocks towards the site's template.
+
+        Each URL counts once, so re-fetching an article never turns its own
+        paragraphs into template. Only the page's own row is written, after
+        the in-memory counts are updated and outside the lock.
+        """
+        with self._lock:
+            state = self._site(site)
+            if url in state['urls']:
+                return False
+        hashes = sorted({digest for _, digest in iter_blocks(soup)})
+        evicted = []
+        with self._lock:
+            if url in state['urls']:
+                return False
+            state['urls'][url] = hashes
+            state['blocks'].update(hashes)
+            while len(state['urls']) > BOILERPLATE_WINDOW:
+                oldest = next(iter(state['urls']))
+                evicted.append(oldest)
+                for digest in state['urls'].pop(oldest):
+                    state['blocks'][digest] -= 1
+                    if state['blocks'][digest] <= 0:
+                        del state['blocks'][digest]
+            state['pages'] = len(state['urls'])
+        with self._connect() as conn:
+            conn.execute("INSERT OR IGNORE INTO template_pages (site, url, hashes) VALUES (?, ?, ?)",
+                         (site, url, json.dumps(hashes)))
+            conn.executemany("DELETE FROM template_pages WHERE site = ? AND url = ?",
+                             [(site, old) for old in evicted])
+        return True
+
+    def ready(self, site):
+        """Whether enough of the site's pages have been seen for a template to exist"""
+        with self._lock:
+            return self._site(site)['pages'] >= BOILERPLATE_MIN_PAGES
+
+    def template(self, site):
+        with self._lock:
+            return self._template(self._site(site))
+
+    def strip(self, site, soup):
+        """Remove the site's template blocks from soup; returns how many were removed"""
+        template = self.template(site)
+        if not template:
+            return 0
+        removed = 0
+        for element, digest in list(iter_blocks(soup)):
+            # Children of an already removed block are gone with it
+            if element.decomposed:
+                continue
+            if digest in template:
+                element.decompose()
+                removed += 1
+        return removed
+
+    def stats(self, site):
+        with self._lock:
+            state = self._site(site)
+            return {'site': site, 'pages': state['pages'], 'template_blocks': len(self._template(state))}
+
+@st.cache_resource
+def get_boilerplate_learner():
+    return BoilerplateLearner()
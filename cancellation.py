@@ -0,0 +1,122 @@
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+
+class Cancelled(BaseException):
+    """Raised at a checkpoint once the run's token is cancelled.
+
+    Like asyncio.CancelledError it derives from BaseException, so the many
+    "except Exception" blocks that record a page or API call as failed and
+    carry on let it through and the whole run unwinds.
+    """
+
+class DeadlineExceeded(Exception):
+    """The run's time budget doesn't leave room for this step.
+
+    An ordinary Exception: the step fails (an article is skipped, a Gemini
+    call gives up) and the run goes on to return a partial result.
+    """
+
+class CancelToken:
+    """Cooperative cancellation and an optional deadline for one run.
+
+    Work checks the token at its checkpoints (check, sleep) and registers
+    callbacks with on_cancel to interrupt blocking operations, such as an
+    HTTP body being read or a wait for Gemini quota, as soon as it is cancelled.
+    With a deadline (seconds from now), timeout() caps per-request timeouts
+    to the remaining budget and ensure() refuses steps that can't finish.
+    """
+
+    def __init__(self, deadline=None):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self.deadline = time.monotonic() + deadline if deadline else None
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks = list(self._callbacks)
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                pass
+
+    def remaining(self):
+        """Seconds left before the deadline, or None without one"""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    @property
+    def expired(self):
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def ensure(self, seconds, what="this step"):
+        """Raise DeadlineExceeded unless at least seconds remain"""
+        remaining = self.remaining()
+        if remaining is not None and remaining < seconds:
+            raise DeadlineExceeded(f"Not enough time left for {what} ({remaining:.1f}s of the run's budget)")
+
+    def timeout(self, default=None):
+        """default (None meaning no timeout) capped to the remaining budget"""
+        remaining = self.remaining()
+        if remaining is None:
+            return default
+        self.ensure(0.5)
+        return remaining if default is None else min(default, remaining)
+
+    def check(self):
+        if self._event.is_set():
+            raise Cancelled("The run was cancelled")
+
+    def sleep(self, seconds):
+        """time.sleep that wakes up and raises as soon as the token is cancelled.
+
+        Never sleeps past the deadline.
+        """
+        remaining = self.remaining()
+        if remaining is not None:
+            seconds = min(seconds, remaining)
+        if self._event.wait(seconds):
+            raise Cancelled("The run was cancelled")
+
+    @contextmanager
+    def on_cancel(self, callback):
+        """Call callback if the token is cancelled while the block runs"""
+        with self._lock:
+            self._callbacks.append(callback)
+            run_now = self._event.is_set()
+        try:
+            if run_now:
+                callback()
+            yield
+        finally:
+            with self._lock:
+                self._callbacks.remove(callback)
+
+# Tokens are found through a context variable so fetch, cleaning, rendering
+# and Gemini code deep in a job don't all need a token parameter; threads a
+# job starts must run in a copy of its context (contextvars.copy_context)
+_current = contextvars.ContextVar("cancel_token", default=None)
+_NEVER = CancelToken()
+
+def current_token():
+    """The running job's token, or one that is never cancelled outside a job"""
+    return _current.get() or _NEVER
+
+@contextmanager
+def cancellation_scope(token):
+    reset = _current.set(token)
+    try:
+        yield token
+    finally:
+        _current.reset(reset)
@@ -0,0 +1,72 @@
+import re
+from urllib.parse import urlparse
+
+# Bullets, numbering, brackets and quotes around a keyword line
+_DECORATION_RE = re.compile(r'^(?:[\s\-*•·>\["“”\'`]|\d+[.)]\s)+|[\s\]\["“”\'`.,;]+$')
+_SPACE_RE = re.compile(r'\s+')
+
+def parse_keywords(text):
+    """Keyword lines of an analysis result, normalized and in order.
+
+    Section headers ("🔑 Palabras clave SEO extraídas:") and notes such as
+    "(en español)" are dropped; both the SEO and the paid media lists count.
+    """
+    keywords = []
+    for line in (text or "").splitlines():
+        line = line.strip()
+        if not line or line.endswith(':') or line.startswith(('🔑', '🎯', 'Tip', '#')):
+            continue
+        line = re.sub(r'\((?:en|in) [^)]*\)$', '', line)
+        keyword = _SPACE_RE.sub(' ', _DECORATION_RE.sub('', line)).lower()
+        if keyword and len(keyword.split()) <= 12 and keyword not in keywords:
+            keywords.append(keyword)
+    return keywords
+
+def gap_report(results, client_url=None):
+    """Shared vs unique keywords across sites.
+
+    results maps each site URL to its analysis text. shared lists keywords
+    found on two or more sites (most widely used first); unique lists each
+    site's keywords no other site has. With client_url, gaps lists the
+    competitors' keywords the client is missing.
+    """
+    keywords = {url: parse_keywords(text) for url, text in results.items()}
+    sites_for = {}
+    for url, site_keywords in keywords.items():
+        for keyword in site_keywords:
+            sites_for.setdefault(keyword, []).append(url)
+
+    shared = sorted(((keyword, urls) for keyword, urls in sites_for.items() if len(urls) > 1),
+                    key=lambda item: -len(item[1]))
+    report = {
+        'sites': {url: len(site_keywords) for url, site_keywords in keywords.items()},
+        'shared': [{'keyword': keyword, 'sites': urls} for keyword, urls in shared],
+        'unique': {url: [k for k in site_keywords if len(sites_for[k]) == 1]
+                   for url, site_keywords in keywords.items()},
+    }
+    if client_url is not None:
+        client = set(keywords.get(client_url, ()))
+        report['client'] = client_url
+        report['gaps'] = [{'keyword': keyword, 'sites': urls} for keyword, urls in sites_for.items()
+                          if keyword not in client]
+        report['gaps'].sort(key=lambda gap: -len(gap['sites']))
+    return report
+
+def format_gap_report(report):
+    """Markdown rendering of a gap report for the UI"""
+    def site(url):
+        return urlparse(url).netloc or url
+
+    lines = ["### Shared keywords"]
+    lines += [f"- {item['keyword']} ({', '.join(site(u) for u in item['sites'])})" for item in report['shared']]
+    if not report['shared']:
+        lines.append("_No keyword appears on more than one site._")
+    if report.get('client'):
+        lines.append(f"### Gaps: competitor keywords {site(report['client'])} is missing")
+        lines += [f"- {gap['keyword']} ({', '.join(site(u) for u in gap['sites'])})" for gap in report['gaps']]
+        if not report['gaps']:
+            lines.append("_None._")
+    for url, unique in report['unique'].items():
+        lines.append(f"### Only on {site(url)}")
+        lines += [f"- {keyword}" for keyword in unique] or ["_None._"]
+    return "\n".join(lines)
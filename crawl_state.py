@@ -0,0 +1,158 @@
+import os
+import time
+import sqlite3
+from contextlib import contextmanager
+from urllib.parse import urlparse
+import streamlit as st
+from manifest import content_hash
+from paths import data_path
+
+CRAWL_STATE_DB = os.environ.get("CRAWL_STATE_DB") or data_path("crawl_state.sqlite3")
+# Articles seen more recently than this are reused without a request; older
+# ones are revalidated with If-None-Match / If-Modified-Since
+RECRAWL_AFTER = int(os.environ.get("RECRAWL_AFTER", 3 * 24 * 60 * 60))
+# Content versions not seen in a fetch for this long are dropped; a run's
+# manifest older than that can't be re-analyzed from its exact text
+PAGE_VERSION_TTL = int(os.environ.get("PAGE_VERSION_TTL", 30 * 24 * 60 * 60))
+
+class CrawlState:
+    """Persistent per-site crawl state shared by every run.
+
+    pages keeps each known URL's cleaned content, content hash, HTTP
+    validators and first/last-seen/last-changed times; page_versions keeps
+    cleaned content by hash, so a run is analyzed from exactly the text its
+    manifest recorded even after the page changed; article_keywords keeps
+    per-article analysis results by content hash and prompt, and analyses the
+    combined keyword results, so a re-run only fetches and analyzes what is
+    new or changed.
+    """
+
+    def __init__(self, db_path=CRAWL_STATE_DB):
+        self.db_path = db_path
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS pages (
+                    url TEXT PRIMARY KEY,
+                    site TEXT NOT NULL,
+                    title TEXT,
+                    content TEXT,
+                    content_hash TEXT,
+                    etag TEXT,
+                    last_modified TEXT,
+                    first_seen REAL NOT NULL,
+                    last_seen REAL NOT NULL,
+                    last_changed REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS pages_site ON pages (site);
+                CREATE TABLE IF NOT EXISTS page_versions (
+                    content_hash TEXT PRIMARY KEY,
+                    url TEXT NOT NULL,
+                    title TEXT,
+                    content TEXT NOT NULL,
+                    last_seen REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS page_versions_seen ON page_versions (last_seen);
+                CREATE TABLE IF NOT EXISTS article_keywords (
+                    url TEXT NOT NULL,
+                    content_hash TEXT NOT NULL,
+                    prompt_key TEXT NOT NULL,
+                    keywords TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (url, content_hash, prompt_key)
+                );
+                CREATE TABLE IF NOT EXISTS analyses (
+                    key TEXT PRIMARY KEY,
+                    site TEXT,
+                    result TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                );
+            """)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get_page(self, url):
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM pages WHERE url = ?", (url,)).fetchone()
+        return dict(row) if row else None
+
+    def record_page(self, url, title, content, etag=None, last_modified=None):
+        """Store a freshly fetched page; returns 'new', 'changed' or 'unchanged'"""
+        digest = content_hash(content)
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute("SELECT content_hash FROM pages WHERE url = ?", (url,)).fetchone()
+            if row is None:
+                status = 'new'
+                conn.execute(
+                    "INSERT INTO pages (url, site, title, content, content_hash, etag, last_modified, "
+                    "first_seen, last_seen, last_changed) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (url, urlparse(url).netloc, title, content, digest, etag, last_modified, now, now, now))
+            else:
+                status = 'unchanged' if row['content_hash'] == digest else 'changed'
+                conn.execute(
+                    "UPDATE pages SET title = ?, content = ?, content_hash = ?, etag = ?, last_modified = ?, "
+                    "last_seen = ?, last_changed = CASE WHEN ? THEN last_changed ELSE ? END WHERE url = ?",
+                    (title, content, digest, etag, last_modified, now, status == 'unchanged', now, url))
+            conn.execute(
+                "INSERT INTO page_versions (content_hash, url, title, content, last_seen) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (content_hash) DO UPDATE SET last_seen = excluded.last_seen",
+                (digest, url, title, content, now))
+            conn.execute("DELETE FROM page_versions WHERE last_seen < ?", (now - PAGE_VERSION_TTL,))
+        return status
+
+    def get_version(self, digest):
+        """Title and content of the page version with this content hash, if still kept"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT url, title, content FROM page_versions WHERE content_hash = ?",
+                               (digest,)).fetchone()
+        return dict(row) if row else None
+
+    def touch(self, url):
+        """The server confirmed the stored copy is current (304)"""
+        with self._connect() as conn:
+            conn.execute("UPDATE pages SET last_seen = ? WHERE url = ?", (time.time(), url))
+
+    def site_summary(self, site_url):
+        site = urlparse(site_url).netloc
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT COUNT(*) AS pages, MIN(first_seen) AS first_seen, MAX(last_seen) AS last_seen "
+                "FROM pages WHERE site = ?", (site,)).fetchone()
+        return dict(row)
+
+    def get_article_keywords(self, url, digest, prompt_key):
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT keywords FROM article_keywords WHERE url = ? AND content_hash = ? AND prompt_key = ?",
+                (url, digest, prompt_key)).fetchone()
+        return row['keywords'] if row else None
+
+    def set_article_keywords(self, url, digest, prompt_key, keywords):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO article_keywords (url, content_hash, prompt_key, keywords, created_at) "
+                "VALUES (?, ?, ?, ?, ?)", (url, digest, prompt_key, keywords, time.time()))
+
+    def get_analysis(self, key):
+        with self._connect() as conn:
+            row = conn.execute("SELECT result FROM analyses WHERE key = ?", (key,)).fetchone()
+        return row['result'] if row else None
+
+    def set_analysis(self, key, site_url, result):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO analyses (key, site, result, created_at) VALUES (?, ?, ?, ?)",
+                (key, urlparse(site_url).netloc if site_url else None, result, time.time()))
+
+@st.cache_resource
+def get_crawl_state():
+    return CrawlState()
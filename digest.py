@@ -0,0 +1,122 @@
+import os
+import re
+import math
+from collections import Counter
+from keyword_candidates import tokenize_segments, STOPWORDS
+
+# Token budgets for the digests sent instead of full documents; a document
+# gets at most DIGEST_DOC_TOKENS and all of them together DIGEST_TOTAL_TOKENS
+DIGEST_DOC_TOKENS = int(os.environ.get("DIGEST_DOC_TOKENS", 600))
+DIGEST_TOTAL_TOKENS = int(os.environ.get("DIGEST_TOTAL_TOKENS", 6000))
+MIN_DOC_TOKENS = 150
+INTRO_PARAGRAPHS = 2
+# Same ratio as the local request estimate in gemini.estimate_tokens
+CHARS_PER_TOKEN = 4
+
+_LINK_RE = re.compile(r'!?\[([^\]]*)\]\([^)]*\)')
+_HEADING_RE = re.compile(r'^(#{1,3})\s+(.+)')
+_LIST_RE = re.compile(r'^(?:[*+-]|\d+\.)\s+(.+)')
+_EMPHASIS_RE = re.compile(r'\*\*([^*\n]+?)\*\*|__([^_\n]+?)__')
+_SENTENCE_RE = re.compile(r'(?<=[.!?])\s+')
+_BLOCK_SPLIT_RE = re.compile(r'\n\s*\n')
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN
+
+def _plain(text):
+    return _EMPHASIS_RE.sub(lambda m: m.group(1) or m.group(2), text).lstrip('#').strip()
+
+def _structure(content):
+    """Headings (H1-H3), list items, emphasized terms and paragraphs of a cleaned markdown document"""
+    content = _LINK_RE.sub(r'\1', content)
+    headings, items, paragraphs = [], [], []
+    emphasized = list(dict.fromkeys(
+        term.strip() for match in _EMPHASIS_RE.finditer(content) for term in match.groups()
+        if term and len(term.split()) <= 8))
+    for block in _BLOCK_SPLIT_RE.split(content):
+        text = []
+        for line in block.splitlines():
+            line = line.strip()
+            heading = _HEADING_RE.match(line)
+            item = _LIST_RE.match(line)
+            if heading:
+                headings.append((heading.group(1), _plain(heading.group(2))))
+            elif item:
+                items.append(_plain(item.group(1)))
+            elif line:
+                text.append(_plain(line))
+        if text:
+            paragraphs.append(' '.join(text))
+    return headings, items, emphasized, paragraphs
+
+def _sentence_scores(sentences):
+    """Sum of document frequencies of a sentence's content words, damped by its length"""
+    words_per_sentence = [
+        [w for segment in tokenize_segments(sentence) for w in segment if w not in STOPWORDS and len(w) > 2]
+        for sentence in sentences
+    ]
+    frequency = Counter(w for words in words_per_sentence for w in words)
+    return [sum(frequency[w] for w in set(words)) / math.sqrt(len(words) + 1) for words in words_per_sentence]
+
+def document_digest(title, content, max_tokens=DIGEST_DOC_TOKENS):
+    """Budgeted digest of a document: what carries its keyword signal, most important first.
+
+    Fills max_tokens with the title, H1-H3 headings, the opening paragraphs,
+    list items, emphasized terms and finally the highest-scoring remaining
+    sentences (kept in document order). Whatever doesn't fit is dropped.
+    """
+    headings, items, emphasized, paragraphs = _structure(content)
+    parts = []
+    used = 0
+
+    def add(text):
+        nonlocal used
+        cost = estimate_tokens(text) + 1
+        if used + cost > max_tokens:
+            return False
+        parts.append(text)
+        used += cost
+        return True
+
+    add(f"# {title}")
+    for level, heading in headings:
+        if heading != title:
+            add(f"{level} {heading}")
+    # Long intros are cut at a sentence boundary rather than skipped
+    for paragraph in paragraphs[:INTRO_PARAGRAPHS]:
+        for sentence in _SENTENCE_RE.split(paragraph):
+            if not add(sentence):
+                break
+    for item in items:
+        add(f"- {item}")
+    if emphasized:
+        terms = []
+        for term in emphasized:
+            if estimate_tokens(", ".join(terms + [term])) + used + 4 > max_tokens:
+                break
+            terms.append(term)
+        if terms:
+            add("Destacado: " + ", ".join(terms))
+
+    sentences = [s for paragraph in paragraphs[INTRO_PARAGRAPHS:] for s in _SENTENCE_RE.split(paragraph) if s]
+    selected = []
+    for i in sorted(range(len(sentences)), key=_sentence_scores(sentences).__getitem__, reverse=True):
+        cost = estimate_tokens(sentences[i]) + 1
+        if used + cost <= max_tokens:
+            selected.append(i)
+            used += cost
+    parts += [sentences[i] for i in sorted(selected)]
+    return "\n".join(parts)
+
+def build_digests(pages, total_tokens=DIGEST_TOTAL_TOKENS, doc_tokens=DIGEST_DOC_TOKENS):
+    """Digests of pages (dicts with url, title and content), splitting the total budget between them.
+
+    Returns the combined text and the estimated tokens of the full documents
+    it replaces.
+    """
+    if not pages:
+        return "", 0
+    per_document = max(MIN_DOC_TOKENS, min(doc_tokens, total_tokens // len(pages)))
+    sections = [f"=== Documento {n}: {page['url']} ===\n{document_digest(page['title'], page['content'], per_document)}"
+                for n, page in enumerate(pages, 1)]
+    return "\n\n".join(sections), sum(estimate_tokens(page['content']) for page in pages)
@@ -1,20 +1,32 @@
-import google.generativeai as genai
 import os
 from pathlib import Path
 import mimetypes
+import re
 import time
+import random
+import threading
+import functools
+import contextvars
+from collections import deque
 import requests.exceptions
 import streamlit as st
 from dotenv import load_dotenv
+from telemetry import record_call, get_telemetry
+from cancellation import current_token, Cancelled
+from profiling import profile_thread
 
 # Load environment variables from .env file
 load_dotenv()
 
 # Get API key from environment variable or Streamlit secrets
 def get_api_key():
-    # First check for secret in Streamlit secrets
-    if hasattr(st, 'secrets') and 'GEMINI_API_KEY' in st.secrets:
-        return st.secrets['GEMINI_API_KEY']
+    # First check for secret in Streamlit secrets (missing secrets.toml raises
+    # outside Streamlit Cloud, e.g. when running the HTTP API)
+    try:
+        if hasattr(st, 'secrets') and 'GEMINI_API_KEY' in st.secrets:
+            return st.secrets['GEMINI_API_KEY']
+    except FileNotFoundError:
+        pass
     
     # Then check for environment variable
     api_key = os.environ.get("GEMINI_API_KEY")
@@ -33,11 +45,19 @@ def get_api_key():
     
     return api_key
 
+# The SDK is slow to import, so it is loaded and configured once per API key on
+# first use rather than at import time or on every analysis
+@st.cache_resource
+def get_genai(api_key):
+    import google.generativeai as genai
+    genai.configure(api_key=api_key)
+    return genai
+
 # Configure Gemini API
 def initialize_genai():
     api_key = get_api_key()
     if api_key:
-        genai.configure(api_key=api_key)
+        get_genai(api_key)
         return True
     return False
 
@@ -90,76 +110,467 @@ def prepare_files(file_paths):
     
     return files
 
-def call_gemini_api(prompt, file_paths, model_name="gemini-2.0-flash-lite"):
+# Per-model quota used by the client-side scheduler. The defaults match the
+# free tier; GEMINI_RPM / GEMINI_TPM override them for every model.
+MODEL_LIMITS = {
+    "gemini-2.0-flash-lite": {"rpm": 30, "tpm": 1000000},
+    "gemini-2.0-flash": {"rpm": 15, "tpm": 1000000},
+    "gemini-1.5-flash": {"rpm": 15, "tpm": 1000000},
+    "gemini-1.5-pro": {"rpm": 2, "tpm": 32000},
+}
+DEFAULT_LIMITS = {"rpm": 15, "tpm": 1000000}
+QUOTA_WINDOW = 60.0
+
+# Rough size of a PDF page once Gemini tokenizes it
+TOKENS_PER_PDF_PAGE = 258
+
+def get_model_limits(model_name):
+    limits = dict(MODEL_LIMITS.get(model_name, DEFAULT_LIMITS))
+    if os.environ.get("GEMINI_RPM"):
+        limits["rpm"] = int(os.environ["GEMINI_RPM"])
+    if os.environ.get("GEMINI_TPM"):
+        limits["tpm"] = int(os.environ["GEMINI_TPM"])
+    return limits
+
+def estimate_tokens(prompt, files, max_output_tokens=0):
+    """Cheap local estimate of the tokens a request will use against TPM"""
+    tokens = len(prompt) // 4 + max_output_tokens
+    for file in files:
+        if file["mime_type"] == "application/pdf":
+            pages = max(1, file["data"].count(b"/Type /Page") - file["data"].count(b"/Type /Pages"))
+            tokens += pages * TOKENS_PER_PDF_PAGE
+        else:
+            tokens += len(file["data"]) // 4
+    return tokens
+
+# Ask the model for an exact input size before each call; set to 0 to rely
+# on estimate_tokens only
+GEMINI_COUNT_TOKENS = os.environ.get("GEMINI_COUNT_TOKENS", "1") != "0"
+# Seconds the count may take; under a run deadline it is skipped unless
+# several times that is left, so generation keeps most of the budget
+GEMINI_COUNT_TOKENS_TIMEOUT = float(os.environ.get("GEMINI_COUNT_TOKENS_TIMEOUT", 5))
+
+def count_request_tokens(model, request_content, prompt, files):
+    """Input tokens of a request and where the number came from"""
+    token = current_token()
+    remaining = token.remaining()
+    if GEMINI_COUNT_TOKENS and (remaining is None or remaining >= 4 * GEMINI_COUNT_TOKENS_TIMEOUT):
+        try:
+            # Uploads the whole request again, so it is bounded and cancellable like generation
+            counted = _call_until(time.monotonic() + GEMINI_COUNT_TOKENS_TIMEOUT, token, model.count_tokens,
+                                  request_content)
+            return counted.total_tokens, 'count_tokens'
+        except Exception:
+            pass
+    return estimate_tokens(prompt, files), 'estimate'
+
+def response_usage(response):
+    """(input, output) tokens reported by the response, when it has usage metadata"""
+    usage = getattr(response, 'usage_metadata', None)
+    if not usage:
+        return None, None
+    return usage.prompt_token_count or None, usage.candidates_token_count or 0
+
+class QuotaScheduler:
+    """Client-side RPM/TPM budget per model, shared by every caller in the process.
+
+    Callers wait in FIFO order per model until the sliding one-minute window has
+    room for their request. A 429 from the server pauses the whole model
+    instead of letting each caller retry on its own.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._usage = {}
+        self._queues = {}
+        self._paused_until = {}
+
+    def _wait_time(self, model_name, tokens, now):
+        limits = get_model_limits(model_name)
+        usage = self._usage.setdefault(model_name, deque())
+        while usage and usage[0][0] <= now - QUOTA_WINDOW:
+            usage.popleft()
+
+        wait = max(0.0, self._paused_until.get(model_name, 0) - now)
+        if len(usage) >= limits["rpm"]:
+            wait = max(wait, usage[0][0] + QUOTA_WINDOW - now)
+
+        # A request larger than the whole budget can only run on an empty window
+        tokens = min(tokens, limits["tpm"])
+        used = sum(entry[1] for entry in usage)
+        for timestamp, entry_tokens in usage:
+            if used + tokens <= limits["tpm"]:
+                break
+            used -= entry_tokens
+            wait = max(wait, timestamp + QUOTA_WINDOW - now)
+        return wait
+
+    def acquire(self, model_name, tokens):
+        """Block until the request fits the model's budget, then reserve it.
+
+        Returns the number of seconds spent waiting. Raises DeadlineExceeded
+        instead of waiting past the run's deadline.
+        """
+        ticket = object()
+        queued = time.monotonic()
+        token = current_token()
+        with token.on_cancel(self._wake), self._condition:
+            queue = self._queues.setdefault(model_name, deque())
+            queue.append(ticket)
+            try:
+                while True:
+                    token.check()
+                    now = time.monotonic()
+                    if queue[0] is ticket:
+                        wait = self._wait_time(model_name, tokens, now)
+                        if wait <= 0:
+                            self._usage[model_name].append((now, tokens))
+                            return now - queued
+                        token.ensure(wait, "the Gemini quota wait")
+                    else:
+                        wait = token.remaining()
+                        token.ensure(0.5, "the Gemini quota wait")
+                    self._condition.wait(timeout=wait)
+            finally:
+                queue.remove(ticket)
+                self._condition.notify_all()
+
+    def _wake(self):
+        with self._condition:
+            self._condition.notify_all()
+
+    def pause(self, model_name, seconds):
+        """Hold every queued request for this model after a quota error"""
+        with self._condition:
+            until = time.monotonic() + seconds
+            self._paused_until[model_name] = max(self._paused_until.get(model_name, 0), until)
+            self._condition.notify_all()
+
+@st.cache_resource
+def get_scheduler():
+    return QuotaScheduler()
+
+@functools.lru_cache(maxsize=None)
+def api_errors():
+    """Exception classes by how they are handled; google.api_core loads on first use"""
+    from google.api_core import exceptions as google_exceptions
+    return {
+        # Server-side quota errors: wait for the quota to refill, then retry
+        'rate_limit': (google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests),
+        # Transient failures worth a bounded number of retries
+        'transient': (
+            google_exceptions.ServiceUnavailable,
+            google_exceptions.DeadlineExceeded,
+            google_exceptions.InternalServerError,
+            google_exceptions.GatewayTimeout,
+            requests.exceptions.Timeout,
+            requests.exceptions.ConnectionError,
+            GenerationTimeout,
+        ),
+        # Errors that mean the configuration is too slow rather than the service broken
+        'timeout': (
+            google_exceptions.DeadlineExceeded,
+            google_exceptions.GatewayTimeout,
+            requests.exceptions.Timeout,
+            GenerationTimeout,
+        ),
+    }
+
+def is_rate_limited(error):
+    if isinstance(error, api_errors()['rate_limit']):
+        return True
+    message = str(error)
+    return "429" in message or "RESOURCE_EXHAUSTED" in message or "quota" in message.lower()
+
+def retry_after_seconds(error, default):
+    """Server-suggested delay from a quota error, if it carries one"""
+    match = re.search(r"retry(?:_delay| in)\D{0,20}?(\d+(?:\.\d+)?)", str(error), re.IGNORECASE)
+    if match:
+        return float(match.group(1))
+    return default
+
+# Set generation config with reasonable parameters
+GENERATION_CONFIG = {
+    "temperature": 0.2,  # Lower temperature for more deterministic results
+    "top_p": 0.8,
+    "top_k": 40,
+    "max_output_tokens": 1024,  # Limit output size
+}
+
+def load_request_files(file_paths):
+    # Process files in smaller batches if there are many
+    if len(file_paths) > 5:
+        # Process only the main page and a few articles
+        file_paths = file_paths[:5]  # Take only the first 5 files
+        st.info(f"Processing only the first 5 files to avoid timeout issues.")
+    
+    files = prepare_files(file_paths)
+    
+    if not files:
+        raise ValueError("No valid files to process")
+    
+    st.info(f"Analyzing {len(files)} files with Gemini AI...")
+    return files
+
+# Routes from the default configuration up; a request takes the first route in
+# ROUTE_ORDER whose input threshold covers it. After a timeout, or when recent
+# latency predicts the latency target will be missed, the route's fallback (a
+# faster or smaller configuration) is used instead.
+MODEL_ROUTES = {
+    "fast": {"model": "gemini-2.0-flash-lite", "max_input_tokens": 32000, "max_output_tokens": 1024,
+             "timeout": 60, "fallback": "minimal"},
+    "standard": {"model": "gemini-2.0-flash", "max_input_tokens": 1000000, "max_output_tokens": 2048,
+                 "timeout": 120, "fallback": "fast"},
+    "minimal": {"model": "gemini-2.0-flash-lite", "max_input_tokens": 1000000, "max_output_tokens": 512,
+                "timeout": 45, "fallback": None},
+}
+ROUTE_ORDER = ["fast", "standard"]
+GEMINI_LATENCY_TARGET = float(os.environ.get("GEMINI_LATENCY_TARGET", 45))
+
+def predicted_latency(model_name, input_tokens):
+    """Seconds the call should take, from recent calls to the same model; None without history"""
     try:
-        # Make sure the API is initialized
-        if not initialize_genai():
-            return "Unable to initialize Gemini API. Please check your API key."
-            
-        # Process files in smaller batches if there are many
-        if len(file_paths) > 5:
-            # Process only the main page and a few articles
-            file_paths = file_paths[:5]  # Take only the first 5 files
-            st.info(f"Processing only the first 5 files to avoid timeout issues.")
-        
-        files = prepare_files(file_paths)
-        
-        if not files:
-            raise ValueError("No valid files to process")
-        
-        st.info(f"Analyzing {len(files)} files with Gemini AI...")
-        
-        model = genai.GenerativeModel(model_name)
-        
-        # Prepare the request
-        request_content = [
-            {
-                "parts": [
-                    {"text": prompt},
-                    *[{"inline_data": file} for file in files]
-                ]
-            }
-        ]
-        
-        # Set generation config with reasonable parameters
-        generation_config = {
-            "temperature": 0.2,  # Lower temperature for more deterministic results
-            "top_p": 0.8,
-            "top_k": 40,
-            "max_output_tokens": 1024,  # Limit output size
+        per_token = get_telemetry().latency_per_token(model_name)
+    except Exception:
+        return None
+    return per_token * input_tokens if per_token is not None else None
+
+def route_request(input_tokens, model_name=None):
+    """Pick the route for a request of input_tokens; an explicit model_name pins it"""
+    if model_name:
+        route = dict(MODEL_ROUTES[ROUTE_ORDER[0]], model=model_name, fallback=None)
+        return dict(route, name="pinned", reason="pinned")
+    
+    name = next((n for n in ROUTE_ORDER if input_tokens <= MODEL_ROUTES[n]["max_input_tokens"]), ROUTE_ORDER[-1])
+    reason = f"size<={MODEL_ROUTES[name]['max_input_tokens']}"
+    while MODEL_ROUTES[name]["fallback"]:
+        expected = predicted_latency(MODEL_ROUTES[name]["model"], input_tokens)
+        if expected is None or expected <= GEMINI_LATENCY_TARGET:
+            break
+        reason = f"latency {expected:.0f}s>{GEMINI_LATENCY_TARGET:.0f}s"
+        name = MODEL_ROUTES[name]["fallback"]
+    return dict(MODEL_ROUTES[name], name=name, reason=reason)
+
+class _RouteTimedOut(Exception):
+    pass
+
+class GenerationTimeout(Exception):
+    """A Gemini call didn't answer within its route's timeout"""
+
+_END = object()
+
+def _call_until(deadline, token, func, *args):
+    """func(*args) on a helper thread, given up on at deadline or when token is cancelled.
+
+    google-generativeai 0.3 has no per-request timeout, so a call that hangs
+    is abandoned rather than interrupted; its thread finishes in the background.
+    """
+    result = {}
+    done = threading.Event()
+
+    def run():
+        try:
+            result['value'] = profile_thread(func, *args)
+        except BaseException as e:
+            result['error'] = e
+        finally:
+            done.set()
+
+    # In a copy of the caller's context, so a profiled run includes the call
+    threading.Thread(target=contextvars.copy_context().run, args=(run,), name="gemini-call", daemon=True).start()
+    with token.on_cancel(done.set):
+        done.wait(max(0.0, deadline - time.monotonic()))
+    token.check()
+    if 'error' in result:
+        raise result['error']
+    if 'value' not in result:
+        raise GenerationTimeout("No response before the timeout")
+    return result['value']
+
+def generate_text(prompt, files, model_name=None, stream=False, site=None, run_id=None):
+    """Yield the response text (in chunks when streaming), retrying per error class.
+
+    The model and generation config come from route_request unless model_name
+    pins them; a timeout moves the request to the route's fallback. Every
+    attempt is recorded in the usage telemetry with its route, token counts,
+    latency, scheduler wait and retries, tagged with site and run_id.
+    """
+    # Prepare the request
+    request_content = [
+        {
+            "parts": [
+                {"text": prompt},
+                *[{"inline_data": file} for file in files]
+            ]
         }
-        
-        # Call the API with retries
-        max_retries = 3
-        retry_delay = 2
-        
-        for attempt in range(max_retries):
+    ]
+    
+    import google.generativeai as genai
+    counting_model = genai.GenerativeModel(model_name or MODEL_ROUTES[ROUTE_ORDER[0]]["model"])
+    input_tokens, token_source = count_request_tokens(counting_model, request_content, prompt, files)
+    route = route_request(input_tokens, model_name)
+    
+    while True:
+        fallback = MODEL_ROUTES.get(route["fallback"]) if route["fallback"] else None
+        try:
+            yield from _generate_on_route(route, request_content, files, input_tokens, token_source, stream,
+                                          site, run_id, can_fall_back=fallback is not None)
+            return
+        except _RouteTimedOut as e:
+            st.warning(f"{route['model']} timed out, falling back to the '{route['fallback']}' configuration: {e}")
+            route = dict(fallback, name=route["fallback"], reason=f"timeout on {route['name']}")
+
+def _generate_on_route(route, request_content, files, input_tokens, token_source, stream, site, run_id,
+                       can_fall_back):
+    import google.generativeai as genai
+    model_name = route["model"]
+    model = genai.GenerativeModel(model_name)
+    generation_config = dict(GENERATION_CONFIG, max_output_tokens=route["max_output_tokens"])
+    
+    # Wait for room in the shared RPM/TPM budget before every attempt
+    scheduler = get_scheduler()
+    estimated_tokens = input_tokens + route["max_output_tokens"]
+    
+    max_retries = 3
+    max_rate_limit_waits = 5
+    retry_delay = 2
+    attempt = 0
+    rate_limit_waits = 0
+    
+    token = current_token()
+    
+    usage = {'model': model_name, 'route': route["name"], 'route_reason': route["reason"], 'files': len(files),
+             'run_id': run_id, 'site': site, 'token_source': token_source, 'input_tokens': input_tokens,
+             'queue_wait': 0.0, 'status': 'abandoned'}
+    start = time.perf_counter()
+    try:
+        while True:
+            token.check()
+            usage['queue_wait'] += scheduler.acquire(model_name, estimated_tokens)
+            started = False
             try:
-                response = model.generate_content(
+                # The route's timeout covers the whole response, streamed chunks included
+                deadline = time.monotonic() + token.timeout(route["timeout"])
+                response = _call_until(deadline, token, functools.partial(
+                    model.generate_content,
                     contents=request_content,
-                    generation_config=generation_config
-                )
-                return response.text
-            
-            except requests.exceptions.Timeout as e:
-                st.warning(f"Timeout error (attempt {attempt+1}/{max_retries}): {e}")
-                if attempt < max_retries - 1:
-                    time.sleep(retry_delay)
-                    retry_delay *= 2  # Exponential backoff
-                else:
-                    raise
+                    generation_config=generation_config,
+                    stream=stream,
+                ))
+                if not stream:
+                    text = response.text
+                    usage['input_tokens'], usage['output_tokens'] = response_usage(response)
+                    usage['status'] = 'ok'
+                    yield text
+                    return
+                
+                chunks = iter(response)
+                while True:
+                    chunk = _call_until(deadline, token, next, chunks, _END)
+                    if chunk is _END:
+                        break
+                    try:
+                        text = chunk.text
+                    except ValueError:
+                        # Chunks without text parts, e.g. the final finish-reason chunk
+                        continue
+                    started = True
+                    yield text
+                usage['input_tokens'], usage['output_tokens'] = response_usage(response)
+                usage['status'] = 'ok'
+                return
             
             except Exception as e:
-                st.warning(f"API error (attempt {attempt+1}/{max_retries}): {e}")
-                if attempt < max_retries - 1:
-                    time.sleep(retry_delay)
-                    retry_delay *= 2
-                else:
+                usage['status'], usage['error'] = 'failed', str(e)
+                # Once text has reached the caller a retry would repeat it
+                if started:
                     raise
+                
+                if is_rate_limited(e):
+                    # Quota errors don't count as failed attempts; pause the model for
+                    # everyone so concurrent callers don't turn this into a retry storm
+                    rate_limit_waits += 1
+                    usage['rate_limit_waits'] = rate_limit_waits
+                    if rate_limit_waits > max_rate_limit_waits:
+                        raise
+                    delay = retry_after_seconds(e, QUOTA_WINDOW / 2)
+                    token.ensure(delay, "the Gemini quota wait")
+                    st.warning(f"Gemini quota reached, waiting {delay:.0f}s before retrying: {e}")
+                    scheduler.pause(model_name, delay)
+                    continue
+                
+                # A slower retry of the same configuration rarely helps; use a faster one
+                if can_fall_back and isinstance(e, api_errors()['timeout']):
+                    usage['status'] = 'timeout'
+                    raise _RouteTimedOut(str(e)) from e
+                
+                if not isinstance(e, api_errors()['transient']):
+                    # Invalid requests, bad keys and missing models won't succeed on retry
+                    raise
+                
+                attempt += 1
+                usage['retries'] = attempt
+                st.warning(f"API error (attempt {attempt}/{max_retries}): {e}")
+                if attempt >= max_retries:
+                    raise
+                # Exponential backoff with jitter, unless the run can't afford it
+                delay = retry_delay * random.uniform(0.5, 1.5)
+                token.ensure(delay, "a Gemini retry")
+                token.sleep(delay)
+                retry_delay *= 2
+    except Cancelled:
+        usage['status'], usage['error'] = 'cancelled', None
+        raise
+    finally:
+        if usage['status'] == 'ok':
+            usage['input_tokens'] = usage['input_tokens'] or input_tokens
+            usage['error'] = None
+        usage['latency'] = round(time.perf_counter() - start - usage['queue_wait'], 3)
+        usage['queue_wait'] = round(usage['queue_wait'], 3)
+        record_call(**usage)
+
+def call_gemini_api(prompt, file_paths, model_name=None, site=None, run_id=None):
+    try:
+        # Make sure the API is initialized
+        if not initialize_genai():
+            st.error("Unable to initialize Gemini API. Please check your API key.")
+            return None
+        
+        files = load_request_files(file_paths)
+        return "".join(generate_text(prompt, files, model_name, site=site, run_id=run_id))
         
     except Exception as e:
         st.error(f"Error calling Gemini API: {e}")
         return None
 
+def call_gemini_api_stream(prompt, file_paths, model_name=None, site=None, run_id=None):
+    """Streaming variant of call_gemini_api: yields text chunks as they arrive.
+
+    Errors are reported like call_gemini_api does and end the stream early, so
+    callers should treat an empty result as a failure.
+    """
+    try:
+        if not initialize_genai():
+            st.error("Unable to initialize Gemini API. Please check your API key.")
+            return
+        
+        files = load_request_files(file_paths)
+        yield from generate_text(prompt, files, model_name, stream=True, site=site, run_id=run_id)
+        
+    except Exception as e:
+        st.error(f"Error calling Gemini API: {e}")
+
+def call_gemini_text_stream(prompt, model_name=None, site=None, run_id=None):
+    """Stream a text-only request, e.g. a prompt built from local keyword candidates"""
+    try:
+        if not initialize_genai():
+            st.error("Unable to initialize Gemini API. Please check your API key.")
+            return
+        
+        yield from generate_text(prompt, [], model_name, stream=True, site=site, run_id=run_id)
+        
+    except Exception as e:
+        st.error(f"Error calling Gemini API: {e}")
+
 if __name__ == "__main__":
     print("This module is designed to be imported, not run directly.")
\ No newline at end of file
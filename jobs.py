@@ -0,0 +1,206 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import tempfile
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+import streamlit as st
+from cancellation import CancelToken, Cancelled, cancellation_scope
+
+# One pool per process bounds the scraping/analysis load no matter how many
+# sessions or tabs submit work
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 4))
+MAX_PENDING_JOBS = int(os.environ.get("MAX_PENDING_JOBS", 50))
+JOB_RETENTION = int(os.environ.get("JOB_RETENTION", 24 * 60 * 60))
+# Default time budget in seconds for every job (0: none); submit() can override it
+RUN_DEADLINE = float(os.environ.get("RUN_DEADLINE", 0))
+JOBS_DB = os.environ.get("JOBS_DB", os.path.join(tempfile.gettempdir(), "keyword_extractor_jobs.sqlite3"))
+
+ACTIVE_STATES = ('queued', 'running')
+
+class JobQueueFull(RuntimeError):
+    pass
+
+class JobManager:
+    """Shared worker pool with a SQLite job table the UI polls by job ID.
+
+    Job functions receive a progress(label, fraction=None, partial=None)
+    callback as their first argument and must return a JSON-serializable
+    result. partial carries incremental output (e.g. streamed keywords) the UI
+    can show before the job finishes. A cancelled job is dropped if still
+    queued; a running one has its CancelToken cancelled and stops at its next
+    checkpoint (every progress call is one). Deduplicated jobs are shared, so
+    a session that no longer wants one calls release(), which only cancels
+    it once no other session is waiting for it.
+    """
+
+    def __init__(self, db_path=JOBS_DB, max_workers=JOB_WORKERS, max_pending=MAX_PENDING_JOBS):
+        self.db_path = db_path
+        self.max_pending = max_pending
+        # Several processes may share the table; each only schedules its own jobs
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="keyword-job")
+        self._lock = threading.Lock()
+        self._tokens = {}
+        # Submissions still waiting for each active job of this process
+        self._subscribers = {}
+        self._init_db()
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _init_db(self):
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    owner TEXT NOT NULL,
+                    dedupe_key TEXT,
+                    status TEXT NOT NULL,
+                    progress_label TEXT,
+                    progress_fraction REAL,
+                    partial TEXT,
+                    result TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL
+                )
+            """)
+            # Tables created before streamed results were added lack this column
+            columns = [row['name'] for row in conn.execute("PRAGMA table_info(jobs)")]
+            if 'partial' not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN partial TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (owner, status, dedupe_key)")
+            conn.execute("DELETE FROM jobs WHERE created_at < ?", (time.time() - JOB_RETENTION,))
+
+    def _update(self, job_id, **fields):
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        with self._connect() as conn:
+            conn.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+    def submit(self, kind, func, *args, dedupe_key=None, deadline=None, **kwargs):
+        """Queue func(progress, *args, **kwargs) and return its job ID.
+
+        With a dedupe_key, an identical job that is still queued or running is
+        reused instead of doing the work twice. deadline is the job's time
+        budget in seconds from submission, queueing included (default
+        RUN_DEADLINE).
+        """
+        with self._lock, self._connect() as conn:
+            if dedupe_key is not None:
+                row = conn.execute(
+                    "SELECT id FROM jobs WHERE owner = ? AND dedupe_key = ? AND status IN ('queued', 'running')",
+                    (self.owner, dedupe_key)).fetchone()
+                if row:
+                    if row['id'] in self._subscribers:
+                        self._subscribers[row['id']] += 1
+                    return row['id']
+
+            pending = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE owner = ? AND status IN ('queued', 'running')",
+                (self.owner,)).fetchone()[0]
+            if pending >= self.max_pending:
+                raise JobQueueFull("The server is busy right now. Please try again in a few minutes.")
+
+            job_id = uuid.uuid4().hex
+            conn.execute(
+                "INSERT INTO jobs (id, kind, owner, dedupe_key, status, progress_label, progress_fraction, created_at) "
+                "VALUES (?, ?, ?, ?, 'queued', 'Waiting for a free worker...', 0, ?)",
+                (job_id, kind, self.owner, dedupe_key, time.time()))
+
+            self._tokens[job_id] = CancelToken(deadline if deadline is not None else RUN_DEADLINE)
+            self._subscribers[job_id] = 1
+        self.executor.submit(self._run, job_id, func, args, kwargs)
+        return job_id
+
+    def _run(self, job_id, func, args, kwargs):
+        # Cancelled while queued: drop it without starting
+        with self._connect() as conn:
+            started = conn.execute(
+                "UPDATE jobs SET status = 'running', started_at = ? WHERE id = ? AND status = 'queued'",
+                (time.time(), job_id)).rowcount
+        token = self._tokens[job_id]
+        if not started or token.cancelled:
+            self._forget(job_id)
+            return
+
+        def progress(label, fraction=None, partial=None):
+            token.check()
+            fields = {'progress_label': label}
+            if fraction is not None:
+                fields['progress_fraction'] = fraction
+            if partial is not None:
+                fields['partial'] = partial
+            self._update(job_id, **fields)
+
+        try:
+            with cancellation_scope(token):
+                result = func(progress, *args, **kwargs)
+            token.check()
+            self._update(job_id, status='done', result=json.dumps(result), progress_fraction=1.0,
+                         finished_at=time.time())
+        except Cancelled:
+            self._update(job_id, status='cancelled', finished_at=time.time())
+        except Exception as e:
+            self._update(job_id, status='failed', error=str(e), finished_at=time.time())
+        finally:
+            self._forget(job_id)
+
+    def _forget(self, job_id):
+        with self._lock:
+            self._tokens.pop(job_id, None)
+            self._subscribers.pop(job_id, None)
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job; returns whether it was still active"""
+        with self._connect() as conn:
+            cancelled = conn.execute(
+                "UPDATE jobs SET status = 'cancelled', progress_label = 'Cancelled', finished_at = ? "
+                "WHERE id = ? AND status IN ('queued', 'running')", (time.time(), job_id)).rowcount
+        token = self._tokens.get(job_id)
+        if token is not None:
+            token.cancel()
+        return bool(cancelled)
+
+    def release(self, job_id):
+        """Drop one submission's interest in a job, cancelling it if nobody else waits for it.
+
+        Returns whether the job was cancelled.
+        """
+        with self._lock:
+            if job_id not in self._subscribers:
+                return False
+            self._subscribers[job_id] -= 1
+            if self._subscribers[job_id] > 0:
+                return False
+        return self.cancel(job_id)
+
+    def get(self, job_id):
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+    def is_active(self, job_id):
+        job = self.get(job_id)
+        return job is not None and job['status'] in ACTIVE_STATES
+
+@st.cache_resource
+def get_job_manager():
+    return JobManager()
@@ -0,0 +1,205 @@
+import os
+import re
+from collections import Counter
+
+STOPWORDS_ES = frozenset("""
+a al algo algunas algunos ante antes aquí así aun aunque bajo bien cada casi como con contra cual cuales cuando
+cómo de del desde donde dos durante e el ella ellas ello ellos en entre era eran es esa esas ese eso esos esta
+estaba estado estamos estar estas este esto estos está están fue fueron gran ha había hacer hace hacia han hasta hay
+la las le les lo los más mas me mi mis mismo mucho muy nada ni no nos nuestra nuestro nuestros o otra otras otro
+otros para pero poco por porque puede pueden qué que quien se sea ser si sido sin sobre solo sólo son su sus
+también tan te tiene tienen todo todos tu tus un una unas uno unos usted ya yo él cómo cuál dónde
+""".split())
+
+STOPWORDS_EN = frozenset("""
+a about above after again against all also am an and any are as at be because been before being below between
+both but by can could did do does doing down during each few for from further had has have having he her here
+hers him his how i if in into is it its itself just me more most my no nor not now of off on once only or other
+our ours out over own same she should so some such than that the their theirs them then there these they this
+those through to too under until up very was we were what when where which while who whom why will with would
+you your yours read more click here share
+""".split())
+
+STOPWORDS = STOPWORDS_ES | STOPWORDS_EN
+
+# Adaptive sampling stops once the top candidates' average overlap with the
+# previous ranking stays at or above ADAPTIVE_STABILITY for ADAPTIVE_PATIENCE
+# consecutive articles, and never before ADAPTIVE_MIN_ARTICLES
+ADAPTIVE_TOP_N = int(os.environ.get("ADAPTIVE_TOP_N", 20))
+ADAPTIVE_STABILITY = float(os.environ.get("ADAPTIVE_STABILITY", 0.85))
+ADAPTIVE_PATIENCE = int(os.environ.get("ADAPTIVE_PATIENCE", 2))
+ADAPTIVE_MIN_ARTICLES = int(os.environ.get("ADAPTIVE_MIN_ARTICLES", 3))
+
+# Stopwords allowed inside a phrase, so "marketing de contenidos" or
+# "cost of living" survive as long-tail candidates
+CONNECTORS = frozenset(["de", "del", "para", "en", "con", "y", "of", "for", "in", "to", "with", "and", "on"])
+
+_MARKDOWN_RE = re.compile(r'!?\[([^\]]*)\]\([^)]*\)|https?://\S+|[#*_`>|]+')
+_SEGMENT_RE = re.compile(r'[.,;:!?¿¡()\[\]{}"“”«»\n\r\t/\\]+| - ')
+_WORD_RE = re.compile(r"[^\W\d_][\w'’-]*[^\W_]|[^\W\d_]", re.UNICODE)
+
+def _strip_markdown(text):
+    return _MARKDOWN_RE.sub(lambda m: f" {m.group(1)} " if m.group(1) is not None else " ", text)
+
+def tokenize_segments(text):
+    """Lowercased word runs, split at punctuation and line breaks"""
+    segments = []
+    for segment in _SEGMENT_RE.split(_strip_markdown(text).lower()):
+        words = _WORD_RE.findall(segment)
+        if words:
+            segments.append(words)
+    return segments
+
+def detect_language(text):
+    words = _WORD_RE.findall(text.lower()[:20000])
+    spanish = sum(1 for w in words if w in STOPWORDS_ES and w not in STOPWORDS_EN)
+    english = sum(1 for w in words if w in STOPWORDS_EN and w not in STOPWORDS_ES)
+    return 'es' if spanish >= english else 'en'
+
+def iter_phrases(segments, stopwords=STOPWORDS, max_words=4):
+    for words in segments:
+        for start in range(len(words)):
+            if words[start] in stopwords or len(words[start]) < 3:
+                continue
+            for end in range(start + 1, min(start + max_words, len(words)) + 1):
+                word = words[end - 1]
+                if word in stopwords:
+                    # RAKE-style boundary, except for single connectors inside a phrase
+                    if word not in CONNECTORS or words[end - 2] in stopwords:
+                        break
+                    continue
+                if len(word) >= 3:
+                    yield ' '.join(words[start:end])
+
+def extract_candidates(documents, top_n=30, max_words=4, min_count=2, language=None):
+    """Rank long-tail keyword candidates across a set of cleaned markdown documents.
+
+    Phrases are n-grams bounded by stopwords (RAKE style). Each phrase is
+    scored by TF-IDF summed over the documents, weighted by the RAKE
+    degree/frequency score of its words, so multi-word phrases built from
+    topical words rank above isolated frequent terms.
+    Returns dicts with phrase, score, count and documents.
+    """
+    import numpy as np
+
+    documents = [doc for doc in documents if doc and doc.strip()]
+    if not documents:
+        return []
+
+    if language == 'es':
+        stopwords = STOPWORDS_ES
+    elif language == 'en':
+        stopwords = STOPWORDS_EN
+    else:
+        stopwords = STOPWORDS
+
+    doc_counts = []
+    word_frequency = Counter()
+    word_degree = Counter()
+    for doc in documents:
+        phrases = Counter(iter_phrases(tokenize_segments(doc), stopwords, max_words))
+        doc_counts.append(phrases)
+        for phrase, count in phrases.items():
+            words = [w for w in phrase.split() if w not in stopwords]
+            for word in words:
+                word_frequency[word] += count
+                word_degree[word] += count * len(words)
+
+    vocabulary = Counter()
+    for phrases in doc_counts:
+        vocabulary.update(phrases)
+    # Single documents are short; don't demand repeats there
+    threshold = min_count if len(documents) > 1 or sum(vocabulary.values()) > 500 else 1
+    terms = [phrase for phrase, count in vocabulary.items() if count >= threshold]
+    if not terms:
+        return []
+    index = {phrase: i for i, phrase in enumerate(terms)}
+
+    matrix = np.zeros((len(terms), len(documents)), dtype=np.float32)
+    for column, phrases in enumerate(doc_counts):
+        rows = [index[p] for p in phrases if p in index]
+        matrix[rows, column] = [phrases[terms[row]] for row in rows]
+
+    doc_lengths = np.maximum(matrix.sum(axis=0), 1.0)
+    document_frequency = (matrix > 0).sum(axis=1)
+    idf = np.log((1 + len(documents)) / (1 + document_frequency)) + 1.0
+    tfidf = (matrix / doc_lengths) * idf[:, None]
+
+    rake = np.array([
+        sum(word_degree[w] / word_frequency[w] for w in phrase.split() if w in word_frequency)
+        for phrase in terms
+    ], dtype=np.float32)
+    scores = tfidf.sum(axis=1) * rake
+
+    counts = matrix.sum(axis=1)
+    selected = []
+    for i in np.argsort(-scores, kind='stable'):
+        phrase = f" {terms[i]} "
+        # Skip fragments of an already selected phrase that occur about as often
+        if any(phrase in f" {terms[j]} " and counts[i] <= counts[j] * 1.25 for j in selected):
+            continue
+        selected.append(i)
+        if len(selected) >= top_n:
+            break
+
+    return [
+        {
+            'phrase': terms[i],
+            'score': round(float(scores[i]), 4),
+            'count': int(counts[i]),
+            'documents': int(document_frequency[i]),
+        }
+        for i in selected
+    ]
+
+def format_candidates(candidates, limit=None):
+    """One candidate per line, the compact form sent to Gemini or shown in the UI"""
+    return "\n".join(candidate['phrase'] for candidate in candidates[:limit])
+
+def average_overlap(previous, current):
+    """Rank-aware similarity of two rankings: mean overlap of their top-d prefixes, in [0, 1]"""
+    depth = max(len(previous), len(current))
+    if depth == 0:
+        return 1.0
+    seen_previous, seen_current = set(), set()
+    total = 0.0
+    for d in range(depth):
+        if d < len(previous):
+            seen_previous.add(previous[d])
+        if d < len(current):
+            seen_current.add(current[d])
+        total += len(seen_previous & seen_current) / (d + 1)
+    return total / depth
+
+class CandidateConvergence:
+    """Running local keyword ranking over documents as they are fetched.
+
+    After each document the candidates are re-ranked; once the top_n
+    ranking has stayed stable for patience documents in a row, further
+    documents are unlikely to change what the site is about.
+    """
+
+    def __init__(self, top_n=ADAPTIVE_TOP_N, threshold=ADAPTIVE_STABILITY, patience=ADAPTIVE_PATIENCE,
+                 min_documents=ADAPTIVE_MIN_ARTICLES):
+        self.top_n = top_n
+        self.threshold = threshold
+        self.patience = patience
+        self.min_documents = min_documents
+        self.documents = []
+        self.ranking = []
+        self.stability = None
+        self.stable_steps = 0
+
+    def add(self, document):
+        """Add a document and return whether the ranking has converged"""
+        self.documents.append(document)
+        ranking = [candidate['phrase'] for candidate in extract_candidates(self.documents, top_n=self.top_n)]
+        if self.ranking:
+            self.stability = average_overlap(self.ranking, ranking)
+            self.stable_steps = self.stable_steps + 1 if self.stability >= self.threshold else 0
+        self.ranking = ranking
+        return self.converged
+
+    @property
+    def converged(self):
+        return len(self.documents) >= self.min_documents and self.stable_steps >= self.patience
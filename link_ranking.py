@@ -0,0 +1,215 @@
+import os
+import re
+import math
+import time
+import zlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from urllib.parse import urljoin, urlparse
+from shared_cache import TTLCache
+from warc_fetch import http_get, get_session
+from cancellation import CancelToken, Cancelled, cancellation_scope, current_token
+
+# Relative weight of each signal in an article link's score
+RANKING_WEIGHTS = {'recency': 0.4, 'anchor': 0.25, 'position': 0.2, 'slug': 0.15}
+# An article this many days old scores half the recency of one published today
+RECENCY_HALF_LIFE = int(os.environ.get("RECENCY_HALF_LIFE", 365))
+# Sitemap files (robots.txt entries, sitemap.xml, children of an index) read per site
+SITEMAP_MAX_FILES = int(os.environ.get("SITEMAP_MAX_FILES", 3))
+# Bytes read per sitemap file (after decompression for .gz); entries past it are ignored
+SITEMAP_MAX_BYTES = int(os.environ.get("SITEMAP_MAX_BYTES", 2 * 1024 * 1024))
+# Seconds one site's whole lookup may take, and seconds link ranking waits for
+# it; a lookup still running then finishes in the background for later runs
+SITEMAP_TIME_LIMIT = float(os.environ.get("SITEMAP_TIME_LIMIT", 15))
+SITEMAP_WAIT = float(os.environ.get("SITEMAP_WAIT", 3))
+SITEMAP_TTL = int(os.environ.get("SITEMAP_TTL", 6 * 60 * 60))
+# Sites without usable sitemaps are tried again after this long
+SITEMAP_FAILURE_TTL = int(os.environ.get("SITEMAP_FAILURE_TTL", 10 * 60))
+SITEMAP_WORKERS = 4
+ANCHOR_WORDS = 8
+SLUG_WORDS = 6
+
+_URL_DATE_RE = re.compile(r'/((?:19|20)\d{2})[/-](\d{1,2})(?:[/-](\d{1,2}))?(?=[/-]|$)')
+_SITEMAP_ENTRY_RE = re.compile(r'<(url|sitemap)\b[^>]*>(.*?)</\1>', re.S | re.I)
+_LOC_RE = re.compile(r'<loc>\s*(.*?)\s*</loc>', re.S | re.I)
+_LASTMOD_RE = re.compile(r'<lastmod>\s*(.*?)\s*</lastmod>', re.S | re.I)
+_ROBOTS_SITEMAP_RE = re.compile(r'^\s*sitemap:\s*(\S+)', re.M | re.I)
+_SLUG_SPLIT_RE = re.compile(r'[-_]+')
+
+_sitemaps = TTLCache("sitemaps", 100, SITEMAP_TTL)
+_sitemap_failures = TTLCache("sitemap_failures", 500, SITEMAP_FAILURE_TTL)
+_lookups = {}
+_lookups_lock = threading.Lock()
+_lookup_executor = ThreadPoolExecutor(max_workers=SITEMAP_WORKERS, thread_name_prefix="sitemap")
+
+def _url_key(url):
+    # Sitemaps and listings disagree on scheme, case and trailing slashes
+    parsed = urlparse(url)
+    return (parsed.netloc + parsed.path.rstrip('/')).lower()
+
+def _parse_date(value):
+    try:
+        return datetime.strptime(value[:10], '%Y-%m-%d').replace(tzinfo=timezone.utc).timestamp()
+    except ValueError:
+        return None
+
+def url_date(url):
+    """Publication date encoded in the URL path (/2024/05/slug, /2024-05-17-slug), as a timestamp"""
+    match = _URL_DATE_RE.search(urlparse(url).path)
+    if not match:
+        return None
+    year, month, day = int(match.group(1)), int(match.group(2)), int(match.group(3) or 1)
+    try:
+        return datetime(year, month, day, tzinfo=timezone.utc).timestamp()
+    except ValueError:
+        return None
+
+def _sitemap_entries(content):
+    if content[:2] == b'\x1f\x8b':
+        # A truncated download still yields its complete entries
+        content = zlib.decompressobj(zlib.MAX_WBITS | 16).decompress(content, SITEMAP_MAX_BYTES)
+    for tag, body in _SITEMAP_ENTRY_RE.findall(content.decode('utf-8', 'replace')):
+        loc = _LOC_RE.search(body)
+        if loc:
+            lastmod = _LASTMOD_RE.search(body)
+            yield tag.lower() == 'sitemap', loc.group(1), _parse_date(lastmod.group(1)) if lastmod else None
+
+def _site_root(site_url):
+    parsed = urlparse(site_url)
+    return f"{parsed.scheme}://{parsed.netloc}"
+
+def _read_sitemaps(root):
+    """Read the site's sitemaps within SITEMAP_TIME_LIMIT and cache the dates found"""
+    dates = {}
+    session = get_session()
+    # Its own token: a download still trickling in at the time limit is aborted
+    token = CancelToken(SITEMAP_TIME_LIMIT)
+    timer = threading.Timer(SITEMAP_TIME_LIMIT, token.cancel)
+    timer.daemon = True
+    timer.start()
+    try:
+        with cancellation_scope(token):
+            try:
+                robots = http_get(session, root + '/robots.txt', timeout=10, max_bytes=SITEMAP_MAX_BYTES)
+                queue = _ROBOTS_SITEMAP_RE.findall(robots.text) if robots.status_code == 200 else []
+            except Exception:
+                queue = []
+            queue = queue or [root + '/sitemap.xml']
+            for _ in range(SITEMAP_MAX_FILES):
+                if not queue:
+                    break
+                try:
+                    response = http_get(session, queue.pop(0), timeout=10, max_bytes=SITEMAP_MAX_BYTES)
+                    if response.status_code != 200:
+                        continue
+                    children = []
+                    for is_index, loc, lastmod in _sitemap_entries(response.content):
+                        if is_index:
+                            children.append((lastmod or 0, urljoin(root, loc)))
+                        elif lastmod is not None:
+                            dates[_url_key(urljoin(root, loc))] = lastmod
+                    queue += [loc for _, loc in sorted(children, reverse=True)]
+                except Exception:
+                    continue
+    except Cancelled:
+        # Out of time; the dates read so far still count
+        pass
+    finally:
+        timer.cancel()
+    if dates:
+        _sitemaps.set(root, dates)
+    else:
+        _sitemap_failures.set(root, True)
+    return dates
+
+def prefetch_sitemap(site_url):
+    """Start reading the site's sitemaps in the background, e.g. while its listing downloads.
+
+    One lookup runs per site however many callers ask; returns its future,
+    or None when the result is already cached.
+    """
+    root = _site_root(site_url)
+    if _sitemaps.get(root) is not None or _sitemap_failures.get(root):
+        return None
+    with _lookups_lock:
+        future = _lookups.get(root)
+        if future is None:
+            # Not tied to the caller's run: other sessions may be waiting for the same site
+            future = _lookup_executor.submit(_read_sitemaps, root)
+            _lookups[root] = future
+            future.add_done_callback(lambda _: _lookups.pop(root, None))
+    return future
+
+def sitemap_lastmod(site_url, wait=SITEMAP_WAIT):
+    """lastmod timestamps by URL key from the site's sitemaps, cached per site.
+
+    Reads robots.txt for Sitemap: entries (falling back to /sitemap.xml) and
+    at most SITEMAP_MAX_FILES files of up to SITEMAP_MAX_BYTES, following a
+    sitemap index to its most recently modified children. Waits at most wait
+    seconds (less near the run's deadline) and has no dates meanwhile. Any
+    failure just means fewer dates; sites without them are retried after
+    SITEMAP_FAILURE_TTL.
+    """
+    root = _site_root(site_url)
+    dates = _sitemaps.get(root)
+    if dates is not None:
+        return dates
+    future = prefetch_sitemap(site_url)
+    if future is None:
+        return _sitemaps.get(root) or {}
+    remaining = current_token().remaining()
+    try:
+        return future.result(timeout=wait if remaining is None else min(wait, remaining))
+    except Exception:
+        # Still running (it keeps going for later runs) or failed
+        return {}
+
+def link_candidates(soup, base_url, urls):
+    """Anchor text (the longest of the URL's links) and first position on the page for each URL"""
+    wanted = set(urls)
+    links = soup.find_all('a', href=True)
+    candidates = {}
+    for position, link in enumerate(links):
+        url = urljoin(base_url, link['href'])
+        if url not in wanted:
+            continue
+        anchor = link.get_text(' ', strip=True) or link.get('title', '')
+        candidate = candidates.setdefault(url, {'url': url, 'anchor': '', 'position': position})
+        if len(anchor) > len(candidate['anchor']):
+            candidate['anchor'] = anchor
+    return [candidates.get(url) or {'url': url, 'anchor': '', 'position': len(links)} for url in urls]
+
+def score_link(candidate, total_links, published=None, now=None):
+    """Weighted score in [0, 1] of how likely a link is a current, substantial article"""
+    now = now or time.time()
+    recency = 0.0
+    if published is not None:
+        age_days = max(0.0, (now - published) / 86400)
+        recency = math.pow(0.5, age_days / RECENCY_HALF_LIFE)
+    # Article titles are several words long; "Read more" and category links aren't
+    anchor = min(len(candidate['anchor'].split()), ANCHOR_WORDS) / ANCHOR_WORDS
+    # Listings put their featured and newest articles first
+    position = 1.0 - candidate['position'] / max(total_links, 1)
+    slug_text = urlparse(candidate['url']).path.rstrip('/').rsplit('/', 1)[-1]
+    slug = min(len([w for w in _SLUG_SPLIT_RE.split(slug_text) if w]), SLUG_WORDS) / SLUG_WORDS
+    signals = {'recency': recency, 'anchor': anchor, 'position': position, 'slug': slug}
+    return sum(RANKING_WEIGHTS[name] * value for name, value in signals.items())
+
+def rank_links(site_url, candidates, lastmod=None):
+    """Candidates sorted best first, with their score and publication date.
+
+    Dates come from the sitemap's lastmod when listed there, otherwise from
+    the URL. Ties keep page order, so the same listing always ranks the same.
+    """
+    if lastmod is None:
+        lastmod = sitemap_lastmod(site_url)
+    now = time.time()
+    total_links = max((c['position'] for c in candidates), default=0) + 1
+    ranked = []
+    for candidate in candidates:
+        published = lastmod.get(_url_key(candidate['url'])) or url_date(candidate['url'])
+        ranked.append(dict(candidate, published=published,
+                           score=round(score_link(candidate, total_links, published, now), 6)))
+    ranked.sort(key=lambda c: (-c['score'], c['position'], c['url']))
+    return ranked
@@ -0,0 +1,144 @@
+import os
+import json
+import time
+import hashlib
+
+def content_hash(text):
+    return hashlib.sha256(text.encode('utf-8', 'ignore')).hexdigest()
+
+class RunManifest:
+    """In-memory record of every page produced by a fetch run.
+
+    Each entry holds the page URL, its role (main or article), the article
+    index, a hash of the cleaned content, the artifact location and a status.
+    When spill_path is set every entry is also appended to that JSONL file so
+    a run can be reloaded later with RunManifest.load().
+    """
+
+    def __init__(self, site_url=None, spill_path=None):
+        self.site_url = site_url
+        self.spill_path = spill_path
+        self.entries = []
+        self._by_url = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def artifact_name(self, url, role='article', index=None):
+        """Collision-free artifact name derived from the URL, not its basename"""
+        if role == 'main':
+            return 'main_page'
+        digest = hashlib.sha1(url.encode('utf-8')).hexdigest()[:12]
+        return f"article_{index + 1}_{digest}" if index is not None else f"article_{digest}"
+
+    def _add(self, entry):
+        previous = self._by_url.get(entry['url'])
+        if previous is not None:
+            self.entries.remove(previous)
+        self.entries.append(entry)
+        self._by_url[entry['url']] = entry
+
+        if self.spill_path:
+            with open(self.spill_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        return entry
+
+    def record_page(self, page, artifact, role='article', index=None):
+        return self._add({
+            'url': page['url'],
+            'role': role,
+            'index': index,
+            'title': page.get('title'),
+            'content_hash': content_hash(page.get('content', '')),
+            'artifact': artifact,
+            'crawl': page.get('crawl'),
+            'status': 'ok',
+            'error': None,
+            'recorded_at': time.time(),
+        })
+
+    def record_failure(self, url, error, role='article', index=None):
+        return self._add({
+            'url': url,
+            'role': role,
+            'index': index,
+            'title': None,
+            'content_hash': None,
+            'artifact': None,
+            'status': 'failed',
+            'error': str(error),
+            'recorded_at': time.time(),
+        })
+
+    def record_duplicate(self, url, duplicate_of, content, role='article', index=None):
+        """Near-copy of an earlier page; kept out of the analysis and the artifact budget"""
+        return self._add({
+            'url': url,
+            'role': role,
+            'index': index,
+            'title': None,
+            'content_hash': content_hash(content),
+            'artifact': None,
+            'status': 'duplicate',
+            'error': None,
+            'duplicate_of': duplicate_of,
+            'recorded_at': time.time(),
+        })
+
+    def get(self, url):
+        return self._by_url.get(url)
+
+    def pages(self, status='ok'):
+        return [entry for entry in self.entries if status is None or entry['status'] == status]
+
+    def select(self, include_main=True, article_indexes=None):
+        """Successful entries for analysis: the main page first, then articles in order.
+
+        article_indexes limits the articles to a selection; None means all.
+        """
+        main = [e for e in self.pages() if e['role'] == 'main']
+        articles = [e for e in self.pages() if e['role'] == 'article']
+        if article_indexes is not None:
+            selected = set(article_indexes)
+            articles = [e for e in articles if e['index'] in selected]
+        articles.sort(key=lambda e: (e['index'] is None, e['index'] or 0))
+
+        return [e for e in (main if include_main else []) + articles if e['artifact']]
+
+    def artifacts(self, include_main=True, article_indexes=None):
+        return [e['artifact'] for e in self.select(include_main, article_indexes)]
+
+    def content_hashes(self, include_main=True, article_indexes=None):
+        return [e['content_hash'] for e in self.select(include_main, article_indexes)]
+
+    def clear(self):
+        self.entries = []
+        self._by_url = {}
+        if self.spill_path and os.path.exists(self.spill_path):
+            os.remove(self.spill_path)
+
+    def to_dict(self):
+        return {'site_url': self.site_url, 'entries': list(self.entries)}
+
+    @classmethod
+    def load(cls, spill_path, site_url=None):
+        """Rebuild a manifest from its spill file; later entries for a URL win"""
+        manifest = cls(site_url=site_url)
+        if os.path.exists(spill_path):
+            with open(spill_path, encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        manifest._add(json.loads(line))
+        manifest.spill_path = spill_path
+        return manifest
+
+    @classmethod
+    def from_dict(cls, data, spill_path=None):
+        manifest = cls(site_url=data.get('site_url'), spill_path=spill_path)
+        for entry in data.get('entries', []):
+            manifest.entries.append(entry)
+            manifest._by_url[entry['url']] = entry
+        return manifest
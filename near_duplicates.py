@@ -0,0 +1,75 @@
+import os
+import re
+import hashlib
+from collections import Counter
+
+# SimHash fingerprints within this many bits of each other are the same
+# article (AMP/print views, query-string variants, category reposts)
+NEAR_DUPLICATE_DISTANCE = int(os.environ.get("NEAR_DUPLICATE_DISTANCE", 8))
+SHINGLE_WORDS = 3
+# Pages with fewer shingles than this are too short to fingerprint reliably
+MIN_SHINGLES = 8
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+def shingles(text, size=SHINGLE_WORDS):
+    words = _WORD_RE.findall(text.lower())
+    if len(words) < size:
+        return Counter([' '.join(words)]) if words else Counter()
+    return Counter(' '.join(words[i:i + size]) for i in range(len(words) - size + 1))
+
+def simhash(text):
+    """64-bit SimHash of the text's word shingles, or None when it is too short"""
+    import numpy as np
+
+    features = shingles(text)
+    if len(features) < MIN_SHINGLES:
+        return None
+    hashes = np.array([int.from_bytes(hashlib.blake2b(f.encode('utf-8'), digest_size=8).digest(), 'big')
+                       for f in features], dtype=np.uint64)
+    weights = np.fromiter(features.values(), dtype=np.float64, count=len(features))
+    bits = np.unpackbits(hashes.view(np.uint8)).reshape(-1, 64)
+    votes = (weights[:, None] * (bits.astype(np.float64) * 2 - 1)).sum(axis=0)
+    return int(np.packbits(votes > 0).view(np.uint64)[0])
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count('1')
+
+class NearDuplicateDetector:
+    """Remembers SimHash fingerprints of a run's pages and flags near-copies.
+
+    Fingerprints are split into max_distance + 1 bands; two fingerprints within
+    max_distance bits must agree on at least one band, so only pages sharing a
+    band are compared.
+    """
+
+    def __init__(self, max_distance=NEAR_DUPLICATE_DISTANCE):
+        self.max_distance = max_distance
+        self.bands = max_distance + 1
+        self.band_bits = 64 // self.bands
+        self.buckets = [{} for _ in range(self.bands)]
+        self.fingerprints = {}
+
+    def _band_keys(self, fingerprint):
+        mask = (1 << self.band_bits) - 1
+        return [(fingerprint >> (band * self.band_bits)) & mask for band in range(self.bands)]
+
+    def find(self, fingerprint):
+        for band, key in enumerate(self._band_keys(fingerprint)):
+            for url in self.buckets[band].get(key, ()):
+                if hamming_distance(fingerprint, self.fingerprints[url]) <= self.max_distance:
+                    return url
+        return None
+
+    def check(self, url, text):
+        """URL of an earlier near-duplicate of text, or None after remembering it"""
+        fingerprint = simhash(text)
+        if fingerprint is None:
+            return None
+        original = self.find(fingerprint)
+        if original is not None and original != url:
+            return original
+        self.fingerprints[url] = fingerprint
+        for band, key in enumerate(self._band_keys(fingerprint)):
+            self.buckets[band].setdefault(key, []).append(url)
+        return None
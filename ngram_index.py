@@ -0,0 +1,216 @@
+import os
+import time
+import sqlite3
+import threading
+from array import array
+from collections import Counter
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+import streamlit as st
+from keyword_candidates import tokenize_segments, iter_phrases
+from manifest import content_hash
+from paths import data_path
+
+NGRAM_INDEX_PATH = os.environ.get("NGRAM_INDEX_PATH") or data_path("ngram_index.sqlite3")
+INDEX_MAX_WORDS = 3
+
+def _pack(values):
+    return array('I', values).tobytes()
+
+def _unpack(blob):
+    values = array('I')
+    if blob:
+        values.frombytes(blob)
+    return values
+
+class NgramIndex:
+    """Persistent inverted index of n-grams to the documents that contain them.
+
+    Postings are one row per (term, document) with the in-document count,
+    and term_sites counts each term's documents per site, so adding or
+    replacing a document only touches the rows of its own terms. terms
+    keeps each term's document frequency, total frequency and the number of
+    distinct sites it appears on; corpus-level queries read those columns
+    directly.
+    """
+
+    def __init__(self, path=NGRAM_INDEX_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS documents (
+                    id INTEGER PRIMARY KEY,
+                    url TEXT UNIQUE NOT NULL,
+                    site TEXT NOT NULL,
+                    content_hash TEXT NOT NULL,
+                    length INTEGER NOT NULL,
+                    terms BLOB,
+                    indexed_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS terms (
+                    id INTEGER PRIMARY KEY,
+                    term TEXT UNIQUE NOT NULL,
+                    df INTEGER NOT NULL DEFAULT 0,
+                    tf INTEGER NOT NULL DEFAULT 0,
+                    sites INTEGER NOT NULL DEFAULT 0
+                );
+                CREATE TABLE IF NOT EXISTS postings (
+                    term_id INTEGER NOT NULL,
+                    doc_id INTEGER NOT NULL,
+                    count INTEGER NOT NULL,
+                    PRIMARY KEY (term_id, doc_id)
+                ) WITHOUT ROWID;
+                CREATE TABLE IF NOT EXISTS term_sites (
+                    term_id INTEGER NOT NULL,
+                    site TEXT NOT NULL,
+                    docs INTEGER NOT NULL,
+                    PRIMARY KEY (term_id, site)
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS terms_sites ON terms (sites, df);
+                CREATE INDEX IF NOT EXISTS documents_site ON documents (site);
+            """)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _term_ids(self, conn, terms):
+        ids = {}
+        for start in range(0, len(terms), 500):
+            chunk = terms[start:start + 500]
+            ids.update(conn.execute(
+                f"SELECT term, id FROM terms WHERE term IN ({','.join('?' * len(chunk))})", chunk))
+        return ids
+
+    def _remove_postings(self, conn, doc_id, site, term_ids):
+        for start in range(0, len(term_ids), 500):
+            chunk = term_ids[start:start + 500]
+            marks = ','.join('?' * len(chunk))
+            rows = conn.execute(
+                f"SELECT term_id, count FROM postings WHERE doc_id = ? AND term_id IN ({marks})",
+                [doc_id, *chunk]).fetchall()
+            conn.executemany("DELETE FROM postings WHERE term_id = ? AND doc_id = ?",
+                             [(term_id, doc_id) for term_id, _ in rows])
+            conn.executemany("UPDATE terms SET df = df - 1, tf = tf - ? WHERE id = ?",
+                             [(count, term_id) for term_id, count in rows])
+            conn.executemany("UPDATE term_sites SET docs = docs - 1 WHERE term_id = ? AND site = ?",
+                             [(term_id, site) for term_id, _ in rows])
+            # Terms whose last document on this site was this one lose the site
+            gone = [row[0] for row in conn.execute(
+                f"SELECT term_id FROM term_sites WHERE site = ? AND docs <= 0 AND term_id IN ({marks})",
+                [site, *chunk])]
+            conn.executemany("UPDATE terms SET sites = sites - 1 WHERE id = ?", [(t,) for t in gone])
+            conn.executemany("DELETE FROM term_sites WHERE term_id = ? AND site = ?", [(t, site) for t in gone])
+            conn.execute(f"DELETE FROM terms WHERE df <= 0 AND id IN ({marks})", chunk)
+
+    def add_document(self, url, content, site=None):
+        """Index a page's cleaned content; unchanged pages are skipped, changed ones replaced"""
+        digest = content_hash(content)
+        site = site or urlparse(url).netloc
+        term_counts = Counter(iter_phrases(tokenize_segments(content), max_words=INDEX_MAX_WORDS))
+
+        with self._lock, self._connect() as conn:
+            existing = conn.execute(
+                "SELECT id, content_hash, terms, site FROM documents WHERE url = ?", (url,)).fetchone()
+            if existing and existing[1] == digest:
+                return False
+
+            if existing:
+                self._remove_postings(conn, existing[0], existing[3], list(_unpack(existing[2])))
+                conn.execute("DELETE FROM documents WHERE id = ?", (existing[0],))
+
+            cursor = conn.execute(
+                "INSERT INTO documents (url, site, content_hash, length, indexed_at) VALUES (?, ?, ?, ?, ?)",
+                (url, site, digest, sum(term_counts.values()), time.time()))
+            doc_id = cursor.lastrowid
+
+            conn.executemany("INSERT OR IGNORE INTO terms (term) VALUES (?)", [(t,) for t in term_counts])
+            ids = self._term_ids(conn, list(term_counts))
+            conn.executemany("INSERT INTO postings (term_id, doc_id, count) VALUES (?, ?, ?)",
+                             [(ids[term], doc_id, count) for term, count in term_counts.items()])
+            conn.executemany("UPDATE terms SET df = df + 1, tf = tf + ? WHERE id = ?",
+                             [(count, ids[term]) for term, count in term_counts.items()])
+
+            term_ids = sorted(ids.values())
+            on_site = set()
+            for start in range(0, len(term_ids), 500):
+                chunk = term_ids[start:start + 500]
+                on_site.update(row[0] for row in conn.execute(
+                    f"SELECT term_id FROM term_sites WHERE site = ? AND term_id IN ({','.join('?' * len(chunk))})",
+                    [site, *chunk]))
+            conn.executemany("UPDATE term_sites SET docs = docs + 1 WHERE term_id = ? AND site = ?",
+                             [(t, site) for t in on_site])
+            new_on_site = [t for t in term_ids if t not in on_site]
+            conn.executemany("INSERT INTO term_sites (term_id, site, docs) VALUES (?, ?, 1)",
+                             [(t, site) for t in new_on_site])
+            conn.executemany("UPDATE terms SET sites = sites + 1 WHERE id = ?", [(t,) for t in new_on_site])
+
+            conn.execute("UPDATE documents SET terms = ? WHERE id = ?", (_pack(term_ids), doc_id))
+        return True
+
+    def frequency(self, term):
+        """Term and document frequency plus site spread for one phrase"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT tf, df, sites FROM terms WHERE term = ?", (term.lower(),)).fetchone()
+        if row is None:
+            return {'term': term, 'tf': 0, 'df': 0, 'sites': 0}
+        return {'term': term, 'tf': row[0], 'df': row[1], 'sites': row[2]}
+
+    def documents_for(self, term):
+        """URLs containing the phrase, with in-document counts"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT d.url, p.count FROM terms t JOIN postings p ON p.term_id = t.id "
+                "JOIN documents d ON d.id = p.doc_id WHERE t.term = ? ORDER BY p.doc_id",
+                (term.lower(),)).fetchall()
+        return [{'url': url, 'count': count} for url, count in rows]
+
+    def common_phrases(self, min_sites=2, min_words=2, limit=50):
+        """Phrases that appear on at least min_sites different sites, most widespread first"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT term, tf, df, sites FROM terms WHERE sites >= ? "
+                "AND length(term) - length(replace(term, ' ', '')) >= ? "
+                "ORDER BY sites DESC, df DESC, tf DESC LIMIT ?",
+                (min_sites, min_words - 1, limit)).fetchall()
+        return [{'term': t, 'tf': tf, 'df': df, 'sites': sites} for t, tf, df, sites in rows]
+
+    def stats(self):
+        with self._connect() as conn:
+            documents, sites = conn.execute("SELECT COUNT(*), COUNT(DISTINCT site) FROM documents").fetchone()
+            terms = conn.execute("SELECT COUNT(*) FROM terms").fetchone()[0]
+        return {'documents': documents, 'sites': sites, 'terms': terms}
+
+@st.cache_resource
+def get_ngram_index():
+    return NgramIndex()
+
+@st.cache_data(ttl=60, show_spinner=False)
+def shared_phrases(limit=15):
+    """common_phrases for the UI; cached so polling reruns don't re-query the index"""
+    return get_ngram_index().common_phrases(limit=limit)
+
+def _index(url, content):
+    try:
+        return get_ngram_index().add_document(url, content)
+    except Exception as e:
+        st.warning(f"Could not update the n-gram index for {url}: {e}")
+        return False
+
+# A single writer thread applies index updates in order, off the fetch path
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ngram-index")
+
+def index_page(url, content):
+    """Queue freshly cleaned page text for the shared index; never blocks or fails the fetch.
+
+    Returns a future resolving to whether the document was (re)indexed.
+    """
+    return _writer.submit(_index, url, content)
@@ -0,0 +1,174 @@
+import os
+import re
+import json
+import contextvars
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from bs4 import BeautifulSoup
+from shared_cache import TTLCache
+from warc_fetch import http_get_head, get_session, decode_html
+from keyword_candidates import extract_candidates
+from profiling import profile_thread
+from web_scrape import fetch_listing, find_article_links
+
+# Articles whose <head> is read per site, and how many are read at once
+# across all sites and sessions of the process
+METADATA_ARTICLES = int(os.environ.get("METADATA_ARTICLES", 20))
+METADATA_WORKERS = int(os.environ.get("METADATA_WORKERS", 8))
+METADATA_TTL = int(os.environ.get("METADATA_TTL", 6 * 60 * 60))
+# Declared keywords longer than this are sentences, not keywords
+MAX_KEYWORD_WORDS = 8
+
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+}
+
+# JSON-LD types whose keywords and headline describe the page's content
+ARTICLE_TYPES = frozenset(['Article', 'BlogPosting', 'NewsArticle', 'TechArticle', 'Report', 'WebPage'])
+
+_SPACE_RE = re.compile(r'\s+')
+_KEYWORD_SPLIT_RE = re.compile(r'[,;|]')
+
+_metadata = TTLCache("page_metadata", 5000, METADATA_TTL)
+# Shared by every site_metadata call, so concurrent triage sites don't multiply the requests in flight
+_head_executor = ThreadPoolExecutor(max_workers=METADATA_WORKERS, thread_name_prefix="metadata")
+
+def _clean(text):
+    return _SPACE_RE.sub(' ', text or '').strip()
+
+def _terms(values):
+    """Declared keywords, split, trimmed and deduplicated case-insensitively in order"""
+    terms = {}
+    for value in values:
+        if isinstance(value, dict):
+            value = value.get('name', '')
+        if not isinstance(value, str):
+            continue
+        for term in _KEYWORD_SPLIT_RE.split(value):
+            term = _clean(term)
+            if term and len(term.split()) <= MAX_KEYWORD_WORDS:
+                terms.setdefault(term.lower(), term)
+    return list(terms.values())
+
+def _listify(value):
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+def _json_ld_nodes(soup):
+    """Article-like JSON-LD objects on the page, including those nested in @graph"""
+    nodes = []
+    for script in soup.find_all('script', type='application/ld+json'):
+        try:
+            data = json.loads(script.string or '')
+        except ValueError:
+            continue
+        stack = _listify(data)
+        while stack:
+            node = stack.pop(0)
+            if not isinstance(node, dict):
+                continue
+            stack += _listify(node.get('@graph'))
+            # @type may hold objects or lists besides type names
+            if ARTICLE_TYPES & {t for t in _listify(node.get('@type')) if isinstance(t, str)}:
+                nodes.append(node)
+    return nodes
+
+def _meta(soup, *names):
+    """Content of every <meta> whose name or property is one of names"""
+    values = []
+    for tag in soup.find_all('meta', content=True):
+        if (tag.get('property') or tag.get('name') or '').lower() in names:
+            values.append(tag['content'])
+    return values
+
+def extract_metadata(soup, url):
+    """Topic signals a page declares in its head.
+
+    Reads <meta name="keywords">, og:title/og:description, article:tag and
+    the keywords, headline and articleSection of JSON-LD Article and
+    BlogPosting objects. Nothing in the body is used, so a partial download
+    of the <head> is enough.
+    """
+    nodes = _json_ld_nodes(soup)
+    title = next(iter(_meta(soup, 'og:title')), None) or (soup.title.get_text() if soup.title else '')
+    description = next(iter(_meta(soup, 'og:description', 'description')), '')
+    headline = next((node['headline'] for node in nodes if isinstance(node.get('headline'), str)), '')
+    return {
+        'url': url,
+        'title': _clean(title),
+        'headline': _clean(headline),
+        'description': _clean(description),
+        'keywords': _terms(_meta(soup, 'keywords', 'news_keywords')
+                           + [k for node in nodes for k in _listify(node.get('keywords'))]),
+        'tags': _terms(_meta(soup, 'article:tag', 'article:section')
+                       + [s for node in nodes for s in _listify(node.get('articleSection'))]),
+    }
+
+def head_metadata(url):
+    """extract_metadata of a page from a download of just its <head>, cached per URL"""
+    metadata = _metadata.get(url)
+    if metadata is None:
+        response = http_get_head(get_session(), url, headers=HEADERS, timeout=10)
+        response.raise_for_status()
+        metadata = extract_metadata(BeautifulSoup(decode_html(response), 'html.parser'), url)
+        _metadata.set(url, metadata)
+    return metadata
+
+def site_metadata(url, max_articles=METADATA_ARTICLES):
+    """Metadata of the main page and its top-ranked articles, with the article links.
+
+    The main page is fetched once for both its metadata and its links; the
+    articles are read head-only and concurrently, on a pool shared by all
+    callers. Articles that fail are left out.
+    """
+    soup = fetch_listing(url)
+    links = find_article_links(soup, url)[:max_articles]
+    pages = [extract_metadata(soup, url)]
+    # Each read runs in a copy of the caller's context so it sees its cancellation token
+    futures = [_head_executor.submit(contextvars.copy_context().run, profile_thread, head_metadata, link)
+               for link in links]
+    for future in futures:
+        try:
+            pages.append(future.result())
+        except Exception:
+            continue
+    return pages, links
+
+def metadata_candidates(pages, top_n=30):
+    """Keyword candidates from page metadata, in the shape of extract_candidates.
+
+    Declared keywords and tags come first, ranked by how many pages declare
+    them; phrases recurring across titles, headlines and descriptions fill
+    the rest of the list.
+    """
+    declared = Counter()
+    for page in pages:
+        # In page order, so ties rank the same on every run
+        declared.update(list(dict.fromkeys(term.lower() for term in page['keywords'] + page['tags'])))
+    candidates = [
+        {'phrase': phrase, 'score': round(1 + count / len(pages), 4), 'count': count, 'documents': count}
+        for phrase, count in declared.most_common()
+    ]
+
+    texts = ['. '.join(filter(None, (page['title'], page['headline'], page['description']))) for page in pages]
+    phrases = extract_candidates(texts, top_n=top_n)
+    best = max((candidate['score'] for candidate in phrases), default=1) or 1
+    for candidate in phrases:
+        if candidate['phrase'] not in declared:
+            candidates.append(dict(candidate, score=round(candidate['score'] / best, 4)))
+    return candidates[:top_n]
+
+def format_metadata(pages):
+    """Compact per-page rendering of the metadata, sent to Gemini instead of documents"""
+    sections = []
+    for n, page in enumerate(pages, 1):
+        lines = [f"=== Página {n}: {page['url']} ==="]
+        for label, value in (('Título', page['title']), ('Titular', page['headline']),
+                             ('Descripción', page['description']), ('Keywords', ', '.join(page['keywords'])),
+                             ('Etiquetas', ', '.join(page['tags']))):
+            if value and not (label == 'Titular' and value == page['title']):
+                lines.append(f"{label}: {value}")
+        sections.append("\n".join(lines))
+    return "\n\n".join(sections)
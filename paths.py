@@ -0,0 +1,9 @@
+import os
+
+# Persistent state (n-gram index, crawl state, telemetry) lives here; mount a
+# volume at this path in production so it survives container restarts
+DATA_DIR = os.environ.get("KEYWORD_DATA_DIR", os.path.join(os.path.expanduser("~"), ".keyword_extractor"))
+
+def data_path(name):
+    os.makedirs(DATA_DIR, exist_ok=True)
+    return os.path.join(DATA_DIR, name)
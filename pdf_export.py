@@ -0,0 +1,128 @@
+import io
+import re
+import functools
+
+# reportlab is imported on first render so importing this module (and the
+# apps that depend on it) stays fast
+@functools.lru_cache(maxsize=None)
+def get_styles():
+    """Paragraph styles, built once; they are immutable and shared by every document"""
+    from reportlab.lib import colors
+    from reportlab.lib.styles import ParagraphStyle
+    return {
+        'title': ParagraphStyle(
+            'TitleStyle',
+            fontSize=16,
+            leading=20,
+            textColor=colors.darkblue,
+            spaceAfter=12
+        ),
+        'normal': ParagraphStyle(
+            'NormalStyle',
+            fontSize=11,
+            leading=14,
+            spaceAfter=6
+        ),
+        'url': ParagraphStyle(
+            'URLStyle',
+            fontSize=9,
+            leading=12,
+            textColor=colors.darkblue,
+            spaceAfter=12
+        ),
+        'header1': ParagraphStyle(
+            'Header1Style',
+            fontSize=14,
+            leading=18,
+            textColor=colors.darkblue,
+            spaceAfter=10
+        ),
+        'header2': ParagraphStyle(
+            'Header2Style',
+            fontSize=12,
+            leading=16,
+            textColor=colors.darkblue,
+            spaceAfter=8
+        ),
+    }
+
+# Markdown links, emphasis markers, XML special characters and control
+# characters are all handled by a single substitution pass; link targets may
+# contain one level of balanced parentheses (Wikipedia-style URLs)
+_MARKUP_RE = re.compile(r'\[([^\]]*)\]\((?:[^()]|\([^()]*\))*\)|\*\*|__|[*_&<>\x00-\x08\x0b\x0c\x0e-\x1f]')
+_INLINE_RE = re.compile(r'\*\*|__|[*_&<>\x00-\x08\x0b\x0c\x0e-\x1f]')
+_ESCAPE_RE = re.compile(r'[&<>\x00-\x08\x0b\x0c\x0e-\x1f]')
+_REPLACEMENTS = {'&': '&amp;', '<': '&lt;', '>': '&gt;'}
+_PARAGRAPH_SPLIT_RE = re.compile(r'\n\s*\n')
+
+def _replace_inline(match):
+    return _REPLACEMENTS.get(match.group(0), '')
+
+def _replace_markup(match):
+    link_text = match.group(1)
+    if link_text is not None:
+        # Keep the link text, drop the target
+        return _INLINE_RE.sub(_replace_inline, link_text)
+    return _REPLACEMENTS.get(match.group(0), '')
+
+def to_markup(text):
+    """Convert a markdown fragment into valid reportlab paragraph markup"""
+    return _MARKUP_RE.sub(_replace_markup, text)
+
+def escape_text(text):
+    """Escape plain text (titles, URLs) for reportlab paragraph markup"""
+    return _ESCAPE_RE.sub(_replace_inline, text)
+
+def markdown_to_story(title, url, content):
+    from reportlab.lib.units import inch
+    from reportlab.platypus import Paragraph, Spacer
+    styles = get_styles()
+
+    story = [
+        Paragraph(escape_text(title), styles['title']),
+        Spacer(1, 0.25*inch),
+        Paragraph(f"Source: {escape_text(url)}", styles['url']),
+        Spacer(1, 0.25*inch),
+    ]
+
+    # Drop characters that cannot be encoded once, not per paragraph
+    content = content.encode('utf-8', 'ignore').decode('utf-8')
+
+    for para in _PARAGRAPH_SPLIT_RE.split(content):
+        para = para.strip()
+        if not para:
+            continue
+
+        # Skip image placeholders with no useful text
+        if '![' in para and len(para.replace('![', '').strip()) < 5:
+            continue
+
+        if para.startswith('# '):
+            story.append(Paragraph(to_markup(para[2:]), styles['header1']))
+        elif para.startswith('## '):
+            story.append(Paragraph(to_markup(para[3:]), styles['header2']))
+        else:
+            story.append(Paragraph(to_markup(para), styles['normal']))
+
+    return story
+
+def build_pdf(output_path, title, url, content):
+    from reportlab.lib.pagesizes import letter
+    from reportlab.platypus import SimpleDocTemplate
+
+    # output_path may also be a writable binary file object
+    doc = SimpleDocTemplate(
+        output_path,
+        pagesize=letter,
+        rightMargin=72,
+        leftMargin=72,
+        topMargin=72,
+        bottomMargin=72
+    )
+    doc.build(markdown_to_story(title, url, content))
+
+def render_pdf(title, url, content):
+    """Render the PDF in memory and return its bytes"""
+    buffer = io.BytesIO()
+    build_pdf(buffer, title, url, content)
+    return buffer.getvalue()
@@ -0,0 +1,433 @@
+import os
+import uuid
+import time
+import hashlib
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+from web_scrape import extract_article_links, save_page, reclean_provisional
+from gemini import call_gemini_api, call_gemini_api_stream, call_gemini_text_stream
+from keyword_candidates import extract_candidates, format_candidates, CandidateConvergence
+from manifest import RunManifest, content_hash
+from writers import PdfWriter, site_slug
+from near_duplicates import NearDuplicateDetector
+from crawl_state import get_crawl_state
+from shared_cache import keyword_cache, page_cache, cache_key
+from telemetry import get_telemetry
+from warc_fetch import polite_delay
+from competitors import gap_report
+from digest import build_digests, estimate_tokens
+from cancellation import current_token
+from profiling import profile_thread
+from page_metadata import site_metadata, metadata_candidates, format_metadata, METADATA_ARTICLES
+
+CANDIDATES_PROMPT = """
+
+En lugar de los documentos completos, a continuación tienes las frases candidatas extraídas localmente del contenido, ordenadas por relevancia. Basa tu análisis en ellas:
+
+"""
+
+DIGEST_PROMPT = """
+
+En lugar de los documentos completos, a continuación tienes un extracto de cada uno con su título, encabezados, introducción, listas, términos destacados y las frases más relevantes. Basa tu análisis en ellos:
+
+"""
+
+METADATA_PROMPT = """
+
+En lugar de los documentos completos, a continuación tienes solo los metadatos que cada página declara (título, descripción, keywords y etiquetas de sus meta tags, Open Graph y JSON-LD). Basa tu análisis en ellos:
+
+"""
+
+MERGE_PROMPT = """
+
+Cada documento ya se analizó por separado. A continuación tienes las palabras clave extraídas de cada página; combínalas en un único resultado global con el formato indicado, eliminando duplicados:
+
+"""
+
+# Sites triaged at once by triage_job
+TRIAGE_WORKERS = int(os.environ.get("TRIAGE_WORKERS", 8))
+# Sites fetched and analyzed at once by competitor_job; the rest wait their turn
+COMPETITOR_WORKERS = int(os.environ.get("COMPETITOR_WORKERS", 4))
+
+# Hard article budget for adaptive runs, which usually stop well before it
+ADAPTIVE_MAX_ARTICLES = int(os.environ.get("ADAPTIVE_MAX_ARTICLES", 30))
+
+# Under a run deadline, fetching gets this share of the remaining time when
+# the same run also analyzes; Gemini isn't started with less than
+# MIN_ANALYSIS_TIME seconds left
+FETCH_TIME_SHARE = float(os.environ.get("FETCH_TIME_SHARE", 0.6))
+MIN_ANALYSIS_TIME = float(os.environ.get("MIN_ANALYSIS_TIME", 8))
+
+FALLBACK_HEADER = "🔑 Palabras clave candidatas (análisis local, Gemini no disponible):\n"
+DEADLINE_HEADER = "🔑 Palabras clave candidatas (análisis local, sin tiempo para Gemini):\n"
+PARTIAL_NOTE = "\n\n⏱️ Resultado parcial: se alcanzó el límite de tiempo del análisis."
+
+def _no_progress(label, fraction=None, partial=None):
+    pass
+
+def fetch_site(url, output_dir, progress=None, max_articles=10, require_articles=False, adaptive=False,
+               time_share=1.0):
+    """Fetch the main page and up to max_articles articles into output_dir as PDFs.
+
+    Articles are fetched in ranked order. With adaptive, fetching stops early
+    once the local keyword candidates stop changing from one article to the
+    next, and max_articles is only the hard budget. Under a run deadline,
+    fetching uses at most time_share of the remaining time and stops before
+    an article that wouldn't fit, skipping the lower-ranked rest.
+    Returns the run manifest and the list of article URLs that were attempted.
+    Raises RuntimeError when the run cannot produce anything to analyze.
+    """
+    progress = progress or _no_progress
+    
+    # Clear previous data
+    os.makedirs(output_dir, exist_ok=True)
+    for file in os.listdir(output_dir):
+        os.remove(os.path.join(output_dir, file))
+    
+    manifest = RunManifest(url)
+    writer = PdfWriter(output_dir)
+    duplicates = NearDuplicateDetector()
+    convergence = CandidateConvergence() if adaptive else None
+    remaining = current_token().remaining()
+    fetch_until = time.monotonic() + remaining * time_share if remaining is not None else None
+    
+    # Extract article links
+    progress("Extracting article links...", 0.0)
+    links = extract_article_links(url)
+    if require_articles and not links:
+        raise RuntimeError("No article links found on the provided URL")
+    
+    # Save main page regardless of whether articles are found
+    progress("Saving main page...", 0.05)
+    main_page = save_page(url, writer, manifest.artifact_name(url, 'main'), manifest, role='main',
+                          duplicates=duplicates)
+    if not main_page:
+        raise RuntimeError("Failed to save the main page. Please check the URL and try again.")
+    # Pages cleaned before the site's template was learned; cleaned again at the end
+    provisional = [main_page] if 'provisional' in main_page else []
+    
+    # Near-duplicates (AMP/print views, reposts) are skipped and don't use up a
+    # slot; indexes stay dense so they line up with the returned links
+    max_articles = min(max_articles, len(links))
+    attempted = []
+    skipped = 0
+    converged = False
+    out_of_time = False
+    article_time = 0.0
+    for article_url in links:
+        if len(attempted) >= max_articles:
+            break
+        # Running estimate of one article's time, so the next one isn't started if it can't finish
+        if fetch_until is not None and time.monotonic() + article_time > fetch_until:
+            out_of_time = True
+            break
+        started = time.monotonic()
+        i = len(attempted)
+        progress(f"Saving article {i+1} of {max_articles}...", (i + 1) / (max_articles + 1))
+        page = save_page(article_url, writer, manifest.artifact_name(article_url, index=i), manifest, index=i,
+                         duplicates=duplicates)
+        if manifest.get(article_url)['status'] == 'duplicate':
+            skipped += 1
+        else:
+            attempted.append(article_url)
+            if page is not None and 'provisional' in page:
+                provisional.append(page)
+            if convergence is not None and page is not None and convergence.add(page['content']):
+                converged = True
+                break
+        polite_delay(1)  # Be nice to the server
+        elapsed = time.monotonic() - started
+        article_time = elapsed if not article_time else (article_time + elapsed) / 2
+    
+    if provisional:
+        progress("Removing site template from the first pages...", 1.0)
+        reclean_provisional(provisional, manifest, writer)
+    
+    message = f"Successfully fetched {len(attempted)} articles!"
+    if converged:
+        message += f" Stopped early: top keywords stable ({convergence.stability:.0%} overlap)."
+    if out_of_time:
+        message += f" Time budget reached: skipped {max_articles - len(attempted)} lower-ranked articles."
+    if skipped:
+        message += f" Skipped {skipped} near-duplicate pages."
+    unchanged = crawl_summary(manifest)['unchanged']
+    if unchanged:
+        message += f" {unchanged} pages unchanged since the last crawl."
+    progress(message, 1.0)
+    return manifest, attempted
+
+def load_pages(manifest, article_indexes=None, progress=None):
+    """The manifest's cleaned pages, exactly as the run recorded them.
+
+    Nothing is fetched again: each page comes from the page cache or the
+    crawl state, but only with the content hash in the manifest, so the
+    text analyzed is the text of the run's PDFs. Pages whose recorded
+    version is no longer kept are left out and reported through progress.
+    """
+    state = get_crawl_state()
+    pages, missing = [], 0
+    for entry in manifest.select(article_indexes=article_indexes):
+        digest = entry['content_hash']
+        cached = page_cache().get(entry['url'])
+        if cached is not None and content_hash(cached['content']) == digest:
+            pages.append(cached)
+            continue
+        known = state.get_page(entry['url'])
+        version = known if known and known['content_hash'] == digest else state.get_version(digest)
+        if version is None:
+            missing += 1
+            continue
+        pages.append({'url': entry['url'], 'title': version['title'], 'content': version['content']})
+    if missing and progress is not None:
+        progress(f"{missing} page(s) of this run are no longer stored and were left out; fetch again to include them")
+    return pages
+
+def load_documents(manifest, article_indexes=None, progress=None):
+    return [page['content'] for page in load_pages(manifest, article_indexes, progress)]
+
+def local_candidates(manifest, article_indexes=None, top_n=30, progress=None):
+    return extract_candidates(load_documents(manifest, article_indexes, progress), top_n=top_n)
+
+def crawl_summary(manifest):
+    """How many of the run's pages are new, changed or unchanged since earlier runs"""
+    summary = {'new': 0, 'changed': 0, 'unchanged': 0}
+    for entry in manifest.pages():
+        if entry.get('crawl') in summary:
+            summary[entry['crawl']] += 1
+    return summary
+
+def incremental_chunks(prompt, manifest, article_indexes, progress, run_id=None):
+    """Analyze each page on its own, reusing stored per-page results, then merge.
+
+    Only pages whose content hash has no stored result for this prompt go to
+    Gemini with their PDF; the merge step is a small text-only request.
+    Returns the merge stream and whether every page has a result.
+    """
+    state = get_crawl_state()
+    prompt_key = cache_key(prompt)
+    entries = manifest.select(article_indexes=article_indexes)
+    sections = []
+    for n, entry in enumerate(entries):
+        keywords = state.get_article_keywords(entry['url'], entry['content_hash'], prompt_key)
+        if keywords is None:
+            progress(f"Analyzing {entry['title'] or entry['url']}...", 0.1 + 0.4 * n / len(entries))
+            keywords = call_gemini_api(prompt, [entry['artifact']], site=manifest.site_url, run_id=run_id)
+            if not keywords:
+                continue
+            state.set_article_keywords(entry['url'], entry['content_hash'], prompt_key, keywords)
+        sections.append(f"## {entry['url']}\n{keywords}")
+    
+    if not sections:
+        return iter(()), False
+    chunks = call_gemini_text_stream(prompt + MERGE_PROMPT + "\n\n".join(sections), site=manifest.site_url,
+                                     run_id=run_id)
+    return chunks, len(sections) == len(entries)
+
+def analyze_site(prompt, manifest, article_indexes=None, progress=None, use_candidates=False, incremental=False,
+                 run_id=None, use_digest=False):
+    """Run the keyword prompt over the manifest's artifacts, reusing cached results.
+
+    The response is streamed: progress receives the text generated so far as
+    partial, and only the complete text is cached. With use_candidates the
+    local candidate list is sent instead of the documents, and with use_digest
+    a token-budgeted digest of each document (see digest.py); with incremental
+    each page is analyzed on its own and only new or changed pages go to
+    Gemini. Complete results are also persisted in the crawl state. If Gemini
+    gives no answer, or the run's deadline leaves no time for it, the local
+    candidates are returned instead; a response cut short by the deadline is
+    returned marked as partial. Neither is cached.
+    Gemini calls are recorded in the usage telemetry under run_id.
+    """
+    progress = progress or _no_progress
+    
+    files_to_process = manifest.artifacts(article_indexes=article_indexes)
+    if not files_to_process:
+        raise ValueError("No content to analyze. Please fetch the website first.")
+    
+    # Reuse keywords another session already produced for the same content
+    keywords_key = cache_key(prompt, use_candidates, incremental, *(('digest',) if use_digest else ()),
+                             *manifest.content_hashes(article_indexes=article_indexes))
+    result = keyword_cache().get(keywords_key)
+    if result is None:
+        # An earlier run on the same content, possibly before a restart
+        result = get_crawl_state().get_analysis(keywords_key)
+        if result is not None:
+            keyword_cache().set(keywords_key, result)
+    if result is not None:
+        progress("Analysis complete!", 1.0)
+        return result
+    
+    candidates = None
+    complete = True
+    remaining = current_token().remaining()
+    if remaining is not None and remaining < MIN_ANALYSIS_TIME:
+        candidates = local_candidates(manifest, article_indexes, progress=progress)
+        if not candidates:
+            raise RuntimeError("Not enough time left to analyze the content")
+        progress("Not enough time left for Gemini, using local keyword candidates", 1.0)
+        return DEADLINE_HEADER + format_candidates(candidates, limit=15)
+    if incremental:
+        chunks, complete = incremental_chunks(prompt, manifest, article_indexes, progress, run_id)
+    elif use_candidates:
+        progress("Extracting local keyword candidates...", 0.05)
+        candidates = local_candidates(manifest, article_indexes, progress=progress)
+        chunks = call_gemini_text_stream(prompt + CANDIDATES_PROMPT + format_candidates(candidates),
+                                         site=manifest.site_url, run_id=run_id)
+    elif use_digest:
+        progress("Building document digests...", 0.05)
+        digests, full_tokens = build_digests(load_pages(manifest, article_indexes, progress))
+        progress(f"Sending digests: ~{estimate_tokens(digests):,} tokens instead of ~{full_tokens:,}", 0.1)
+        chunks = call_gemini_text_stream(prompt + DIGEST_PROMPT + digests, site=manifest.site_url, run_id=run_id)
+    else:
+        chunks = call_gemini_api_stream(prompt, files_to_process, site=manifest.site_url, run_id=run_id)
+    
+    if not incremental and not use_digest:
+        progress(f"Processing {len(files_to_process)} files...", 0.1)
+    result = ""
+    for chunk in chunks:
+        result += chunk
+        progress("Receiving keywords...", 0.5, partial=result)
+    
+    out_of_time = current_token().expired
+    if not result:
+        if candidates is None:
+            candidates = local_candidates(manifest, article_indexes, progress=progress)
+        if not candidates:
+            raise RuntimeError("Failed to get a response from Gemini API")
+        progress("Gemini unavailable, using local keyword candidates", 1.0)
+        return (DEADLINE_HEADER if out_of_time else FALLBACK_HEADER) + format_candidates(candidates, limit=15)
+    if out_of_time:
+        progress("Time budget reached, returning a partial result", 1.0)
+        return result + PARTIAL_NOTE
+    
+    if complete:
+        keyword_cache().set(keywords_key, result)
+        get_crawl_state().set_analysis(keywords_key, manifest.site_url, result)
+    progress("Analysis complete!", 1.0)
+    return result
+
+# Job entry points: the first argument is the progress callback and the
+# return value must be JSON serializable so it can be stored in the job table
+
+def fetch_job(progress, url, output_dir, max_articles=10, require_articles=False, adaptive=False):
+    if adaptive:
+        max_articles = max(max_articles, ADAPTIVE_MAX_ARTICLES)
+    manifest, links = fetch_site(url, output_dir, progress, max_articles, require_articles, adaptive)
+    # Instant, local keyword candidates while Gemini hasn't run yet
+    candidates = local_candidates(manifest, top_n=20)
+    return {'manifest': manifest.to_dict(), 'links': links, 'candidates': candidates,
+            'crawl': crawl_summary(manifest)}
+
+def analyze_job(progress, prompt, manifest_data, article_indexes=None, use_candidates=False, incremental=False,
+                use_digest=False):
+    manifest = RunManifest.from_dict(manifest_data)
+    run_id = uuid.uuid4().hex
+    keywords = analyze_site(prompt, manifest, article_indexes, progress, use_candidates, incremental, run_id,
+                            use_digest)
+    return {'keywords': keywords, 'usage': get_telemetry().run_usage(run_id)}
+
+def triage_site(url, prompt=None, max_articles=METADATA_ARTICLES, run_id=None):
+    """Keywords of a site from declared metadata only, without converting any page.
+
+    Local candidates always; with a prompt, also Gemini's answer to it over
+    the formatted metadata (None if Gemini gives no answer). Complete
+    answers are cached like full analyses.
+    """
+    pages, links = site_metadata(url, max_articles)
+    candidates = metadata_candidates(pages)
+    site = {'pages': len(pages), 'links': links, 'candidates': candidates, 'keywords': None}
+    if prompt:
+        text = prompt + METADATA_PROMPT + format_metadata(pages)
+        keywords_key = cache_key('metadata', text)
+        site['keywords'] = keyword_cache().get(keywords_key)
+        if site['keywords'] is None:
+            site['keywords'] = "".join(call_gemini_text_stream(text, site=url, run_id=run_id)) or None
+            if site['keywords'] and not current_token().expired:
+                keyword_cache().set(keywords_key, site['keywords'])
+    return site
+
+def triage_job(progress, prompt, urls, max_articles=METADATA_ARTICLES, use_gemini=False):
+    """Metadata-only keywords for a list of sites, TRIAGE_WORKERS at a time.
+
+    Only each main page and the <head> of its top articles are downloaded,
+    so a long list takes seconds rather than minutes. Sites that fail are
+    listed in errors.
+    """
+    run_id = uuid.uuid4().hex
+    sites, errors = {}, {}
+    with ThreadPoolExecutor(max_workers=max(1, min(TRIAGE_WORKERS, len(urls))),
+                            thread_name_prefix="triage") as executor:
+        futures = {executor.submit(contextvars.copy_context().run, profile_thread, triage_site, url,
+                                   prompt if use_gemini else None, max_articles, run_id): url for url in urls}
+        for done, future in enumerate(as_completed(futures), 1):
+            url = futures[future]
+            try:
+                sites[url] = future.result()
+            except Exception as e:
+                errors[url] = str(e)
+            progress(f"Triaged {done} of {len(urls)} sites", done / len(urls))
+    return {'sites': {url: sites[url] for url in urls if url in sites}, 'errors': errors,
+            'usage': get_telemetry().run_usage(run_id) if use_gemini else None}
+
+def competitor_job(progress, prompt, urls, output_dir, max_articles=10, use_candidates=False, incremental=False,
+                   adaptive=False, use_digest=False):
+    """Fetch and analyze several sites concurrently and compare their keywords.
+
+    The first URL is the client, the rest its competitors. Each site is
+    fetched and then analyzed on its own thread, up to COMPETITOR_WORKERS at
+    a time; all of them share the HTTP connection pool, page cache and
+    Gemini scheduler. Each site gets its own directory under output_dir, even
+    when several URLs are on the same host. A site that fails is listed in
+    errors and left out of the gap report.
+    """
+    lock = threading.Lock()
+    fractions = dict.fromkeys(urls, 0.0)
+
+    def site_progress(url, offset):
+        # Fetching is the first half of a site's progress, analysis the second
+        def report(label, fraction=None, partial=None):
+            with lock:
+                if fraction is not None:
+                    fractions[url] = offset + fraction / 2
+                overall = sum(fractions.values()) / len(urls)
+            progress(f"{urlparse(url).netloc}: {label}", overall)
+        return report
+
+    if adaptive:
+        max_articles = max(max_articles, ADAPTIVE_MAX_ARTICLES)
+
+    def run_site(url):
+        # fetch_site empties its directory, so URLs on one host mustn't share it
+        site_dir = f"{site_slug(url)}-{hashlib.sha1(url.encode('utf-8')).hexdigest()[:8]}"
+        manifest, links = fetch_site(url, os.path.join(output_dir, site_dir), site_progress(url, 0.0),
+                                     max_articles, adaptive=adaptive, time_share=FETCH_TIME_SHARE)
+        run_id = uuid.uuid4().hex
+        keywords = analyze_site(prompt, manifest, progress=site_progress(url, 0.5), use_candidates=use_candidates,
+                                incremental=incremental, run_id=run_id, use_digest=use_digest)
+        # The gap report parses the text line by line; the note would count as a keyword
+        partial = keywords.endswith(PARTIAL_NOTE)
+        if partial:
+            keywords = keywords[:-len(PARTIAL_NOTE)]
+        return {'manifest': manifest.to_dict(), 'links': links, 'keywords': keywords, 'partial': partial,
+                'usage': get_telemetry().run_usage(run_id)}
+
+    sites, errors = {}, {}
+    with ThreadPoolExecutor(max_workers=max(1, min(COMPETITOR_WORKERS, len(urls))),
+                            thread_name_prefix="competitor") as executor:
+        # Each site thread runs in a copy of the job's context so it sees its cancellation token
+        futures = {executor.submit(contextvars.copy_context().run, profile_thread, run_site, url): url for url in urls}
+        for future in as_completed(futures):
+            url = futures[future]
+            try:
+                sites[url] = future.result()
+            except Exception as e:
+                errors[url] = str(e)
+    if not sites:
+        raise RuntimeError("No site could be analyzed: " + "; ".join(f"{url}: {e}" for url, e in errors.items()))
+
+    client = urls[0] if urls[0] in sites else None
+    report = gap_report({url: sites[url]['keywords'] for url in urls if url in sites}, client_url=client)
+    progress("Comparison complete!", 1.0)
+    return {'sites': sites, 'errors': errors, 'report': report}
@@ -0,0 +1,117 @@
+import os
+import io
+import time
+import pstats
+import cProfile
+import threading
+import contextvars
+import tracemalloc
+from paths import data_path
+from cancellation import current_token
+
+PROFILE_DIR = os.environ.get("PROFILE_DIR") or data_path("profiles")
+PROFILE_TOP = int(os.environ.get("PROFILE_TOP", 40))
+# Frames kept per allocation; deeper traces cost more while tracing
+TRACEMALLOC_FRAMES = int(os.environ.get("TRACEMALLOC_FRAMES", 10))
+
+# tracemalloc is process-wide, so profiled runs take turns
+_profile_lock = threading.Lock()
+# Profilers of the threads a profiled run hands work to, merged into its stats
+_thread_profiles = contextvars.ContextVar("thread_profiles", default=None)
+
+def profile_thread(func, *args, **kwargs):
+    """func(*args, **kwargs), profiled as part of the enclosing run_profiled, if any.
+
+    For work a job hands to another thread and waits for; the thread must
+    run it in a copy of the job's context (contextvars.copy_context).
+    """
+    profiles = _thread_profiles.get()
+    if profiles is None:
+        return func(*args, **kwargs)
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Another profiler already owns this thread
+        return func(*args, **kwargs)
+    try:
+        return func(*args, **kwargs)
+    finally:
+        profiler.disable()
+        profiles.append(profiler)
+
+def _report(name, elapsed, stats, snapshot, peak, threads):
+    out = io.StringIO()
+    out.write(f"Profile of {name}: {elapsed:.2f}s wall time, {peak / 1024 / 1024:.1f} MiB peak traced memory\n")
+    out.write(f"CPU profile of the job's thread and {threads} worker task(s). Memory is traced process-wide,\n"
+              f"so it includes allocations by other jobs running at the same time.\n\n")
+    out.write(f"Top {PROFILE_TOP} functions by cumulative time\n")
+    stats.stream = out
+    stats.sort_stats('cumulative').print_stats(PROFILE_TOP)
+    out.write(f"Top {PROFILE_TOP} allocation sites still held at the end of the run\n\n")
+    for stat in snapshot.statistics('lineno')[:PROFILE_TOP]:
+        out.write(f"{stat}\n")
+    return out.getvalue()
+
+def run_profiled(name, func, *args, output_dir=None, **kwargs):
+    """Run func(*args, **kwargs) under cProfile and tracemalloc.
+
+    The CPU profile covers the calling thread plus the tasks func hands to
+    worker pools through profile_thread (site and article fetches, Gemini
+    calls); background work the job doesn't wait for, such as n-gram
+    indexing, is not included. Memory is traced process-wide, so profiled
+    runs take turns and the figures include other jobs running meanwhile.
+    Saves <name>.prof (pstats, e.g. for snakeviz), <name>.snapshot
+    (tracemalloc.Snapshot.load) and a readable <name>.txt report into
+    output_dir and returns func's result with the artifact paths. Nothing is
+    traced unless this is called, so unprofiled runs pay nothing.
+    """
+    output_dir = output_dir or PROFILE_DIR
+    os.makedirs(output_dir, exist_ok=True)
+    token = current_token()
+    while not _profile_lock.acquire(timeout=1):
+        token.check()
+    try:
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{name}"
+        profiler = cProfile.Profile()
+        thread_profiles = []
+        reset = _thread_profiles.set(thread_profiles)
+        # Left running if something else (e.g. PYTHONTRACEMALLOC) started it
+        owns_tracing = not tracemalloc.is_tracing()
+        if owns_tracing:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        start = time.perf_counter()
+        try:
+            profiler.enable()
+            try:
+                result = func(*args, **kwargs)
+            finally:
+                profiler.disable()
+            elapsed = time.perf_counter() - start
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            if owns_tracing:
+                tracemalloc.stop()
+            _thread_profiles.reset(reset)
+    finally:
+        _profile_lock.release()
+
+    artifacts = {
+        'profile': os.path.join(output_dir, f"{name}.prof"),
+        'snapshot': os.path.join(output_dir, f"{name}.snapshot"),
+        'report': os.path.join(output_dir, f"{name}.txt"),
+    }
+    stats = pstats.Stats(profiler)
+    for thread_profiler in thread_profiles:
+        stats.add(thread_profiler)
+    stats.dump_stats(artifacts['profile'])
+    snapshot.dump(artifacts['snapshot'])
+    with open(artifacts['report'], 'w', encoding='utf-8') as f:
+        f.write(_report(name, elapsed, stats, snapshot, peak, len(thread_profiles)))
+    return result, dict(artifacts, elapsed=round(elapsed, 3), peak_memory=peak)
+
+def profile_job(progress, name, func, *args, **kwargs):
+    """Job entry point wrapping another job function in run_profiled"""
+    result, profile = run_profiled(name, func, progress, *args, **kwargs)
+    return dict(result, profile=profile)
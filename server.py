@@ -2,7 +2,10 @@ import streamlit as st
 import os
 import time
 import re
-from gemini import call_gemini_api, get_all_files_from_directory
+from manifest import RunManifest
+from shared_cache import cache_key
+from jobs import get_job_manager, JobQueueFull, ACTIVE_STATES
+from telemetry import usage_report, format_usage
 import tempfile
 import shutil
 
@@ -100,6 +103,10 @@ if 'preview_image' not in st.session_state:
     st.session_state.preview_image = None
 if 'keywords' not in st.session_state:
     st.session_state.keywords = "No keywords found yet"
+if 'usage' not in st.session_state:
+    st.session_state.usage = None
+if 'profile' not in st.session_state:
+    st.session_state.profile = None
 if 'temp_dir' not in st.session_state:
     st.session_state.temp_dir = tempfile.mkdtemp()
 if 'scraped_dir' not in st.session_state:
@@ -113,18 +120,83 @@ if 'status' not in st.session_state:
     st.session_state.status = "Ready"
 if 'last_analyzed_url' not in st.session_state:
     st.session_state.last_analyzed_url = None
+if 'manifest' not in st.session_state:
+    st.session_state.manifest = RunManifest()
+if 'candidates' not in st.session_state:
+    st.session_state.candidates = []
+if 'job_id' not in st.session_state:
+    st.session_state.job_id = None
+    st.session_state.job_kind = None
+    st.session_state.pending_url = None
 
 # Title with logo and information
 with st.container():
     col1, col2 = st.columns([1, 5])
     with col1:
-        st.image("https://img.icons8.com/color/96/000000/search-engine-optimization.png", width=80)
+        # st.image imports numpy even for a URL; a plain <img> keeps it out of the first render
+        st.markdown('<img src="https://img.icons8.com/color/96/000000/search-engine-optimization.png" width="80">',
+                    unsafe_allow_html=True)
     with col2:
         st.title("Blog SEO Keyword Extractor")
         st.markdown("""
         Extract long-tail keywords and search phrases from blog articles using AI analysis.
         """)
 
+# Extract a display title from the article URL
+def title_from_url(article_url):
+    article_title = os.path.basename(article_url)
+    article_title = re.sub(r'\.html$|\.php$|\.asp$', '', article_title)
+    article_title = article_title.replace('-', ' ').replace('_', ' ')
+    return ' '.join(word.capitalize() for word in article_title.split())
+
+# Scraping and analysis run on the shared worker pool; the script only polls
+def submit_job(kind, func, *args, dedupe_key=None, **kwargs):
+    # 0 leaves the server default (RUN_DEADLINE)
+    kwargs.setdefault('deadline', st.session_state.get('deadline') or None)
+    if st.session_state.get('profile_run'):
+        # Profiled runs wrap the job and never reuse another session's job
+        from profiling import profile_job
+        func, args, dedupe_key = profile_job, (kind, func, *args), None
+    try:
+        st.session_state.job_id = get_job_manager().submit(kind, func, *args, dedupe_key=dedupe_key, **kwargs)
+    except JobQueueFull as e:
+        st.error(str(e))
+        return
+    st.session_state.job_kind = kind
+    st.session_state.status = "Processing"
+
+def apply_job_result(job):
+    if job['status'] == 'failed':
+        label = "Error fetching articles" if st.session_state.job_kind == "fetch" else "Analysis failed"
+        st.error(f"{label}: {job['error']}")
+    elif job['status'] == 'cancelled':
+        st.warning("The run was cancelled.")
+    elif st.session_state.job_kind == "fetch":
+        links = job['result']['links']
+        st.session_state.manifest = RunManifest.from_dict(job['result']['manifest'])
+        # Initialize all articles as selected by default
+        st.session_state.article_details = {
+            i: {'title': title_from_url(link), 'url': link, 'selected': True}
+            for i, link in enumerate(links)
+        }
+        st.session_state.articles = links
+        st.session_state.candidates = job['result']['candidates']
+        st.session_state.last_analyzed_url = st.session_state.pending_url
+        st.success(f"Successfully fetched {len(links)} articles!")
+        crawl = job['result'].get('crawl') or {}
+        if crawl.get('unchanged') or crawl.get('changed'):
+            st.info(f"Re-crawl: {crawl['new']} new, {crawl['changed']} changed and "
+                    f"{crawl['unchanged']} unchanged pages since the last run.")
+    else:
+        st.session_state.keywords = job['result']['keywords']
+        st.session_state.usage = job['result'].get('usage')
+        st.success("Analysis complete!")
+    if job['result'] and job['result'].get('profile'):
+        st.session_state.profile = job['result']['profile']
+    
+    st.session_state.job_id = None
+    st.session_state.status = "Ready"
+
 # Create tabs for different sections
 tab1, tab2, tab3 = st.tabs(["Extract Keywords", "How It Works", "Settings"])
 
@@ -132,6 +204,19 @@ with tab1:
     # Input URL
     url_input = st.text_input("Enter website URL:", placeholder="https://example.com/blog")
 
+    # Poll the background job; keywords streamed so far are shown while it runs
+    live_keywords = None
+    if st.session_state.job_id:
+        job = get_job_manager().get(st.session_state.job_id)
+        if job is None:
+            st.session_state.job_id = None
+            st.session_state.status = "Ready"
+        elif job['status'] in ACTIVE_STATES:
+            st.progress(job['progress_fraction'] or 0.0, text=job['progress_label'])
+            live_keywords = job['partial']
+        else:
+            apply_job_result(job)
+
     # Status indicator
     status_class = "status-ready" if st.session_state.status == "Ready" else "status-pending"
     st.markdown(f'<div class="{status_class}">Status: {st.session_state.status}</div>', unsafe_allow_html=True)
@@ -181,31 +266,16 @@ def copy_to_clipboard(text):
 
 # Function to analyze selected articles with Gemini
 def analyze_articles():
-    with st.status("Analyzing articles with Gemini API...") as status:
-        st.session_state.status = "Processing"
-        
-        # Get files from the scraped directory - only for selected articles
-        all_files = get_all_files_from_directory(st.session_state.scraped_dir)
-        
-        # Always include the main page if it exists
-        files_to_process = [f for f in all_files if "main_page" in f]
-        
-        # Add selected article files
-        for index, article in enumerate(st.session_state.articles):
-            if index in st.session_state.article_details and st.session_state.article_details[index]['selected']:
-                article_files = [f for f in all_files if f"article_{index+1}_" in f]
-                files_to_process.extend(article_files)
-        
-        if not files_to_process:
-            st.error("No files selected for analysis. Please select at least one article.")
-            st.session_state.status = "Ready"
-            status.update(label="Error: No files selected", state="error")
-            return
-        
-        status.update(label=f"Processing {len(files_to_process)} files...", state="running")
-        
-        # Prepare the prompt for Gemini
-        user_prompt = """ Puedes responder en español o en inglés, dependiendo principalmente del idioma de los documentos PDF proporcionados. Analiza todos los documentos PDF proporcionados como si fueran páginas web optimizadas para SEO.
+    # Always include the main page, plus the selected articles from the run manifest
+    selected = [index for index, details in st.session_state.article_details.items() if details['selected']]
+    manifest = st.session_state.manifest
+    
+    if not manifest.artifacts(article_indexes=selected):
+        st.error("No files selected for analysis. Please select at least one article.")
+        return
+    
+    # Prepare the prompt for Gemini
+    user_prompt = """ Puedes responder en español o en inglés, dependiendo principalmente del idioma de los documentos PDF proporcionados. Analiza todos los documentos PDF proporcionados como si fueran páginas web optimizadas para SEO.
 
 Extrae de 5 a 10 palabras clave de cola larga o frases de búsqueda implícitas a las que estas páginas probablemente estén orientadas. Enfócate en frases naturales y de nicho que un usuario podría buscar en Google, asegurándote de que estén adaptadas al idioma y contexto de los artículos.
 
@@ -218,81 +288,28 @@ Tu respuesta debe estar formateada de la siguiente manera:
 [tercera palabra clave/frase] (en español) ...
 
 Asegúrate de que las palabras clave reflejen los temas principales tratados en todo el contenido analizado, con énfasis en la especificidad, la intención de búsqueda y la adecuación lingüística."""
-        
-        # Call Gemini API
-        result = call_gemini_api(user_prompt, files_to_process)
-        
-        if result:
-            st.session_state.keywords = result
-            status.update(label="Analysis complete!", state="complete")
-        else:
-            st.error("Failed to get a response from Gemini API")
-            status.update(label="Analysis failed", state="error")
-        
-        st.session_state.status = "Ready"
+    
+    # Identical analyses from other sessions share one job; the pipeline (and
+    # the Gemini SDK behind it) is only imported once work is submitted
+    from pipeline import analyze_job
+    use_candidates = st.session_state.get('use_candidates', False)
+    incremental = st.session_state.get('incremental', False)
+    use_digest = st.session_state.get('use_digest', False)
+    submit_job("analyze", analyze_job, user_prompt, manifest.to_dict(), selected, use_candidates, incremental,
+               use_digest,
+               dedupe_key=cache_key("analyze", user_prompt, use_candidates, incremental, use_digest,
+                                    *manifest.content_hashes(article_indexes=selected)))
 
 # Handle fetch button click
 if fetch_button and url_input:
     if st.session_state.last_analyzed_url != url_input:
-        with st.status("Fetching articles...") as status:
-            st.session_state.status = "Processing"
-            try:
-                # Clear previous data
-                for file in os.listdir(st.session_state.scraped_dir):
-                    os.remove(os.path.join(st.session_state.scraped_dir, file))
-                
-                st.session_state.articles = []
-                st.session_state.article_details = {}
-                
-                # Extract article links
-                status.update(label="Extracting article links...", state="running")
-                links = extract_article_links(url_input)
-                
-                if links:
-                    # Save main page
-                    status.update(label="Saving main page...", state="running")
-                    main_page_path = os.path.join(st.session_state.scraped_dir, "main_page.pdf")
-                    save_as_pdf(url_input, main_page_path)
-                    
-                    # Save articles with progress updates
-                    max_articles = min(10, len(links))
-                    for i in range(max_articles):
-                        article_url = links[i]
-                        article_filename = f"article_{i+1}_{os.path.basename(article_url)}.pdf"
-                        article_path = os.path.join(st.session_state.scraped_dir, article_filename)
-                        
-                        status.update(label=f"Fetching article {i+1} of {max_articles}...", state="running")
-                        save_as_pdf(article_url, article_path)
-                        
-                        # Extract title from filename for display
-                        article_title = os.path.basename(article_url)
-                        article_title = re.sub(r'\.html$|\.php$|\.asp$', '', article_title)
-                        article_title = article_title.replace('-', ' ').replace('_', ' ')
-                        article_title = ' '.join(word.capitalize() for word in article_title.split())
-                        
-                        # Initialize all articles as selected by default
-                        st.session_state.article_details[i] = {
-                            'title': article_title,
-                            'url': article_url,
-                            'selected': True
-                        }
-                        
-                        time.sleep(1)  # Be nice to the server
-                    
-                    # Update session state
-                    st.session_state.articles = links[:max_articles]
-                    st.session_state.last_analyzed_url = url_input
-                    status.update(label=f"Successfully fetched {max_articles} articles!", state="complete")
-                    st.success(f"Successfully fetched {max_articles} articles!")
-                    st.experimental_rerun()
-                else:
-                    st.error("No article links found on the provided URL")
-                    status.update(label="No articles found", state="error")
-            except Exception as e:
-                st.error(f"Error fetching articles: {str(e)}")
-                status.update(label=f"Error: {str(e)}", state="error")
-            
-            st.session_state.status = "Ready"
+        st.session_state.articles = []
+        st.session_state.article_details = {}
+        st.session_state.manifest = RunManifest()
+        st.session_state.pending_url = url_input
+        from pipeline import fetch_job
+        submit_job("fetch", fetch_job, url_input, st.session_state.scraped_dir, require_articles=True,
+                   adaptive=st.session_state.get('adaptive', False))
     else:
         st.info("Articles already fetched for this URL. Use 'Clear All' to start again.")
 
@@ -302,12 +319,21 @@ if analyze_button:
 
 # Handle clear button click
 if clear_button:
-    # Reset session state
+    # Reset session state; a running job no other session shares is cancelled
+    # and stops within a moment
+    if st.session_state.job_id:
+        get_job_manager().release(st.session_state.job_id)
     st.session_state.articles = []
     st.session_state.article_details = {}
     st.session_state.screenshot_path = None
     st.session_state.keywords = "No keywords found yet"
     st.session_state.last_analyzed_url = None
+    st.session_state.candidates = []
+    st.session_state.usage = None
+    st.session_state.profile = None
+    st.session_state.manifest = RunManifest()
+    st.session_state.job_id = None
+    st.session_state.status = "Ready"
     
     # Clear files
     for file in os.listdir(st.session_state.scraped_dir):
@@ -353,10 +379,17 @@ with tab1:
     with content_col2:
         st.markdown("### Blog Articles Found (Select to Analyze)")
         display_articles()
+        
+        # Local candidates are available as soon as the fetch finishes
+        if st.session_state.candidates:
+            st.markdown("#### Local keyword candidates")
+            st.markdown("\n".join(f"- {c['phrase']}" for c in st.session_state.candidates[:15]))
 
     with content_col3:
         st.markdown("### SEO Keywords Found")
-        st.markdown('<div class="keyword-container">{}</div>'.format(st.session_state.keywords), unsafe_allow_html=True)
+        st.markdown('<div class="keyword-container">{}</div>'.format(live_keywords or st.session_state.keywords), unsafe_allow_html=True)
+        if st.session_state.usage:
+            st.caption(format_usage(st.session_state.usage))
         if st.session_state.keywords != "No keywords found yet":
             copy_btn = st.button("Copy to Clipboard", key="copy_keywords")
             if copy_btn:
@@ -420,12 +453,58 @@ with tab3:
     # Number of keywords to extract
     num_keywords = st.slider("Number of keywords to extract", min_value=3, max_value=15, value=8)
     
+    # Send the locally ranked candidates instead of the full documents
+    st.checkbox("Send only local keyword candidates to Gemini (faster, smaller request)", key="use_candidates")
+    
+    # Keep per-article results between runs and only send new or changed articles
+    st.checkbox("Re-analyze only new or changed articles (reuses earlier per-article results)", key="incremental")
+    
+    # Budgeted per-article digests (headings, intro, lists, key sentences) instead of full PDFs
+    st.checkbox("Send a compact digest of each article instead of the full PDFs "
+                "(headings, intro, lists and key sentences; much smaller request)", key="use_digest")
+    
+    # Fetch articles in ranked order until the local keyword candidates stop changing
+    st.checkbox("Adaptive sampling: stop fetching once the top keywords stop changing "
+                "(fewer articles on focused blogs, more on broad ones)", key="adaptive")
+    
+    # Wrap the next fetch/analysis job in cProfile and tracemalloc
+    st.checkbox("Profile the next fetch/analysis (CPU profile and memory snapshot to download)", key="profile_run")
+    
+    # Per-run time budget: fetching and Gemini calls are cut to fit it
+    st.number_input("Time limit per fetch/analysis in seconds (0 = no limit; returns a partial result when reached)",
+                    min_value=0, max_value=3600, value=0, step=30, key="deadline")
+    
     # Temperature setting
     temperature = st.slider("AI creativity (temperature)", min_value=0.0, max_value=1.0, value=0.2, step=0.1)
     
     # Apply button
     if st.button("Apply Settings"):
         st.success("Settings applied successfully!")
+    
+    # Token usage across runs, for sizing batches and forecasting quota
+    # Tables load pyarrow/numpy, so they are only rendered on request
+    st.subheader("Gemini Usage (last 30 days)")
+    if st.checkbox("Show usage tables", key="show_usage"):
+        report = usage_report()
+        st.markdown("**Per day**")
+        st.dataframe(report['by_day'], use_container_width=True)
+        st.markdown("**Per site**")
+        st.dataframe(report['by_site'], use_container_width=True)
+        st.markdown("**Per model route**")
+        st.dataframe(report['by_route'], use_container_width=True)
+    
+    # Artifacts of the last profiled run
+    if st.session_state.profile:
+        profile = st.session_state.profile
+        st.subheader("Profile of the Last Run")
+        st.caption(f"{profile['elapsed']:.2f}s wall time, "
+                   f"{profile['peak_memory'] / 1024 / 1024:.1f} MiB peak traced memory")
+        for key, label in (('report', "Download report (.txt)"), ('profile', "Download CPU profile (.prof)"),
+                           ('snapshot', "Download memory snapshot")):
+            if os.path.exists(profile[key]):
+                with open(profile[key], 'rb') as f:
+                    st.download_button(label, f.read(), file_name=os.path.basename(profile[key]),
+                                       key=f"profile_{key}")
 
 # Cleanup function to be called when the app is closed
 def cleanup():
@@ -445,5 +524,8 @@ st.markdown("""
 </div>
 """, unsafe_allow_html=True)
 
-if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=8501)
\ No newline at end of file
+# Keep polling while a background job is queued or running; analyses poll
+# faster so streamed keywords appear as soon as they arrive
+if st.session_state.job_id:
+    time.sleep(0.25 if st.session_state.job_kind == "analyze" else 1)
+    st.rerun()
\ No newline at end of file
@@ -0,0 +1,105 @@
+import os
+import sys
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+import streamlit as st
+
+# Budgets can be tuned per deployment through environment variables
+PAGE_CACHE_ENTRIES = int(os.environ.get("PAGE_CACHE_ENTRIES", 500))
+PAGE_CACHE_TTL = int(os.environ.get("PAGE_CACHE_TTL", 60 * 60))
+PAGE_CACHE_MB = int(os.environ.get("PAGE_CACHE_MB", 64))
+RENDER_CACHE_ENTRIES = int(os.environ.get("RENDER_CACHE_ENTRIES", 200))
+RENDER_CACHE_TTL = int(os.environ.get("RENDER_CACHE_TTL", 60 * 60))
+RENDER_CACHE_MB = int(os.environ.get("RENDER_CACHE_MB", 128))
+KEYWORD_CACHE_ENTRIES = int(os.environ.get("KEYWORD_CACHE_ENTRIES", 500))
+KEYWORD_CACHE_TTL = int(os.environ.get("KEYWORD_CACHE_TTL", 24 * 60 * 60))
+
+class TTLCache:
+    """Thread-safe LRU cache with a per-entry TTL and entry/byte budgets"""
+
+    def __init__(self, name, max_entries, ttl, max_bytes=None):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            value, expires_at, size = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self._bytes -= size
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, size=None):
+        if size is None:
+            size = sys.getsizeof(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+
+        with self._lock:
+            previous = self._data.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[2]
+            self._data[key] = (value, time.monotonic() + self.ttl, size)
+            self._bytes += size
+
+            while self._data and (len(self._data) > self.max_entries or
+                                  (self.max_bytes is not None and self._bytes > self.max_bytes)):
+                _, (_, _, evicted_size) = self._data.popitem(last=False)
+                self._bytes -= evicted_size
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'name': self.name,
+                'entries': len(self._data),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+@st.cache_resource
+def get_shared_caches():
+    """Process-wide caches, shared by every browser session of the app"""
+    return {
+        'pages': TTLCache('pages', PAGE_CACHE_ENTRIES, PAGE_CACHE_TTL, PAGE_CACHE_MB * 1024 * 1024),
+        'renders': TTLCache('renders', RENDER_CACHE_ENTRIES, RENDER_CACHE_TTL, RENDER_CACHE_MB * 1024 * 1024),
+        'keywords': TTLCache('keywords', KEYWORD_CACHE_ENTRIES, KEYWORD_CACHE_TTL),
+    }
+
+def page_cache():
+    return get_shared_caches()['pages']
+
+def render_cache():
+    return get_shared_caches()['renders']
+
+def keyword_cache():
+    return get_shared_caches()['keywords']
+
+def cache_key(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode('utf-8', 'ignore'))
+        digest.update(b'\0')
+    return digest.hexdigest()
@@ -1,8 +1,11 @@
 import streamlit as st
 import os
 import time
-from web_scrape import extract_article_links, save_as_pdf
-from gemini import call_gemini_api, get_all_files_from_directory
+from manifest import RunManifest
+from shared_cache import cache_key
+from jobs import get_job_manager, JobQueueFull, ACTIVE_STATES
+from ngram_index import shared_phrases
+from telemetry import usage_report, format_usage
 import tempfile
 import shutil
 
@@ -202,6 +205,22 @@ if 'last_analyzed_url' not in st.session_state:
     st.session_state.last_analyzed_url = None
 if 'article_count' not in st.session_state:
     st.session_state.article_count = 0
+if 'manifest' not in st.session_state:
+    st.session_state.manifest = RunManifest()
+if 'candidates' not in st.session_state:
+    st.session_state.candidates = []
+if 'usage' not in st.session_state:
+    st.session_state.usage = None
+if 'profile' not in st.session_state:
+    st.session_state.profile = None
+if 'comparison' not in st.session_state:
+    st.session_state.comparison = None
+if 'triage' not in st.session_state:
+    st.session_state.triage = None
+if 'job_id' not in st.session_state:
+    st.session_state.job_id = None
+    st.session_state.job_kind = None
+    st.session_state.pending_url = None
 
 # Title with logo and information
 with st.container():
@@ -223,6 +242,82 @@ with st.container():
 # Input URL
 url_input = st.text_input("Enter website URL:", placeholder="https://example.com/blog")
 
+# Scraping and analysis run on the shared worker pool; the script only polls
+def submit_job(kind, func, *args, dedupe_key=None):
+    # 0 leaves the server default (RUN_DEADLINE)
+    deadline = st.session_state.get('deadline') or None
+    if st.session_state.get('profile_run'):
+        # Profiled runs wrap the job and never reuse another session's job
+        from profiling import profile_job
+        func, args, dedupe_key = profile_job, (kind, func, *args), None
+    try:
+        st.session_state.job_id = get_job_manager().submit(kind, func, *args, dedupe_key=dedupe_key,
+                                                           deadline=deadline)
+    except JobQueueFull as e:
+        st.error(str(e))
+        return
+    st.session_state.job_kind = kind
+    st.session_state.status = "Processing"
+
+def apply_job_result(job):
+    if job['status'] == 'failed':
+        label = {"fetch": "Error fetching content", "compare": "Comparison failed",
+                 "triage": "Triage failed"}.get(
+            st.session_state.job_kind, "Analysis failed")
+        st.error(f"{label}: {job['error']}")
+    elif job['status'] == 'cancelled':
+        st.warning("The run was cancelled.")
+    elif st.session_state.job_kind == "fetch":
+        manifest = RunManifest.from_dict(job['result']['manifest'])
+        links = job['result']['links']
+        st.session_state.manifest = manifest
+        # Store articles in session state (we won't display them but keep track)
+        st.session_state.article_details = {i: {'url': link, 'selected': True} for i, link in enumerate(links)}
+        st.session_state.articles = links
+        st.session_state.article_count = len(links)
+        st.session_state.candidates = job['result']['candidates']
+        st.session_state.last_analyzed_url = st.session_state.pending_url
+        if links:
+            st.success(f"Successfully fetched main page + {len(links)} articles!")
+        else:
+            st.warning("No article links found. Will analyze the main page only.")
+        crawl = job['result'].get('crawl') or {}
+        if crawl.get('unchanged') or crawl.get('changed'):
+            st.info(f"Re-crawl: {crawl['new']} new, {crawl['changed']} changed and "
+                    f"{crawl['unchanged']} unchanged pages since the last run.")
+    elif st.session_state.job_kind == "compare":
+        st.session_state.comparison = job['result']
+        for url, error in job['result']['errors'].items():
+            st.error(f"Could not analyze {url}: {error}")
+        st.success(f"Compared {len(job['result']['sites'])} sites!")
+    elif st.session_state.job_kind == "triage":
+        st.session_state.triage = job['result']
+        for url, error in job['result']['errors'].items():
+            st.error(f"Could not triage {url}: {error}")
+        st.success(f"Triaged {len(job['result']['sites'])} sites!")
+    else:
+        st.session_state.keywords = job['result']['keywords']
+        st.session_state.usage = job['result'].get('usage')
+        st.success("Analysis complete!")
+    if job['result'] and job['result'].get('profile'):
+        st.session_state.profile = job['result']['profile']
+    
+    st.session_state.job_id = None
+    st.session_state.status = "Ready"
+
+# Poll the background job; keywords streamed so far are shown while it runs
+live_keywords = None
+if st.session_state.job_id:
+    job = get_job_manager().get(st.session_state.job_id)
+    if job is None:
+        st.session_state.job_id = None
+        st.session_state.status = "Ready"
+    elif job['status'] in ACTIVE_STATES:
+        st.progress(job['progress_fraction'] or 0.0, text=job['progress_label'])
+        live_keywords = job['partial']
+    else:
+        apply_job_result(job)
+
 # Status indicator
 status_class = "status-ready" if st.session_state.status == "Ready" else "status-pending"
 st.markdown(f'<div class="{status_class}">Status: {st.session_state.status}</div>', unsafe_allow_html=True)
@@ -241,35 +336,38 @@ with col2:
 with col3:
     clear_button = st.button("Clear All", use_container_width=True)
 
+use_candidates = st.checkbox("Send only local keyword candidates to Gemini (faster, smaller request)",
+                             key="use_candidates")
+incremental = st.checkbox("Re-analyze only new or changed articles (reuses earlier per-article results)",
+                          key="incremental")
+use_digest = st.checkbox("Send a compact digest of each article instead of the full PDFs "
+                         "(headings, intro, lists and key sentences; much smaller request)", key="use_digest")
+adaptive = st.checkbox("Adaptive sampling: stop fetching once the top keywords stop changing "
+                       "(fewer articles on focused blogs, more on broad ones)", key="adaptive")
+st.checkbox("Profile the next fetch/analysis (CPU profile and memory snapshot to download)", key="profile_run")
+st.number_input("Time limit per fetch/analysis in seconds (0 = no limit; returns a partial result when reached)",
+                min_value=0, max_value=3600, value=0, step=30, key="deadline")
+
+# Client vs competitors: every site is fetched and analyzed concurrently
+with st.expander("Compare with competitors"):
+    competitors_input = st.text_area("Competitor URLs, one per line (the URL above is the client):",
+                                     key="competitors")
+    compare_button = st.button("Compare Keywords", use_container_width=True,
+                               disabled=(not url_input or st.session_state.status == "Processing"))
+
+# Many sites at once from their declared metadata only (meta keywords, Open Graph, JSON-LD)
+with st.expander("Quick triage (metadata only)"):
+    triage_input = st.text_area("Site URLs, one per line:", key="triage_urls")
+    triage_gemini = st.checkbox("Also ask Gemini, sending only the metadata (small, fast request)",
+                                key="triage_gemini")
+    triage_button = st.button("Triage Sites", use_container_width=True,
+                              disabled=(not triage_input.strip() or st.session_state.status == "Processing"))
+
 # Main content area
 content_col1, content_col2, content_col3 = st.columns([1, 1, 1])
 
-# Function to analyze articles with Gemini
-def analyze_articles():
-    with st.status("Analyzing content with Gemini API...") as status:
-        st.session_state.status = "Processing"
-        
-        # Get files from the scraped directory
-        all_files = get_all_files_from_directory(st.session_state.scraped_dir)
-        
-        # Check if we have any files to analyze
-        if not all_files:
-            st.error("No content to analyze. Please fetch the website first.")
-            st.session_state.status = "Ready"
-            status.update(label="Error: No content to analyze", state="error")
-            return
-        
-        # Always include the main page if it exists
-        files_to_process = [f for f in all_files if "main_page" in f]
-        
-        # If we have article PDFs, add them all for analysis
-        article_files = [f for f in all_files if "article_" in f]
-        files_to_process.extend(article_files)
-        
-        status.update(label=f"Processing {len(files_to_process)} files...", state="running")
-        
-        # Prepare the prompt for Gemini
-        user_prompt = """Puedes responder en español o en inglés, dependiendo del idioma principal del contenido de los documentos PDF proporcionados.
+# Prompt for Gemini, shared by single-site analyses and competitor comparisons
+USER_PROMPT = """Puedes responder en español o en inglés, dependiendo del idioma principal del contenido de los documentos PDF proporcionados.
 
 Tarea principal:  
 Analiza los documentos PDF como si fueran páginas web optimizadas para SEO. Identifica los temas centrales y extrae entre 5 y 10 palabras clave de cola larga o frases de búsqueda relevantes.
@@ -301,87 +399,31 @@ Tip: Incluye keywords con intención de compra, comparativa o solución (por eje
 Importante: La respuesta debe considerar el análisis **global** de todos los documentos proporcionados, no un análisis individual. Las palabras clave extraídas deben reflejar los temas comunes o complementarios tratados en el conjunto completo de PDFs.
 
 """
-        
-        # Call Gemini API
-        result = call_gemini_api(user_prompt, files_to_process)
-        
-        if result:
-            st.session_state.keywords = result
-            status.update(label="Analysis complete!", state="complete")
-        else:
-            st.error("Failed to get a response from Gemini API")
-            status.update(label="Analysis failed", state="error")
-        
-        st.session_state.status = "Ready"
+
+# Function to analyze articles with Gemini
+def analyze_articles():
+    # The run manifest lists the main page first, then every saved article
+    if not st.session_state.manifest.artifacts():
+        st.error("No content to analyze. Please fetch the website first.")
+        return
+    
+    # Identical analyses from other sessions share one job; the pipeline (and
+    # the Gemini SDK behind it) is only imported once work is submitted
+    from pipeline import analyze_job
+    manifest = st.session_state.manifest
+    submit_job("analyze", analyze_job, USER_PROMPT, manifest.to_dict(), None, use_candidates, incremental,
+               use_digest,
+               dedupe_key=cache_key("analyze", USER_PROMPT, use_candidates, incremental, use_digest,
+                                    *manifest.content_hashes()))
 
 # Function to handle website scraping
 def fetch_website_content(url):
-    with st.status("Fetching content...") as status:
-        st.session_state.status = "Processing"
-        try:
-            # Clear previous data
-            for file in os.listdir(st.session_state.scraped_dir):
-                os.remove(os.path.join(st.session_state.scraped_dir, file))
-            
-            st.session_state.articles = []
-            st.session_state.article_details = {}
-            
-            # Extract article links
-            status.update(label="Extracting article links...", state="running")
-            links = extract_article_links(url)
-            
-            # Save main page regardless of whether articles are found
-            status.update(label="Saving main page...", state="running")
-            main_page_path = os.path.join(st.session_state.scraped_dir, "main_page.pdf")
-            main_page_saved = save_as_pdf(url, main_page_path)
-            
-            if not main_page_saved:
-                st.error("Failed to save the main page. Please check the URL and try again.")
-                status.update(label="Failed to save main page", state="error")
-                st.session_state.status = "Ready"
-                return False
-            
-            if links:
-                # Save articles with progress updates
-                max_articles = min(10, len(links))
-                
-                status.update(label=f"Found {max_articles} articles. Saving...", state="running")
-                
-                for i in range(max_articles):
-                    article_url = links[i]
-                    article_filename = f"article_{i+1}_{os.path.basename(article_url)}.pdf"
-                    article_path = os.path.join(st.session_state.scraped_dir, article_filename)
-                    
-                    status.update(label=f"Saving article {i+1} of {max_articles}...", state="running")
-                    save_as_pdf(article_url, article_path)
-                    
-                    # Store article in session state (we won't display them but keep track)
-                    st.session_state.article_details[i] = {
-                        'url': article_url,
-                        'selected': True
-                    }
-                    
-                    time.sleep(1)  # Be nice to the server
-                
-                # Update session state
-                st.session_state.articles = links[:max_articles]
-                st.session_state.article_count = max_articles
-                status.update(label=f"Successfully fetched {max_articles} articles!", state="complete")
-                st.success(f"Successfully fetched main page + {max_articles} articles!")
-            else:
-                st.warning("No article links found. Will analyze the main page only.")
-                st.session_state.article_count = 0
-                status.update(label="Only main page will be analyzed", state="complete")
-            
-            st.session_state.last_analyzed_url = url
-            st.session_state.status = "Ready"
-            return True
-                
-        except Exception as e:
-            st.error(f"Error fetching content: {str(e)}")
-            status.update(label=f"Error: {str(e)}", state="error")
-            st.session_state.status = "Ready"
-            return False
+    st.session_state.articles = []
+    st.session_state.article_details = {}
+    st.session_state.manifest = RunManifest()
+    st.session_state.pending_url = url
+    from pipeline import fetch_job
+    submit_job("fetch", fetch_job, url, st.session_state.scraped_dir, 10, False, adaptive)
 
 # Handle fetch button click
 if fetch_button and url_input:
@@ -394,15 +436,43 @@ if fetch_button and url_input:
 if analyze_button:
     analyze_articles()
 
+# Handle compare button click
+if compare_button:
+    urls = list(dict.fromkeys(u.strip() for u in [url_input, *competitors_input.splitlines()] if u.strip()))
+    if len(urls) < 2:
+        st.error("Enter at least one competitor URL.")
+    else:
+        from pipeline import competitor_job
+        submit_job("compare", competitor_job, USER_PROMPT, urls,
+                   os.path.join(st.session_state.temp_dir, "competitors"), 10, use_candidates, incremental,
+                   adaptive, use_digest)
+
+# Handle triage button click
+if triage_button:
+    from pipeline import triage_job
+    urls = list(dict.fromkeys(u.strip() for u in triage_input.splitlines() if u.strip()))
+    submit_job("triage", triage_job, USER_PROMPT, urls, 20, triage_gemini)
+
 # Handle clear button click
 if clear_button:
-    # Reset session state
+    # Reset session state; a running job no other session shares is cancelled
+    # and stops within a moment
+    if st.session_state.job_id:
+        get_job_manager().release(st.session_state.job_id)
     st.session_state.articles = []
     st.session_state.article_details = {}
     st.session_state.screenshot_path = None
     st.session_state.keywords = "No keywords found yet"
     st.session_state.last_analyzed_url = None
     st.session_state.article_count = 0
+    st.session_state.candidates = []
+    st.session_state.usage = None
+    st.session_state.profile = None
+    st.session_state.comparison = None
+    st.session_state.triage = None
+    st.session_state.manifest = RunManifest()
+    st.session_state.job_id = None
+    st.session_state.status = "Ready"
     
     # Clear files
     if os.path.exists(st.session_state.scraped_dir):
@@ -430,10 +500,23 @@ with content_col2:
         st.markdown('<div class="article-counter">No articles found. Only the main page will be analyzed.</div>', unsafe_allow_html=True)
     else:
         st.markdown('<div class="article-counter">No content fetched yet. Enter a URL and click "Fetch Blog Articles".</div>', unsafe_allow_html=True)
+    
+    # Local candidates are available as soon as the fetch finishes
+    if st.session_state.candidates:
+        st.markdown("#### Local keyword candidates")
+        st.markdown("\n".join(f"- {c['phrase']}" for c in st.session_state.candidates[:15]))
+
+    # Phrases shared by several sites across every fetch so far
+    common = shared_phrases(limit=15)
+    if common:
+        with st.expander("Phrases common across indexed sites"):
+            st.markdown("\n".join(f"- {p['term']} ({p['sites']} sites, {p['df']} pages)" for p in common))
 
 with content_col3:
     st.markdown("### SEO Keywords Found")
-    st.markdown('<div class="keyword-container">{}</div>'.format(st.session_state.keywords), unsafe_allow_html=True)
+    st.markdown('<div class="keyword-container">{}</div>'.format(live_keywords or st.session_state.keywords), unsafe_allow_html=True)
+    if st.session_state.usage:
+        st.caption(format_usage(st.session_state.usage))
     if st.session_state.keywords != "No keywords found yet":
         copy_btn = st.button("Copy to Clipboard", key="copy_keywords")
         if copy_btn:
@@ -448,6 +531,58 @@ with content_col3:
             </script>
             """, height=0)
 
+# Merged keyword report of the last competitor comparison
+if st.session_state.comparison:
+    from competitors import format_gap_report
+    from pipeline import PARTIAL_NOTE
+    comparison = st.session_state.comparison
+    st.markdown("## Competitor Keyword Gap Report")
+    st.markdown(format_gap_report(comparison['report']))
+    for url, site in comparison['sites'].items():
+        with st.expander(f"Keywords for {url}"):
+            st.markdown(site['keywords'])
+            if site.get('partial'):
+                st.caption(PARTIAL_NOTE.strip())
+            st.caption(format_usage(site['usage']))
+
+# Metadata-only keywords of the last triage, one row per site
+if st.session_state.triage:
+    triage = st.session_state.triage
+    st.markdown("## Quick Triage")
+    st.dataframe([{'site': url, 'pages read': site['pages'],
+                   'top candidates': ", ".join(c['phrase'] for c in site['candidates'][:8])}
+                  for url, site in triage['sites'].items()], use_container_width=True)
+    for url, site in triage['sites'].items():
+        if site['keywords']:
+            with st.expander(f"Keywords for {url}"):
+                st.markdown(site['keywords'])
+    if triage.get('usage'):
+        st.caption(format_usage(triage['usage']))
+
+# Token usage across runs, for sizing batches and forecasting quota. An
+# expander would render its tables (and load pyarrow/numpy) on every run
+if st.checkbox("Show Gemini usage (last 30 days)", key="show_usage"):
+    report = usage_report()
+    st.markdown("**Per day**")
+    st.dataframe(report['by_day'], use_container_width=True)
+    st.markdown("**Per site**")
+    st.dataframe(report['by_site'], use_container_width=True)
+    st.markdown("**Per model route**")
+    st.dataframe(report['by_route'], use_container_width=True)
+
+# Artifacts of the last profiled run
+if st.session_state.profile:
+    profile = st.session_state.profile
+    with st.expander("Profile of the last run", expanded=True):
+        st.caption(f"{profile['elapsed']:.2f}s wall time, "
+                   f"{profile['peak_memory'] / 1024 / 1024:.1f} MiB peak traced memory")
+        for key, label in (('report', "Download report (.txt)"), ('profile', "Download CPU profile (.prof)"),
+                           ('snapshot', "Download memory snapshot")):
+            if os.path.exists(profile[key]):
+                with open(profile[key], 'rb') as f:
+                    st.download_button(label, f.read(), file_name=os.path.basename(profile[key]),
+                                       key=f"profile_{key}")
+
 # No settings section - using default values
 
 # Cleanup function to be called when the app is closed
@@ -500,4 +635,10 @@ st.components.v1.html("""
         }
     }, 500);
 </script>
-""", height=0)
\ No newline at end of file
+""", height=0)
+
+# Keep polling while a background job is queued or running; analyses poll
+# faster so streamed keywords appear as soon as they arrive
+if st.session_state.job_id:
+    time.sleep(0.25 if st.session_state.job_kind == "analyze" else 1)
+    st.rerun()
@@ -0,0 +1,155 @@
+import os
+import time
+import sqlite3
+from contextlib import contextmanager
+from urllib.parse import urlparse
+import streamlit as st
+from paths import data_path
+
+TELEMETRY_DB = os.environ.get("TELEMETRY_DB") or data_path("telemetry.sqlite3")
+
+_TOTALS = """
+    COUNT(*) AS calls,
+    SUM(status != 'ok') AS failed,
+    SUM(input_tokens) AS input_tokens,
+    SUM(output_tokens) AS output_tokens,
+    SUM(retries) AS retries,
+    SUM(rate_limit_waits) AS rate_limit_waits,
+    ROUND(SUM(latency), 3) AS latency,
+    ROUND(SUM(queue_wait), 3) AS queue_wait
+"""
+
+class Telemetry:
+    """One row per Gemini call: tokens, latency, retries and outcome.
+
+    input_tokens comes from the response's usage metadata when the call
+    succeeds, and otherwise from the pre-call count (token_source says whether
+    that was the model's count_tokens or the local estimate). Rows carry the
+    site and run they belong to so usage can be summed per run, site and day.
+    """
+
+    def __init__(self, db_path=TELEMETRY_DB):
+        self.db_path = db_path
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS gemini_calls (
+                    id INTEGER PRIMARY KEY,
+                    created_at REAL NOT NULL,
+                    day TEXT NOT NULL,
+                    run_id TEXT,
+                    site TEXT,
+                    model TEXT NOT NULL,
+                    route TEXT,
+                    route_reason TEXT,
+                    files INTEGER NOT NULL,
+                    token_source TEXT,
+                    input_tokens INTEGER,
+                    output_tokens INTEGER,
+                    latency REAL,
+                    queue_wait REAL,
+                    retries INTEGER NOT NULL DEFAULT 0,
+                    rate_limit_waits INTEGER NOT NULL DEFAULT 0,
+                    status TEXT NOT NULL,
+                    error TEXT
+                );
+                CREATE INDEX IF NOT EXISTS gemini_calls_run ON gemini_calls (run_id);
+                CREATE INDEX IF NOT EXISTS gemini_calls_day ON gemini_calls (day, site);
+            """)
+            # Tables created before model routing lack the route columns
+            columns = [row['name'] for row in conn.execute("PRAGMA table_info(gemini_calls)")]
+            for column in ('route', 'route_reason'):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE gemini_calls ADD COLUMN {column} TEXT")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def record_call(self, model, route=None, route_reason=None, files=0, run_id=None, site=None,
+                    token_source=None, input_tokens=None, output_tokens=None, latency=None, queue_wait=None,
+                    retries=0, rate_limit_waits=0, status='ok', error=None):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO gemini_calls (created_at, day, run_id, site, model, route, route_reason, files, "
+                "token_source, input_tokens, output_tokens, latency, queue_wait, retries, rate_limit_waits, "
+                "status, error) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (now, time.strftime('%Y-%m-%d', time.gmtime(now)), run_id, urlparse(site).netloc if site else None,
+                 model, route, route_reason, files, token_source, input_tokens, output_tokens, latency, queue_wait,
+                 retries, rate_limit_waits, status, error))
+
+    def latency_per_token(self, model, sample=20):
+        """Median seconds per input token over the model's recent calls, or None without history"""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT latency, input_tokens FROM gemini_calls WHERE model = ? AND input_tokens > 0 "
+                "AND status IN ('ok', 'timeout') ORDER BY id DESC LIMIT ?", (model, sample)).fetchall()
+        if not rows:
+            return None
+        # A timed out call took at least this long, so it still counts as evidence
+        rates = sorted(row['latency'] / row['input_tokens'] for row in rows)
+        return rates[len(rates) // 2]
+
+    def routes(self, days=30):
+        """How often each route was chosen and why, with its outcome, for tuning the routing table"""
+        since = time.time() - days * 24 * 60 * 60
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT route, route_reason, model, {_TOTALS}, SUM(status = 'timeout') AS timeouts, "
+                "ROUND(AVG(latency), 3) AS avg_latency FROM gemini_calls WHERE created_at >= ? "
+                "GROUP BY route, route_reason, model ORDER BY calls DESC", (since,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def run_usage(self, run_id):
+        with self._connect() as conn:
+            row = conn.execute(f"SELECT {_TOTALS} FROM gemini_calls WHERE run_id = ?", (run_id,)).fetchone()
+        return {key: row[key] or 0 for key in row.keys()}
+
+    def by_day(self, days=30):
+        since = time.strftime('%Y-%m-%d', time.gmtime(time.time() - days * 24 * 60 * 60))
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT day, model, {_TOTALS} FROM gemini_calls WHERE day >= ? "
+                "GROUP BY day, model ORDER BY day DESC, model", (since,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def by_site(self, days=30, limit=50):
+        since = time.time() - days * 24 * 60 * 60
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT site, {_TOTALS}, COUNT(DISTINCT run_id) AS runs FROM gemini_calls "
+                "WHERE created_at >= ? GROUP BY site ORDER BY SUM(input_tokens) DESC LIMIT ?",
+                (since, limit)).fetchall()
+        return [dict(row) for row in rows]
+
+@st.cache_resource
+def get_telemetry():
+    return Telemetry()
+
+@st.cache_data(ttl=60, show_spinner=False)
+def usage_report(days=30):
+    """Aggregates for the UI; cached so polling reruns don't re-query the table"""
+    telemetry = get_telemetry()
+    return {'by_day': telemetry.by_day(days), 'by_site': telemetry.by_site(days), 'by_route': telemetry.routes(days)}
+
+def record_call(**fields):
+    """Record a call without ever failing the request it describes"""
+    try:
+        get_telemetry().record_call(**fields)
+    except Exception as e:
+        st.warning(f"Could not record Gemini usage: {e}")
+
+def format_usage(usage):
+    """One-line summary of a run's usage for the UI"""
+    line = (f"Gemini: {usage['input_tokens']:,} input + {usage['output_tokens']:,} output tokens, "
+            f"{usage['calls']} calls, {usage['latency']:.1f}s")
+    if usage['retries'] or usage['rate_limit_waits']:
+        line += f", {usage['retries']} retries, {usage['rate_limit_waits']} quota waits"
+    return line
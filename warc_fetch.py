@@ -0,0 +1,307 @@
+"""HTTP fetch layer with WARC record/replay.
+
+In record mode every response (including redirect hops) is appended to a
+WARC file together with the request that produced it; in replay mode
+responses are served from that file and nothing touches the network, so a
+scrape of a real site can be re-run and profiled deterministically.
+
+    SCRAPE_MODE=record SCRAPE_WARC=site.warc.gz python batch_scrape.py https://example.com/blog
+    SCRAPE_MODE=replay SCRAPE_WARC=site.warc.gz python batch_scrape.py https://example.com/blog
+"""
+import os
+import re
+import gzip
+import socket
+import uuid
+import functools
+import threading
+from datetime import datetime, timezone
+from urllib.parse import urljoin, urlparse
+import requests
+from requests.structures import CaseInsensitiveDict
+from paths import data_path
+from cancellation import current_token
+
+MODES = ('live', 'record', 'replay')
+SCRAPE_MODE = os.environ.get("SCRAPE_MODE", "live")
+SCRAPE_WARC = os.environ.get("SCRAPE_WARC") or data_path("scrape.warc.gz")
+MAX_REDIRECTS = 10
+# Bodies are read in chunks so a cancelled run stops mid-download
+READ_CHUNK = 64 * 1024
+# Head-only reads stop at </head> or after this many bytes
+HEAD_MAX_BYTES = int(os.environ.get("HEAD_MAX_BYTES", 64 * 1024))
+HEAD_CHUNK = 8 * 1024
+# Seconds allowed to open a connection (TCP and TLS); it can't be aborted on
+# cancellation like a body read, so it is kept short
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", 3))
+# Connections kept per host by the shared session
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", 20))
+
+_HEADER_CHARSET_RE = re.compile(r'charset=["\']?([\w-]+)', re.I)
+_META_CHARSET_RE = re.compile(rb'<meta[^>]+charset=["\']?([\w-]+)', re.I)
+
+# Bodies are stored decoded, so transfer-level headers no longer describe them
+_DROPPED_HEADERS = {'content-encoding', 'transfer-encoding', 'content-length'}
+
+_lock = threading.Lock()
+_recorders = {}
+_archives = {}
+
+def set_mode(mode, path=None):
+    """Switch the fetch mode for this process, e.g. from a CLI flag"""
+    global SCRAPE_MODE, SCRAPE_WARC
+    if mode not in MODES:
+        raise ValueError(f"Unknown scrape mode {mode!r}; expected one of {', '.join(MODES)}")
+    SCRAPE_MODE = mode
+    if path:
+        SCRAPE_WARC = path
+
+def is_replaying():
+    return SCRAPE_MODE == 'replay'
+
+def polite_delay(seconds):
+    """Pause between requests to a live site; replays run at full speed"""
+    if not is_replaying():
+        current_token().sleep(seconds)
+
+def _warc_record(warc_type, target_uri, block, content_type, extra=None):
+    headers = {
+        'WARC-Type': warc_type,
+        'WARC-Record-ID': f"<urn:uuid:{uuid.uuid4()}>",
+        'WARC-Date': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'WARC-Target-URI': target_uri,
+        **(extra or {}),
+        'Content-Type': content_type,
+        'Content-Length': str(len(block)),
+    }
+    head = "WARC/1.0\r\n" + "".join(f"{name}: {value}\r\n" for name, value in headers.items()) + "\r\n"
+    return headers['WARC-Record-ID'], head.encode('utf-8') + block + b"\r\n\r\n"
+
+def _http_request_block(request):
+    parsed = urlparse(request.url)
+    target = parsed.path or '/'
+    if parsed.query:
+        target += '?' + parsed.query
+    lines = [f"{request.method} {target} HTTP/1.1", f"Host: {parsed.netloc}"]
+    lines += [f"{name}: {value}" for name, value in request.headers.items()]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode('utf-8')
+
+def _http_response_block(response):
+    body = response.content
+    lines = [f"HTTP/1.1 {response.status_code} {response.reason or ''}".rstrip()]
+    lines += [f"{name}: {value}" for name, value in response.headers.items() if name.lower() not in _DROPPED_HEADERS]
+    lines.append(f"Content-Length: {len(body)}")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode('latin-1', 'replace') + body
+
+class WarcRecorder:
+    """Appends request/response pairs to a WARC file, one gzip member per record"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, 'ab')
+        if self._file.tell() == 0:
+            _, record = _warc_record('warcinfo', '', b"software: keyword-extractor\r\nformat: WARC File Format 1.0\r\n",
+                                     'application/warc-fields')
+            self._file.write(gzip.compress(record))
+
+    def record(self, response):
+        # Redirect hops first, so replay can follow them the same way
+        with self._lock:
+            for hop in [*response.history, response]:
+                response_id, response_record = _warc_record(
+                    'response', hop.url, _http_response_block(hop), 'application/http; msgtype=response')
+                _, request_record = _warc_record(
+                    'request', hop.url, _http_request_block(hop.request), 'application/http; msgtype=request',
+                    {'WARC-Concurrent-To': response_id})
+                self._file.write(gzip.compress(request_record))
+                self._file.write(gzip.compress(response_record))
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+def _parse_headers(lines):
+    headers = CaseInsensitiveDict()
+    for line in lines:
+        name, _, value = line.partition(':')
+        if name:
+            headers[name.strip()] = value.strip()
+    return headers
+
+class WarcArchive:
+    """Response records of a WARC file, indexed by target URI (the last capture wins)"""
+
+    def __init__(self, path):
+        self.path = path
+        self.responses = {}
+        with gzip.open(path, 'rb') as f:
+            data = f.read()
+        position = 0
+        while position < len(data):
+            head_end = data.index(b"\r\n\r\n", position)
+            head = data[position:head_end].decode('utf-8').split("\r\n")
+            headers = _parse_headers(head[1:])
+            block_start = head_end + 4
+            block_end = block_start + int(headers['Content-Length'])
+            if headers.get('WARC-Type') == 'response':
+                self.responses[headers['WARC-Target-URI']] = data[block_start:block_end]
+            position = block_end + 4
+
+    def _response(self, url, block):
+        head, _, body = block.partition(b"\r\n\r\n")
+        lines = head.decode('latin-1').split("\r\n")
+        _, status, reason = (lines[0].split(' ', 2) + [''])[:3]
+        response = requests.Response()
+        response.status_code = int(status)
+        response.reason = reason
+        response.headers = _parse_headers(lines[1:])
+        response._content = body
+        response.url = url
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        response.request = requests.Request('GET', url).prepare()
+        return response
+
+    def get(self, url):
+        """The archived response for url, following archived redirects"""
+        history = []
+        for _ in range(MAX_REDIRECTS + 1):
+            block = self.responses.get(url)
+            if block is None:
+                raise requests.exceptions.ConnectionError(f"{url} is not in the WARC archive {self.path}")
+            response = self._response(url, block)
+            location = response.headers.get('Location')
+            if not (response.is_redirect and location):
+                response.history = history
+                return response
+            history.append(response)
+            url = urljoin(url, location)
+        raise requests.exceptions.TooManyRedirects(f"Too many archived redirects for {url}")
+
+def _recorder(path):
+    with _lock:
+        if path not in _recorders:
+            _recorders[path] = WarcRecorder(path)
+        return _recorders[path]
+
+def _archive(path):
+    with _lock:
+        if path not in _archives:
+            _archives[path] = WarcArchive(path)
+        return _archives[path]
+
+@functools.lru_cache(maxsize=None)
+def get_session():
+    """Process-wide session so pages of a site, and concurrent runs, reuse connections"""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def _abort(response):
+    # Shut the socket down so a read blocked in another thread returns at once
+    fp = getattr(getattr(response.raw, '_fp', None), 'fp', None)
+    sock = getattr(getattr(fp, 'raw', None), '_sock', None)
+    if sock is not None:
+        sock.shutdown(socket.SHUT_RDWR)
+    response.close()
+
+def _timeouts(token, timeout):
+    """(connect, read) timeouts for session.get, both capped to the run's remaining time"""
+    timeout = token.timeout(timeout)
+    if timeout is None:
+        return HTTP_CONNECT_TIMEOUT, None
+    return min(HTTP_CONNECT_TIMEOUT, timeout), timeout
+
+def _read_body(response, token, until=None, max_bytes=None):
+    """Read the body into response.content, stopping early after until or max_bytes"""
+    chunks = []
+    size = 0
+    tail = b""
+    # Partial reads use small chunks so they don't block on bytes they won't use
+    chunk_size = READ_CHUNK if max_bytes is None else HEAD_CHUNK
+    with token.on_cancel(lambda: _abort(response)):
+        try:
+            for chunk in response.iter_content(chunk_size):
+                token.check()
+                chunks.append(chunk)
+                size += len(chunk)
+                if until is not None:
+                    # The marker may straddle two chunks
+                    window = (tail + chunk).lower()
+                    tail = window[-len(until):]
+                if (max_bytes is not None and size >= max_bytes) or (until is not None and until in window):
+                    response.close()
+                    break
+        except requests.exceptions.RequestException:
+            # An aborted connection surfaces as a read error
+            token.check()
+            raise
+    token.check()
+    response._content = b"".join(chunks)
+
+def http_get(session, url, max_bytes=None, **kwargs):
+    """session.get(url, **kwargs), recorded to or replayed from SCRAPE_WARC per SCRAPE_MODE.
+
+    The body is read in chunks under the running job's cancellation token, so
+    cancelling aborts the download instead of waiting for it to finish, and
+    the timeout is capped to the time left before the run's deadline. With
+    max_bytes only the start of the body is kept (and, unless recording,
+    downloaded).
+    """
+    token = current_token()
+    token.check()
+    if SCRAPE_MODE == 'replay':
+        response = _archive(SCRAPE_WARC).get(url)
+        if max_bytes is not None:
+            response._content = response.content[:max_bytes]
+        return response
+    # Per-request timeouts never outlast the run's deadline
+    kwargs['timeout'] = _timeouts(token, kwargs.get('timeout'))
+    response = session.get(url, stream=True, **kwargs)
+    # Recorded bodies are kept whole so a later full fetch of the URL replays
+    _read_body(response, token, max_bytes=max_bytes if SCRAPE_MODE != 'record' else None)
+    if SCRAPE_MODE == 'record':
+        _recorder(SCRAPE_WARC).record(response)
+        if max_bytes is not None:
+            response._content = response.content[:max_bytes]
+    return response
+
+def decode_html(response):
+    """Text of an HTML response in its declared charset.
+
+    Unlike response.text, a <meta charset> counts when the Content-Type
+    header has none (requests then assumes ISO-8859-1), and a body cut off
+    mid-character by a partial read still decodes.
+    """
+    match = _HEADER_CHARSET_RE.search(response.headers.get('Content-Type', '')) or \
+        _META_CHARSET_RE.search(response.content[:4096])
+    charset = match.group(1) if match else 'utf-8'
+    if isinstance(charset, bytes):
+        charset = charset.decode('ascii')
+    try:
+        return response.content.decode(charset, 'replace')
+    except LookupError:
+        return response.content.decode('utf-8', 'replace')
+
+def http_get_head(session, url, max_bytes=HEAD_MAX_BYTES, **kwargs):
+    """Like http_get, but only the start of the body up to </head> is downloaded.
+
+    Enough for <title>, meta tags and the JSON-LD most sites put in the head.
+    When recording, the full body is still read so the archive can replay a
+    full fetch of the same page later.
+    """
+    token = current_token()
+    token.check()
+    if SCRAPE_MODE == 'replay':
+        response = _archive(SCRAPE_WARC).get(url)
+        response._content = response.content[:max_bytes]
+        return response
+    if SCRAPE_MODE == 'record':
+        return http_get(session, url, **kwargs)
+    kwargs['timeout'] = _timeouts(token, kwargs.get('timeout'))
+    response = session.get(url, stream=True, **kwargs)
+    _read_body(response, token, until=b'</head>', max_bytes=max_bytes)
+    return response
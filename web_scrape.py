@@ -5,12 +5,18 @@ from urllib.parse import urljoin, urlparse
 import time
 import random
 import re
-import html2text
-from reportlab.lib.pagesizes import letter
-from reportlab.lib import colors
-from reportlab.lib.styles import ParagraphStyle
-from reportlab.lib.units import inch
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
+from pdf_export import build_pdf
+from writers import PdfWriter
+from manifest import RunManifest
+from shared_cache import page_cache
+from ngram_index import index_page
+from near_duplicates import NearDuplicateDetector
+from boilerplate import get_boilerplate_learner
+from crawl_state import get_crawl_state, RECRAWL_AFTER
+import warc_fetch
+from warc_fetch import http_get, polite_delay, get_session, decode_html
+from link_ranking import link_candidates, rank_links, prefetch_sitemap
+from cancellation import current_token
 import streamlit as st
 
 def create_output_directory(directory_name="scraped"):
@@ -58,7 +64,13 @@ def get_article_title(html_content):
     
     return "Untitled Article"
 
-def clean_html_content(html_content):
+def clean_html_content(html_content, url=None):
+    """Title and markdown content of a page.
+
+    With url, the site's learned template is stripped too. 'provisional' is
+    true while too few of the site's pages have been seen for a template to
+    exist, so the content may still contain boilerplate.
+    """
     soup = BeautifulSoup(html_content, 'html.parser')
     
     # Get title from the article content if possible
@@ -68,6 +80,16 @@ def clean_html_content(html_content):
     for element in soup.select('nav, footer, aside, .sidebar, .comments, .footer, .nav, .menu, .social, .widget, script, style, [class*="cookie"], [class*="popup"], [id*="popup"], [class*="banner"], [id*="banner"], .ad, .ads, [class*="advertisement"], [class*="-ad-"]'):
         element.decompose()
     
+    # Then whatever this site repeats on most of its pages (CTAs, newsletter
+    # boxes, related-post widgets with unusual class names)
+    provisional = False
+    if url:
+        site = urlparse(url).netloc
+        learner = get_boilerplate_learner()
+        learner.learn(site, url, soup)
+        learner.strip(site, soup)
+        provisional = not learner.ready(site)
+    
     # Try to find the main content using common CSS selectors
     content_selectors = [
         'article', 'main', '.content', '.post', '.article', '.entry', 
@@ -86,6 +108,7 @@ def clean_html_content(html_content):
         main_content = soup.body
     
     # Convert HTML to markdown for better readability in the PDF
+    import html2text
     converter = html2text.HTML2Text()
     converter.ignore_links = False
     converter.ignore_images = True
@@ -98,253 +121,328 @@ def clean_html_content(html_content):
     
     return {
         'title': title,
-        'content': markdown_content
+        'content': markdown_content,
+        'provisional': provisional,
     }
 
-def save_as_pdf(url, output_path):
-    try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-            'Accept-Language': 'en-US,en;q=0.5',
-            'Referer': 'https://www.google.com/',
-            'DNT': '1',
-            'Connection': 'keep-alive',
-            'Upgrade-Insecure-Requests': '1',
-            'Cache-Control': 'max-age=0',
-        }
-        
-        session = requests.Session()
+def fetch_page(url, use_cache=True, max_age=0, defer_provisional=False):
+    """Fetch and clean a single page, recording how long each step took.
+
+    Results are shared across sessions through the process-wide page cache.
+    Pages known from earlier runs are reused as-is when seen within max_age
+    seconds and are otherwise revalidated with a conditional request, so an
+    unchanged page is neither downloaded nor cleaned again. page['crawl'] says
+    whether the page is new, changed or unchanged since the last run.
+    With defer_provisional, pages cleaned before their site's template was
+    learned carry page['provisional'] and are not stored until the run
+    calls reclean_provisional(); single-page callers get them stored as cleaned.
+    """
+    if use_cache:
+        cached = page_cache().get(url)
+        if cached is not None:
+            return dict(cached, timings=dict(cached['timings'], cached=True))
+    
+    crawl_state = get_crawl_state()
+    # Recorded and replayed runs always request the page, so the archive
+    # holds full responses and a replay doesn't depend on earlier runs
+    known = crawl_state.get_page(url) if use_cache and warc_fetch.SCRAPE_MODE == 'live' else None
+    if known and known['content'] is None:
+        known = None
+    
+    headers = {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+        'Accept-Language': 'en-US,en;q=0.5',
+        'Referer': 'https://www.google.com/',
+        'DNT': '1',
+        'Connection': 'keep-alive',
+        'Upgrade-Insecure-Requests': '1',
+        'Cache-Control': 'max-age=0',
+    }
+    if known:
+        if known['etag']:
+            headers['If-None-Match'] = known['etag']
+        if known['last_modified']:
+            headers['If-Modified-Since'] = known['last_modified']
+    
+    start = time.perf_counter()
+    if known and time.time() - known['last_seen'] < max_age:
+        response = None
+    else:
+        session = get_session()
         try:
             # Try with a timeout first
-            response = session.get(url, headers=headers, timeout=10)
+            response = http_get(session, url, headers=headers, timeout=10)
             response.raise_for_status()
         except (requests.exceptions.Timeout, requests.exceptions.HTTPError) as e:
             # If timeout or HTTP error occurs, try once more with a longer timeout
             st.warning(f"Initial request failed, retrying: {str(e)}")
-            response = session.get(url, headers=headers, timeout=20)
+            response = http_get(session, url, headers=headers, timeout=20)
             response.raise_for_status()
+    fetched = time.perf_counter()
+    
+    if response is None or response.status_code == 304:
+        if response is not None:
+            crawl_state.touch(url)
+        page = {
+            'url': url,
+            'title': known['title'],
+            'content': known['content'],
+            'crawl': 'unchanged',
+            'timings': {
+                'fetch': round(fetched - start, 3),
+                'clean': 0.0,
+                'index': 0.0,
+            }
+        }
+    else:
+        current_token().check()
+        processed_content = clean_html_content(response.text, url)
+        cleaned = time.perf_counter()
         
-        processed_content = clean_html_content(response.text)
-        
-        doc = SimpleDocTemplate(
-            output_path,
-            pagesize=letter,
-            rightMargin=72,
-            leftMargin=72,
-            topMargin=72,
-            bottomMargin=72
-        )
-        
-        title_style = ParagraphStyle(
-            'TitleStyle',
-            fontSize=16,
-            leading=20,
-            textColor=colors.darkblue,
-            spaceAfter=12
-        )
-        
-        normal_style = ParagraphStyle(
-            'NormalStyle',
-            fontSize=11,
-            leading=14,
-            spaceAfter=6
-        )
-        
-        url_style = ParagraphStyle(
-            'URLStyle',
-            fontSize=9,
-            leading=12,
-            textColor=colors.darkblue,
-            spaceAfter=12
-        )
-        
-        story = []
-        
-        story.append(Paragraph(processed_content['title'], title_style))
-        story.append(Spacer(1, 0.25*inch))
-        
-        story.append(Paragraph(f"Source: {url}", url_style))
-        story.append(Spacer(1, 0.25*inch))
-        
-        paragraphs = processed_content['content'].split('\n\n')
-        for para in paragraphs:
-            if para.strip():
-                # Skip image placeholders with no useful text
-                if '![' in para and len(para.replace('![', '').strip()) < 5:
-                    continue
-                
-                # Fix encoding issues that might occur
-                para = para.encode('utf-8', 'ignore').decode('utf-8')
-                
-                if para.startswith('# '):
-                    header_style = ParagraphStyle(
-                        'Header1Style',
-                        fontSize=14,
-                        leading=18,
-                        textColor=colors.darkblue,
-                        spaceAfter=10
-                    )
-                    story.append(Paragraph(para.replace('# ', ''), header_style))
-                elif para.startswith('## '):
-                    header_style = ParagraphStyle(
-                        'Header2Style',
-                        fontSize=12,
-                        leading=16,
-                        textColor=colors.darkblue,
-                        spaceAfter=8
-                    )
-                    story.append(Paragraph(para.replace('## ', ''), header_style))
-                else:
-                    # Clean up markdown formatting for better PDF display
-                    para = re.sub(r'\[(.*?)\]\(.*?\)', r'\1', para)  # Remove hyperlinks but keep text
-                    para = para.replace('**', '').replace('*', '').replace('__', '').replace('_', '')
-                    
-                    # Wrap paragraphs in try/except to handle any PDF generation errors
-                    try:
-                        story.append(Paragraph(para, normal_style))
-                    except Exception as e:
-                        st.warning(f"Error adding paragraph to PDF: {e}")
-                        # Try a simplified version without special characters
-                        simplified = re.sub(r'[^\x00-\x7F]+', ' ', para)
-                        story.append(Paragraph(simplified, normal_style))
+        index_page(url, processed_content['content'])
+        indexed = time.perf_counter()
         
-        doc.build(story)
+        page = {
+            'url': url,
+            'title': processed_content['title'],
+            'content': processed_content['content'],
+            'timings': {
+                'fetch': round(fetched - start, 3),
+                'clean': round(cleaned - fetched, 3),
+                'index': round(indexed - cleaned, 3),
+            }
+        }
+        etag, last_modified = response.headers.get('ETag'), response.headers.get('Last-Modified')
+        if processed_content['provisional'] and defer_provisional:
+            # Kept out of the crawl state and the shared cache until it is cleaned again
+            page['crawl'] = 'changed' if known else 'new'
+            page['provisional'] = {'html': response.text, 'etag': etag, 'last_modified': last_modified}
+            return page
+        page['crawl'] = crawl_state.record_page(url, page['title'], page['content'], etag, last_modified)
+    if use_cache:
+        page_cache().set(url, page, len(page['content']) + len(page['title']))
+        page = dict(page, timings=dict(page['timings']))
+    return page
+
+def save_as_pdf(url, output_path):
+    try:
+        page = fetch_page(url)
+        build_pdf(output_path, page['title'], url, page['content'])
         return True
     except Exception as e:
         st.error(f"Error saving {url} as PDF: {e}")
         return False
 
-def extract_article_links(main_url):
+def save_page(url, writer, name, manifest=None, role='article', index=None, duplicates=None):
+    """Fetch url, hand it to writer and record the outcome in the run manifest.
+
+    With a NearDuplicateDetector, pages whose content is a near-copy of one
+    already saved in the run are recorded as duplicates and not written.
+    """
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-            'Accept-Language': 'en-US,en;q=0.5',
-            'DNT': '1',
-            'Connection': 'keep-alive',
-            'Upgrade-Insecure-Requests': '1',
-        }
-        
-        session = requests.Session()
+        # The listing page is always revalidated; known articles rarely change
+        page = fetch_page(url, max_age=RECRAWL_AFTER if role == 'article' else 0, defer_provisional=True)
+        duplicate_of = duplicates.check(url, page['content']) if duplicates is not None else None
+        if duplicate_of is not None:
+            if manifest is not None:
+                manifest.record_duplicate(url, duplicate_of, page['content'], role=role, index=index)
+            return None
+        # Rendering is the slowest local step; don't start it for a cancelled run
+        current_token().check()
+        artifact = writer.write(page, name)
+    except Exception as e:
+        st.error(f"Error saving {url}: {e}")
+        if manifest is not None:
+            manifest.record_failure(url, e, role=role, index=index)
+        return None
+    
+    if manifest is not None:
+        manifest.record_page(page, artifact, role=role, index=index)
+    return page
+
+def reclean_provisional(pages, manifest, writer):
+    """Clean provisional pages of a run again, now that more of their site has been seen.
+
+    Each page is cleaned from its stored HTML with the template learned from
+    the whole run, then stored, indexed and cached. Pages whose content
+    changed are written again under the same artifact name and re-recorded
+    in the manifest; stream writers get a second record, and as in the
+    manifest's spill file the later record for a URL wins. Pages of sites
+    still too small for a template are stored as they are.
+    """
+    crawl_state = get_crawl_state()
+    for page in pages:
+        raw = page.pop('provisional', None)
+        entry = manifest.get(page['url'])
+        if raw is None or entry is None or entry['status'] != 'ok':
+            continue
         try:
-            response = session.get(main_url, headers=headers, timeout=15)
-            response.raise_for_status()
+            processed_content = clean_html_content(raw['html'], page['url'])
+            changed = processed_content['content'] != page['content']
+            page['title'], page['content'] = processed_content['title'], processed_content['content']
+            if changed:
+                index_page(page['url'], page['content'])
+            page['crawl'] = crawl_state.record_page(page['url'], page['title'], page['content'],
+                                                    raw['etag'], raw['last_modified'])
+            page_cache().set(page['url'], page, len(page['content']) + len(page['title']))
+            if changed:
+                name = manifest.artifact_name(page['url'], entry['role'], entry['index'])
+                artifact = writer.write(page, name)
+                manifest.record_page(page, artifact, role=entry['role'], index=entry['index'])
         except Exception as e:
-            st.warning(f"Initial request failed, retrying: {str(e)}")
-            # If the first attempt fails, try with a longer timeout
-            response = session.get(main_url, headers=headers, timeout=30)
-            response.raise_for_status()
-        
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        article_links = []
+            st.warning(f"Could not clean {page['url']} again: {e}")
+
+def fetch_listing(main_url):
+    """The parsed listing page, retried once with a longer timeout"""
+    # The sitemap dates rank the listing's links; read them while it downloads
+    prefetch_sitemap(main_url)
+    headers = {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+        'Accept-Language': 'en-US,en;q=0.5',
+        'DNT': '1',
+        'Connection': 'keep-alive',
+        'Upgrade-Insecure-Requests': '1',
+    }
+    
+    session = get_session()
+    try:
+        response = http_get(session, main_url, headers=headers, timeout=15)
+        response.raise_for_status()
+    except Exception as e:
+        st.warning(f"Initial request failed, retrying: {str(e)}")
+        # If the first attempt fails, try with a longer timeout
+        response = http_get(session, main_url, headers=headers, timeout=30)
+        response.raise_for_status()
+    
+    return BeautifulSoup(decode_html(response), 'html.parser')
+
+def find_article_links(soup, main_url):
+    """Ranked article URLs linked from a parsed listing page"""
+    article_links = []
+    
+    # Common CSS selectors for blog articles
+    article_selectors = [
+        'article a', '.post a', '.article a', '.entry a', 
+        'a.article', 'a.post', '.news-item a', '.blog-post a',
+        '.content a', '.card a', '.entry-title a', 
+        'h2 a', 'h3 a', '.blog-entry a', '.post-title a',
+        '.blog-list__item a', '.blog-card a',
+        '.resource-card a', '.blog-content a',
+        '.title a', '.headline a'
+    ]
+    
+    # Try each selector to find article links
+    for selector in article_selectors:
+        links = soup.select(selector)
+        for link in links:
+            if 'href' in link.attrs:
+                full_url = urljoin(main_url, link['href'])
+                # Only include links from the same domain and not already in our list
+                if urlparse(full_url).netloc == urlparse(main_url).netloc and full_url not in article_links:
+                    # Exclude category, tag, author, and common non-article pages
+                    excluded_patterns = ['/category/', '/tag/', '/author/', '/page/', '/wp-content/', 
+                                       '/feed/', '/comments/', '/trackback/', '/wp-json/', 
+                                       '/wp-admin/', '/login/', '/register/', '/search/']
+                    
+                    if not any(pattern in full_url for pattern in excluded_patterns):
+                        article_links.append(full_url)
+    
+    # If no links found with selectors, try a more generic approach
+    if not article_links:
+        all_links = soup.find_all('a')
+        base_domain = urlparse(main_url).netloc
         
-        # Common CSS selectors for blog articles
-        article_selectors = [
-            'article a', '.post a', '.article a', '.entry a', 
-            'a.article', 'a.post', '.news-item a', '.blog-post a',
-            '.content a', '.card a', '.entry-title a', 
-            'h2 a', 'h3 a', '.blog-entry a', '.post-title a',
-            '.blog-list__item a', '.blog-card a',
-            '.resource-card a', '.blog-content a',
-            '.title a', '.headline a'
+        # Look for URLs that match common blog post patterns
+        blog_patterns = [
+            r'/(blog|article|post|news)/',  # Common blog URL patterns
+            r'/\d{4}/\d{2}/',  # Date-based archives (common in WordPress)
+            r'/[^/]+/[^/]+/$',  # Simple slug pattern (for blogs with direct slugs)
         ]
         
-        # Try each selector to find article links
-        for selector in article_selectors:
-            links = soup.select(selector)
-            for link in links:
-                if 'href' in link.attrs:
-                    full_url = urljoin(main_url, link['href'])
-                    # Only include links from the same domain and not already in our list
-                    if urlparse(full_url).netloc == urlparse(main_url).netloc and full_url not in article_links:
-                        # Exclude category, tag, author, and common non-article pages
-                        excluded_patterns = ['/category/', '/tag/', '/author/', '/page/', '/wp-content/', 
-                                           '/feed/', '/comments/', '/trackback/', '/wp-json/', 
-                                           '/wp-admin/', '/login/', '/register/', '/search/']
-                        
-                        if not any(pattern in full_url for pattern in excluded_patterns):
-                            article_links.append(full_url)
-        
-        # If no links found with selectors, try a more generic approach
-        if not article_links:
-            all_links = soup.find_all('a')
-            base_domain = urlparse(main_url).netloc
-            
-            # Look for URLs that match common blog post patterns
-            blog_patterns = [
-                r'/(blog|article|post|news)/',  # Common blog URL patterns
-                r'/\d{4}/\d{2}/',  # Date-based archives (common in WordPress)
-                r'/[^/]+/[^/]+/$',  # Simple slug pattern (for blogs with direct slugs)
-            ]
-            
-            for link in all_links:
-                if 'href' in link.attrs:
-                    full_url = urljoin(main_url, link['href'])
-                    if urlparse(full_url).netloc == base_domain:
-                        path = urlparse(full_url).path
-                        
-                        # Check if the URL matches any of our blog patterns
-                        if any(re.search(pattern, path) for pattern in blog_patterns):
-                            # Don't add duplicates
-                            if full_url not in article_links:
-                                # Exclude common non-article pages
-                                excluded_patterns = ['/category/', '/tag/', '/author/', '/page/', '/wp-content/',
-                                                   '/feed/', '/comments/', '/trackback/', '/wp-json/',
-                                                   '/wp-admin/', '/login/', '/register/', '/search/']
-                                
-                                if not any(pattern in full_url for pattern in excluded_patterns):
-                                    article_links.append(full_url)
-        
-        return list(set(article_links))
+        for link in all_links:
+            if 'href' in link.attrs:
+                full_url = urljoin(main_url, link['href'])
+                if urlparse(full_url).netloc == base_domain:
+                    path = urlparse(full_url).path
+                    
+                    # Check if the URL matches any of our blog patterns
+                    if any(re.search(pattern, path) for pattern in blog_patterns):
+                        # Don't add duplicates
+                        if full_url not in article_links:
+                            # Exclude common non-article pages
+                            excluded_patterns = ['/category/', '/tag/', '/author/', '/page/', '/wp-content/',
+                                               '/feed/', '/comments/', '/trackback/', '/wp-json/',
+                                               '/wp-admin/', '/login/', '/register/', '/search/']
+                            
+                            if not any(pattern in full_url for pattern in excluded_patterns):
+                                article_links.append(full_url)
     
+    # Best articles first (recent, descriptive anchor, prominent on the
+    # page) so a fetch budget is spent on them, in the same order every run
+    article_links = list(dict.fromkeys(article_links))
+    return [link['url'] for link in rank_links(main_url, link_candidates(soup, main_url, article_links))]
+
+def extract_article_links(main_url):
+    try:
+        return find_article_links(fetch_listing(main_url), main_url)
     except Exception as e:
         st.error(f"Error extracting article links: {e}")
         return []
 
-def scrape_website_and_articles(main_url, output_dir):
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-    
-    main_page_filename = f"main_{get_safe_filename(main_url)}"
-    if not main_page_filename.endswith('.pdf'):
-        main_page_filename += '.pdf'
-    main_page_path = os.path.join(output_dir, main_page_filename)
-    
-    main_page_saved = save_as_pdf(main_url, main_page_path)
-    if not main_page_saved:
-        st.warning("Failed to save the main webpage, but will attempt to continue with articles.")
-    
-    article_links = extract_article_links(main_url)
-    
-    # Filter out category and tag links
-    article_links = [url for url in article_links if '/category/' not in url and '/tag/' not in url]
+def scrape_website_and_articles(main_url, output_dir, writer=None, manifest=None):
+    # PDFs remain the default artifact; bulk runs pass a JSONL/Markdown/archive writer
+    # and keep ownership of it so several sites can share one output stream
+    owns_writer = writer is None
+    if owns_writer:
+        writer = PdfWriter(output_dir)
+    if manifest is None:
+        manifest = RunManifest(main_url)
+    duplicates = NearDuplicateDetector()
+    provisional = []
     
-    st.info(f"Found {len(article_links)} article links.")
-    
-    # Process a limited number of articles to avoid timeouts
-    max_to_process = min(10, len(article_links))
-    successful_articles = 0
-    
-    for i in range(max_to_process):
-        try:
-            article_url = article_links[i]
-            
-            article_filename = f"article_{i+1}_{get_safe_filename(article_url)}"
-            if not article_filename.endswith('.pdf'):
-                article_filename += '.pdf'
-            article_path = os.path.join(output_dir, article_filename)
-            
-            success = save_as_pdf(article_url, article_path)
-            if success:
+    try:
+        main_page_saved = save_page(main_url, writer, manifest.artifact_name(main_url, 'main'),
+                                    manifest, role='main', duplicates=duplicates)
+        if main_page_saved and 'provisional' in main_page_saved:
+            provisional.append(main_page_saved)
+        if not main_page_saved:
+            st.warning("Failed to save the main webpage, but will attempt to continue with articles.")
+        
+        article_links = extract_article_links(main_url)
+        
+        # Filter out category and tag links
+        article_links = [url for url in article_links if '/category/' not in url and '/tag/' not in url]
+        
+        st.info(f"Found {len(article_links)} article links.")
+        
+        # Process a limited number of articles to avoid timeouts; near-duplicates
+        # don't use up a slot
+        max_to_process = min(10, len(article_links))
+        attempted = 0
+        successful_articles = 0
+        
+        for article_url in article_links:
+            if attempted >= max_to_process:
+                break
+            i = attempted
+            page = save_page(article_url, writer, manifest.artifact_name(article_url, index=i), manifest, index=i,
+                             duplicates=duplicates)
+            if page:
                 successful_articles += 1
+                if 'provisional' in page:
+                    provisional.append(page)
+            if (manifest.get(article_url) or {}).get('status') != 'duplicate':
+                attempted += 1
             
             # Add a small delay between requests to be respectful to the server
-            time.sleep(random.uniform(1, 2))
-        except Exception as e:
-            st.error(f"Error processing article {i+1}: {e}")
-            continue
+            polite_delay(random.uniform(1, 2))
+        
+        reclean_provisional(provisional, manifest, writer)
+    finally:
+        if owns_writer:
+            writer.close()
     
     return successful_articles
 
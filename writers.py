@@ -0,0 +1,160 @@
+import os
+import io
+import json
+import gzip
+import time
+from urllib.parse import urlparse
+from pdf_export import render_pdf
+from shared_cache import render_cache, cache_key
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+class OutputWriter:
+    """Destination for pages produced by the scrape pipeline.
+
+    A page is the dict returned by web_scrape.fetch_page (url, title, content,
+    timings). write() returns the location of the artifact it produced.
+    """
+
+    def write(self, page, name):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class PdfWriter(OutputWriter):
+    """One PDF per page, the format the Gemini analysis consumes.
+
+    Rendered bytes are kept in the shared render cache, so a page another
+    session already converted is only copied to this writer's directory.
+    """
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        os.makedirs(output_dir, exist_ok=True)
+
+    def write(self, page, name):
+        if not name.endswith('.pdf'):
+            name += '.pdf'
+        path = os.path.join(self.output_dir, name)
+        start = time.perf_counter()
+        key = cache_key(page['title'], page['url'], page['content'])
+        data = render_cache().get(key)
+        if data is None:
+            data = render_pdf(page['title'], page['url'], page['content'])
+            render_cache().set(key, data, len(data))
+        with open(path, 'wb') as f:
+            f.write(data)
+        page['timings']['render'] = round(time.perf_counter() - start, 3)
+        return path
+
+class MarkdownWriter(OutputWriter):
+    """One plain Markdown file per page"""
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        os.makedirs(output_dir, exist_ok=True)
+
+    def write(self, page, name):
+        if not name.endswith('.md'):
+            name += '.md'
+        path = os.path.join(self.output_dir, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(f"# {page['title']}\n\nSource: {page['url']}\n\n{page['content']}")
+        return path
+
+class JsonlWriter(OutputWriter):
+    """One JSON record per page, appended sequentially to a single stream.
+
+    Accepts a path or an already open text stream (e.g. sys.stdout); streams
+    passed in are flushed but not closed.
+    """
+
+    def __init__(self, target):
+        if isinstance(target, (str, os.PathLike)):
+            self.path = str(target)
+            self.stream = open(target, 'a', encoding='utf-8')
+            self.owns_stream = True
+        else:
+            self.path = getattr(target, 'name', '<stream>')
+            self.stream = target
+            self.owns_stream = False
+        self.count = 0
+
+    def write(self, page, name):
+        record = {
+            'url': page['url'],
+            'title': page['title'],
+            'content': page['content'],
+            'timings': page['timings'],
+        }
+        self.stream.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self.count += 1
+        return f"{self.path}#{self.count}"
+
+    def close(self):
+        if self.owns_stream:
+            self.stream.close()
+        else:
+            self.stream.flush()
+
+class ArchiveWriter(JsonlWriter):
+    """JSONL records for a whole site in one compressed file.
+
+    Uses zstd when the zstandard package is installed and the path ends in
+    .zst, gzip otherwise.
+    """
+
+    def __init__(self, path):
+        if path.endswith('.zst'):
+            if zstandard is None:
+                raise ImportError("zstandard is required for .zst archives; use a .gz path instead")
+            self.raw = open(path, 'wb')
+            binary = zstandard.ZstdCompressor(level=10).stream_writer(self.raw)
+        else:
+            self.raw = None
+            binary = gzip.open(path, 'wb')
+        super().__init__(io.TextIOWrapper(binary, encoding='utf-8'))
+        self.path = path
+        self.owns_stream = True
+
+    def close(self):
+        super().close()
+        if self.raw is not None and not self.raw.closed:
+            self.raw.close()
+
+def site_slug(site_url):
+    netloc = urlparse(site_url).netloc
+    return "".join(c if c.isalnum() or c == '-' else '_' for c in netloc) or 'site'
+
+def archive_path(output_dir, site_url):
+    """Default archive location for a site, preferring zstd when available"""
+    extension = '.jsonl.zst' if zstandard is not None else '.jsonl.gz'
+    return os.path.join(output_dir, site_slug(site_url) + extension)
+
+WRITERS = {
+    'pdf': PdfWriter,
+    'markdown': MarkdownWriter,
+    'jsonl': JsonlWriter,
+    'archive': ArchiveWriter,
+}
+
+def get_writer(kind, output_dir, site_url=None):
+    if kind not in WRITERS:
+        raise ValueError(f"Unknown output format '{kind}'. Choose one of: {', '.join(WRITERS)}")
+
+    os.makedirs(output_dir, exist_ok=True)
+    if kind == 'jsonl':
+        return JsonlWriter(os.path.join(output_dir, 'pages.jsonl'))
+    if kind == 'archive':
+        return ArchiveWriter(archive_path(output_dir, site_url or ''))
+    return WRITERS[kind](output_dir)